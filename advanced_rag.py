@@ -1,14 +1,35 @@
 import os
-from typing import List, Optional
-import openai
+import time
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
 # from dotenv import load_dotenv
-import streamlit as st
-from streamlit_chat import message
-import tempfile
 import sys
 import hashlib
-import numpy as np
-from io import BytesIO
+import uuid
+import asyncio
+import copy
+import logging
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from document_pipeline import iter_document_chunks
+from metrics import metrics
+from process_resources import get_async_client, get_client, get_resilience, get_setting, process_singleton
+from resource_manager import SHARED_OWNER
+
+if TYPE_CHECKING:
+    from answer_cache import AnswerCache
+    from async_queries import QueryExecutor, QueryHandle
+    from document_registry import DocumentRegistry
+    from embedding_service import EmbeddingService
+    from ingestion_jobs import IngestionJobs
+    from model_router import ModelRouter, Route, Tier
+    from openai.types.beta.threads import Message
+    from resilience import Resilience
+    from resource_manager import ResourceManager
+    from retrieval import RetrievalEngine, SearchResult
+    from single_flight import SingleFlight
+    from speech_cache import SpeechCache
+    from speech_pipeline import SpeechPipeline
 
 # Streamlit Cloud Ready: This code is optimized for deployment on Streamlit Cloud.
 # Audio recorder feature temporarily removed for Streamlit Cloud compatibility.
@@ -23,262 +44,1245 @@ from io import BytesIO
 # thread_id = os.getenv("THREAD_ID")
 # vector_store_id = os.getenv("VECTOR_STORE_ID")
 
-api_key = st.secrets["OPENAI_API_KEY"]
-assistant_id = st.secrets["ASSISTANT_ID"]
-# Removed vector_store_id from secrets
+# Importing this module is cheap and needs no secrets: the OpenAI client (process_resources.get_client),
+# NumPy and Streamlit are only loaded when first used. Settings come from the environment or st.secrets.
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Process-wide local chunk index over every uploaded file, searched per session by file_id.
+# It is persisted as a memory-mapped int8 file so restarts and sibling workers reuse it,
+# and large segments are searched through an IVF index probing ANN_NPROBE lists.
+INDEX_PATH = os.environ.get(
+    "RAG_INDEX_PATH",
+    os.path.join(os.path.expanduser("~"), ".openai_rag", "chunks.idx")
+)
+ANN_NPROBE = int(os.environ.get("RAG_ANN_NPROBE", "8"))
+# Local indexing is opt-in. It runs as a background job after the upload, so a document is ready
+# as soon as its OpenAI vector store is, and local search sees it once the job finishes
+LOCAL_INDEX = os.environ.get("RAG_LOCAL_INDEX", "").lower() in ("1", "true", "yes")
+
+# Upper bound on how long a single assistant run may stream before it is cancelled
+RUN_TIMEOUT_SECONDS = 60
+_RUN_ENDED = ("thread.run.completed", "thread.run.failed", "thread.run.cancelled", "thread.run.expired",
+              "thread.run.incomplete")
+# A thread refuses new messages until its latest run has left these statuses; a cancelled run stays
+# "cancelling" for a while. Polled with backoff for up to RUN_SETTLE_TIMEOUT_SECONDS.
+_RUN_ACTIVE = ("queued", "in_progress", "requires_action", "cancelling")
+RUN_SETTLE_POLL_SECONDS = 0.1
+RUN_SETTLE_TIMEOUT_SECONDS = 30
+# Shown in place of an answer while a circuit breaker is open
+ASSISTANT_UNAVAILABLE = "[Assistant temporarily unavailable]"
+# Model of assistants created by create_assistant; runs may override it per question (model_router)
+ASSISTANT_MODEL = os.environ.get("RAG_ASSISTANT_MODEL", "gpt-4-1106-preview")
+
+# Concurrent file uploads per add_documents call, and the API limit on files per vector-store batch
+MAX_UPLOAD_WORKERS = 8
+FILE_BATCH_LIMIT = 500
+
+# Vector-store indexing is polled with exponential backoff until every file has settled
+INDEX_POLL_SECONDS = 0.5
+INDEX_POLL_MAX_SECONDS = 5.0
+INDEX_TIMEOUT_SECONDS = 600
+
+# WAV recordings longer than this are split at silences and transcribed in parallel
+LONG_AUDIO_SECONDS = 90
+MAX_TRANSCRIBE_WORKERS = 16
+
+TTS_MODEL = "tts-1"
+
+# Runs see only the last CONTEXT_MESSAGES messages of the thread (0 lets the API truncate automatically),
+# so per-turn latency and token cost stay flat however long the conversation gets
+CONTEXT_MESSAGES = int(os.environ.get("RAG_CONTEXT_MESSAGES", "20"))
+MESSAGE_PAGE_SIZE = 100
+# Chat turns kept in the Streamlit session; older ones drop off the ring buffer
+MESSAGE_HISTORY_LIMIT = 200
+
+
+@process_singleton
+def get_registry() -> "DocumentRegistry":
+    # Content-addressed registry of uploaded documents, shared across sessions and processes
+    from document_registry import DocumentRegistry
+    return DocumentRegistry()
+
+
+@process_singleton
+def get_embedder() -> "EmbeddingService":
+    # Token-budgeted batches, bounded concurrency, rate-limit backoff and de-duplication of inputs;
+    # shared by the answer cache and the retriever. get_embedder().stats() reports throughput.
+    from embedding_service import EmbeddingService
+    return EmbeddingService(get_client, model=EMBEDDING_MODEL)
+
+
+@process_singleton
+def get_answer_cache() -> "AnswerCache":
+    # Process-wide cache of answers per (vector store, question); near-duplicates match by embedding
+    from answer_cache import AnswerCache
+    return AnswerCache(embedder=get_embedder())
+
+
+@process_singleton
+def get_single_flight() -> "SingleFlight":
+    # Identical questions on the same vector store that are asked while one is being answered share its run
+    from single_flight import SingleFlight
+    return SingleFlight()
+
+
+@process_singleton
+def get_router() -> "ModelRouter":
+    # Tiers from RAG_MODEL_TIERS; each question's run goes to the fastest tier its signals allow
+    from model_router import ModelRouter
+    return ModelRouter()
+
+
+@process_singleton
+def get_retriever() -> "RetrievalEngine":
+    from retrieval import RetrievalEngine
+    return RetrievalEngine(embedder=get_embedder(), index_path=INDEX_PATH, ann="ivf", nprobe=ANN_NPROBE)
+
+
+@process_singleton
+def get_resources() -> "ResourceManager":
+    # Ledger of every thread and vector store created, threads reserved per store, and the sweeper
+    # that deletes released and expired ones every RAG_SWEEP_INTERVAL_SECONDS
+    from resource_manager import ResourceManager
+    manager = ResourceManager(get_client, registry=get_registry())
+    manager.start_sweeper()
+    return manager
 
-if not api_key:
-    st.error("OpenAI API key not found. Please add it to your Streamlit Cloud secrets.")
-    st.stop()
 
-# Initialize OpenAI client
-client = openai.OpenAI(api_key=api_key)
+@process_singleton
+def get_speech_cache() -> "SpeechCache":
+    # Synthesized clips on disk, bounded by RAG_SPEECH_CACHE_MB and shared by every session
+    from speech_cache import SpeechCache
+    return SpeechCache()
+
+
+@process_singleton
+def get_ingestion_jobs() -> "IngestionJobs":
+    # Background worker pool for uploads and indexing, so Streamlit reruns never block on them
+    from ingestion_jobs import IngestionJobs
+    return IngestionJobs()
+
+
+@process_singleton
+def get_query_executor() -> "QueryExecutor":
+    # Event loop thread that streams every session's runs on the async client, RAG_MAX_INFLIGHT_RUNS at a time
+    from async_queries import QueryExecutor
+    return QueryExecutor()
+
+
+def _ignore_progress(message: str) -> None:
+    pass
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+async def _drain(stream: AsyncIterator[str], deltas: "asyncio.Queue") -> None:
+    # Runs a stream as its own task; None marks its end, whether it finished or failed
+    try:
+        async for delta in stream:
+            deltas.put_nowait(delta)
+    finally:
+        deltas.put_nowait(None)
+
+
+def _report(level: str, text: str) -> None:
+    # Surface problems in the app when called from a Streamlit script, and in the log everywhere else;
+    # st.* calls from worker threads have no page to render on and are dropped, so a background
+    # ingestion job keeps them for the UI to show once the job finishes
+    st = sys.modules.get("streamlit")
+    if st is not None and st.runtime.exists():
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        if get_script_run_ctx(suppress_warning=True) is not None:
+            getattr(st, level)(text)
+            return
+    getattr(logger, level)(text)
+    jobs = sys.modules.get("ingestion_jobs")
+    job = jobs.current_job() if jobs is not None else None
+    if job is not None:
+        job.warn(text)
+
+
+class RunTracker:
+    # Times one streamed assistant run from its events: queueing, every run step (file_search tool
+    # calls, message creation), the first token and the total, plus token usage once it completes
+    def __init__(self, on_started: Optional[Callable[[float], None]] = None):
+        self.started = time.perf_counter()
+        self.stats = {"queued_ms": None, "first_token_ms": None, "total_ms": None, "steps": [], "usage": None}
+        self._step_started = {}
+        # Called with the seconds the run was queued, when it starts
+        self._on_started = on_started
+
+    def on_event(self, event) -> str:
+        # Returns the answer text carried by the event, if any
+        now = time.perf_counter()
+        text = ""
+        if event.event == "thread.message.delta":
+            text = "".join(part.text.value for part in event.data.delta.content or []
+                           if part.type == "text" and part.text and part.text.value)
+            if text and self.stats["first_token_ms"] is None:
+                self.stats["first_token_ms"] = _ms(now - self.started)
+                metrics.record("run.first_token", now - self.started)
+        elif event.event == "thread.run.in_progress" and self.stats["queued_ms"] is None:
+            self.stats["queued_ms"] = _ms(now - self.started)
+            metrics.record("run.queued", now - self.started)
+            if self._on_started is not None:
+                self._on_started(now - self.started)
+        elif event.event == "thread.run.step.created":
+            self._step_started[event.data.id] = now
+        elif event.event in ("thread.run.step.completed", "thread.run.step.failed"):
+            step = event.data
+            seconds = now - self._step_started.pop(step.id, now)
+            name = step.type
+            if step.type == "tool_calls":
+                name = "+".join(sorted({call.type for call in step.step_details.tool_calls})) or name
+            self.stats["steps"].append({"step": name, "ms": _ms(seconds), "status": step.status})
+            metrics.record(f"run.step.{name}", seconds, "ok" if step.status == "completed" else "error")
+        return text
+
+    def finish(self, run) -> None:
+        elapsed = time.perf_counter() - self.started
+        self.stats["total_ms"] = _ms(elapsed)
+        metrics.record("run.total", elapsed, "ok" if run.status == "completed" else run.status)
+        if run.usage is not None:
+            self.stats["usage"] = {"prompt_tokens": run.usage.prompt_tokens,
+                                   "completion_tokens": run.usage.completion_tokens}
+            metrics.tokens.inc(run.usage.prompt_tokens, kind="prompt")
+            metrics.tokens.inc(run.usage.completion_tokens, kind="completion")
+
+    def abandon(self, status: str) -> None:
+        metrics.record("run.total", time.perf_counter() - self.started, status)
+
 
 class AdvancedRAG:
-    def __init__(self):
+    def __init__(self, registry: Optional["DocumentRegistry"] = None, answer_cache: Optional["AnswerCache"] = None,
+                 retriever: Optional["RetrievalEngine"] = None, speech_cache: Optional["SpeechCache"] = None,
+                 resources: Optional["ResourceManager"] = None, single_flight: Optional["SingleFlight"] = None,
+                 router: Optional["ModelRouter"] = None, resilience: Optional["Resilience"] = None,
+                 context_messages: int = CONTEXT_MESSAGES, local_index: bool = LOCAL_INDEX):
+        self.registry = registry if registry is not None else get_registry()
+        self.answer_cache = answer_cache if answer_cache is not None else get_answer_cache()
+        self.retriever = retriever if retriever is not None else get_retriever()
+        self.speech_cache = speech_cache if speech_cache is not None else get_speech_cache()
+        self.resources = resources if resources is not None else get_resources()
+        self.single_flight = single_flight if single_flight is not None else get_single_flight()
+        self.router = router if router is not None else get_router()
+        self.resilience = resilience if resilience is not None else get_resilience()
+        # Owner of the threads and private vector stores this session creates, in the resource ledger
+        self.session_id = uuid.uuid4().hex
         self.vector_store_id: Optional[str] = None  # No longer from secrets
         self.file_ids: List[str] = []
+        # Stores created by upload_document are shared via the registry and never modified in place
+        self.owns_vector_store = False
         self.thread_id: Optional[str] = None
-        self.assistant_id: Optional[str] = assistant_id
+        self.assistant_id: Optional[str] = get_setting("ASSISTANT_ID")
+        self.context_messages = context_messages
+        self.local_index = local_index
+        # Cursor into the thread: the newest message this session has already seen
+        self.last_message_id: Optional[str] = None
+        # The assistant message the latest run posted, if any; only this is deleted when an answer is discarded
+        self.last_reply_id: Optional[str] = None
+        # Stage timings and token usage of the latest assistant run, for the metrics panel
+        self.last_run_stats: Optional[dict] = None
+
+    @property
+    def truncation_strategy(self) -> dict:
+        if self.context_messages > 0:
+            return {"type": "last_messages", "last_messages": self.context_messages}
+        return {"type": "auto"}
 
     def create_thread(self) -> str:
-        thread = client.beta.threads.create(
-            tool_resources={
-                "file_search": {
-                    "vector_store_ids": [self.vector_store_id]
-                }
-            }
-        )
-        self.thread_id = thread.id
+        # Usually a thread reserved in advance for this vector store, so no API call is made here
+        previous = self.thread_id
+        self.thread_id = self.resources.take_thread(self.vector_store_id, self.session_id,
+                                                    reserve=not self.owns_vector_store)
+        self.last_message_id = None
+        self.last_reply_id = None
+        if previous:
+            self.resources.release(previous)
         return self.thread_id
 
     def create_vector_store(self, name: str = "My Vector Store") -> str:
         try:
             # Create vector store
-            vector_store = client.vector_stores.create(name=name)
+            vector_store = self.resources.create_vector_store(self.session_id, name=name)
             self.vector_store_id = vector_store.id
             return self.vector_store_id
         except Exception as e:
-            st.error(f"Error creating vector store: {str(e)}")
+            _report("error", f"Error creating vector store: {str(e)}")
             raise
 
     def ensure_vector_store(self):
         # Try to use the current vector store, or create a new one if missing/invalid
         try:
             if not self.vector_store_id:
-                vector_store = client.vector_stores.create(name="knowledge_base")
+                vector_store = self.resources.create_vector_store(self.session_id)
                 self.vector_store_id = vector_store.id
             else:
                 # Try to retrieve the vector store to check if it exists
-                client.vector_stores.retrieve(self.vector_store_id)
+                get_client().vector_stores.retrieve(self.vector_store_id)
         except Exception:
             # If retrieval fails, create a new vector store
-            vector_store = client.vector_stores.create(name="knowledge_base")
+            vector_store = self.resources.create_vector_store(self.session_id)
             self.vector_store_id = vector_store.id
 
-    def upload_document(self, uploaded_file) -> str:
-        # Delete previous vector store if it exists
-        if self.vector_store_id:
+    def _vector_store_ready(self, vector_store_id: str) -> bool:
+        try:
+            vector_store = get_client().vector_stores.retrieve(vector_store_id)
+        except Exception:
+            return False
+        return vector_store.status != "expired"
+
+    @metrics.timed("index_locally")
+    def _index_locally(self, file_id: str, uploaded_file) -> bool:
+        if self.retriever.has_document(file_id):
+            return False
+        try:
+            # Pages are extracted, chunked and embedded as a stream, so memory stays flat
+            chunks = iter_document_chunks(uploaded_file.name, uploaded_file,
+                                          self.retriever.max_tokens, self.retriever.overlap_tokens)
+            return self.retriever.add_chunks(file_id, chunks) > 0
+        except Exception as e:
+            # Local search is best effort; the assistant still has the file through file_search
+            _report("warning", f"Could not index {uploaded_file.name} for local search: {e}")
+            return False
+
+    @metrics.timed("persist_index")
+    def _persist_index(self) -> None:
+        try:
+            self.retriever.persist()
+        except Exception as e:
+            _report("warning", f"Could not save the local search index: {e}")
+
+    def _index_documents(self, documents: List[Tuple[str, object]],
+                         progress: Callable[[str], None] = _ignore_progress) -> None:
+        indexed = False
+        for file_id, uploaded_file in documents:
+            progress(f"Indexing {uploaded_file.name} for local search")
+            indexed = self._index_locally(file_id, uploaded_file) or indexed
+        # One index save for the whole batch
+        if indexed:
+            self._persist_index()
+
+    def _index_in_background(self, documents: List[Tuple[str, object]]) -> None:
+        # Off the readiness path; jobs on the shared retriever run one at a time
+        documents = [(file_id, f) for file_id, f in documents if not self.retriever.has_document(file_id)]
+        if self.local_index and documents:
+            get_ingestion_jobs().submit("Indexing for local search", self._index_documents, documents,
+                                        key=self.retriever)
+
+    def _upload_file(self, uploaded_file, content_hash: Optional[str] = None,
+                     progress: Callable[[str], None] = _ignore_progress) -> str:
+        progress(f"Uploading {uploaded_file.name}")
+        return self._upload_to_openai(uploaded_file, content_hash)
+
+    def _upload_to_openai(self, uploaded_file, content_hash: Optional[str] = None) -> str:
+        content_hash = content_hash or file_hash(uploaded_file)
+        existing = self.registry.lookup(content_hash)
+        if existing:
+            return existing.file_id
+        # Stream the upload buffer straight to OpenAI; no temp file, no extra copy
+        uploaded_file.seek(0)
+        file_obj = get_client().files.create(
+            file=(uploaded_file.name, uploaded_file),
+            purpose="assistants"
+        )
+        entry = self.registry.register(content_hash, file_obj.id, name=uploaded_file.name)
+        if entry.file_id != file_obj.id:
+            # Another session registered the same bytes first; use its copy and drop ours
             try:
-                client.vector_stores.delete(self.vector_store_id)
+                get_client().files.delete(file_obj.id)
             except Exception as e:
-                st.warning(f"Could not delete previous vector store {self.vector_store_id}: {e}")
-        # Always create a new vector store for each upload
-        vector_store = client.vector_stores.create(name="knowledge_base")
-        self.vector_store_id = vector_store.id
-        self.file_ids = []
-        # Upload file to OpenAI
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as tmp:
-            tmp.write(uploaded_file.getvalue())
-            tmp.flush()
-            with open(tmp.name, "rb") as file:
-                file_obj = client.files.create(
-                    file=file,
-                    purpose="assistants"
-                )
-                self.file_ids.append(file_obj.id)
-                # Attach file to vector store
-                client.vector_stores.files.create(
-                    vector_store_id=self.vector_store_id,
-                    file_id=file_obj.id
-                )
-        # Always create a new thread for each upload
-        thread = client.beta.threads.create(
-            tool_resources={
-                "file_search": {
-                    "vector_store_ids": [self.vector_store_id]
-                }
-            }
-        )
-        self.thread_id = thread.id
-        return file_obj.id
+                _report("warning", f"Could not delete duplicate upload {file_obj.id}: {e}")
+        return entry.file_id
 
-    def search_similar_chunks(self, query: str, top_k: int = 3) -> list:
-        try:
-            # Add the message to the thread
-            client.beta.threads.messages.create(
-                thread_id=self.thread_id,
-                role="user",
-                content=query
+    def _wait_until_indexed(self, retrieve: Callable, describe: Callable[[object], str],
+                            progress: Callable[[str], None] = _ignore_progress):
+        # Poll a vector-store file or file batch until it leaves in_progress, backing off between polls
+        started = time.monotonic()
+        delay = INDEX_POLL_SECONDS
+        with metrics.span("vector_store.indexing"):
+            while True:
+                item = retrieve()
+                if item.status != "in_progress":
+                    return item
+                elapsed = time.monotonic() - started
+                if elapsed + delay > INDEX_TIMEOUT_SECONDS:
+                    raise Exception(f"Vector store indexing did not finish within {INDEX_TIMEOUT_SECONDS} seconds.")
+                progress(f"{describe(item)} ({elapsed:.0f}s)")
+                time.sleep(delay)
+                delay = min(delay * 2, INDEX_POLL_MAX_SECONDS)
+
+    def _index_file(self, vector_store_id: str, file_id: str, name: str,
+                    progress: Callable[[str], None] = _ignore_progress) -> None:
+        vs_file = get_client().vector_stores.files.create(
+            vector_store_id=vector_store_id,
+            file_id=file_id
+        )
+        if vs_file.status == "in_progress":
+            vs_file = self._wait_until_indexed(
+                lambda: get_client().vector_stores.files.retrieve(file_id=file_id, vector_store_id=vector_store_id),
+                lambda item: f"Indexing {name} in the vector store",
+                progress
             )
-            # Create a run
-            run = client.beta.threads.runs.create(
-                thread_id=self.thread_id,
-                assistant_id=self.assistant_id
+        if vs_file.status != "completed":
+            reason = f": {vs_file.last_error.message}" if vs_file.last_error else ""
+            raise Exception(f"Indexing {name} {vs_file.status}{reason}")
+
+    @metrics.timed("upload_document")
+    def upload_document(self, uploaded_file, progress: Callable[[str], None] = _ignore_progress) -> str:
+        file_id = self._use_registered_store(uploaded_file, progress)
+        # Always create a new thread for each upload
+        self.create_thread()
+        return file_id
+
+    def _use_registered_store(self, uploaded_file, progress: Callable[[str], None] = _ignore_progress) -> str:
+        # The session's knowledge base becomes this one document, on the vector store the registry shares
+        content_hash = file_hash(uploaded_file)
+        # Identical bytes were ingested before: reuse the file and its vector store
+        existing = self.registry.lookup(content_hash)
+        if existing and existing.vector_store_id:
+            if self._vector_store_ready(existing.vector_store_id):
+                self.vector_store_id = existing.vector_store_id
+                self.owns_vector_store = False
+                self.file_ids = [existing.file_id]
+                self._index_in_background([(existing.file_id, uploaded_file)])
+                return existing.file_id
+            self.registry.forget(content_hash)
+            self.resources.forget_store(existing.vector_store_id)
+        file_id = self._upload_file(uploaded_file, content_hash, progress)
+        self._index_in_background([(file_id, uploaded_file)])
+        # Vector stores are shared through the registry, so the previous one is left in place
+        vector_store = self.resources.create_vector_store(SHARED_OWNER)
+        # The session's thread is created while the file indexes
+        self.resources.prepare(vector_store.id)
+        # Attach file to vector store and wait until file_search can see it; only then is the store
+        # registered, so other sessions never reuse a store that is still indexing
+        self._index_file(vector_store.id, file_id, uploaded_file.name, progress)
+        entry = self.registry.register(content_hash, file_id, vector_store.id, uploaded_file.name)
+        if entry.vector_store_id != vector_store.id:
+            # Lost the race to index these bytes; the file itself is shared, only our store is redundant
+            # and goes with the next sweep
+            self.resources.release(vector_store.id)
+        self.vector_store_id = entry.vector_store_id
+        self.owns_vector_store = False
+        self.file_ids = [file_id]
+        return file_id
+
+    @metrics.timed("attach_files")
+    def _attach_files(self, file_ids: List[str],
+                      progress: Callable[[str], None] = _ignore_progress) -> Dict[str, str]:
+        # One batch request per FILE_BATCH_LIMIT files instead of one request per file; files the
+        # vector store failed to index are left out of the session and returned with the reason
+        failed = {}
+        for start in range(0, len(file_ids), FILE_BATCH_LIMIT):
+            batch_ids = file_ids[start:start + FILE_BATCH_LIMIT]
+            batch = get_client().vector_stores.file_batches.create(
+                vector_store_id=self.vector_store_id,
+                file_ids=batch_ids
             )
-            # Wait for the run to complete
-            import time
-            waited = 0
-            while True:
-                run_status = client.beta.threads.runs.retrieve(
-                    thread_id=self.thread_id,
-                    run_id=run.id
+            if batch.status == "in_progress":
+                vector_store_id, batch_id = self.vector_store_id, batch.id
+                batch = self._wait_until_indexed(
+                    lambda: get_client().vector_stores.file_batches.retrieve(batch_id, vector_store_id=vector_store_id),
+                    lambda item: f"Indexed {item.file_counts.completed} of {item.file_counts.total} files",
+                    progress
                 )
-                if run_status.status == 'completed':
-                    break
-                elif run_status.status == 'failed':
-                    raise Exception("Run failed")
-                time.sleep(0.2)
-                waited += 0.2
-                if waited > 60:
-                    raise Exception("Run timed out after 60 seconds.")
-            # Get the messages
-            messages = client.beta.threads.messages.list(
-                thread_id=self.thread_id
+            if batch.file_counts.failed:
+                for vs_file in get_client().vector_stores.file_batches.list_files(
+                        batch.id, vector_store_id=self.vector_store_id, filter="failed", limit=100):
+                    failed[vs_file.id] = vs_file.last_error.message if vs_file.last_error else "failed"
+            self.file_ids.extend(file_id for file_id in batch_ids if file_id not in failed)
+        if file_ids:
+            self.answer_cache.invalidate(self.vector_store_id)
+            self.single_flight.forget(self.vector_store_id)
+        return failed
+
+    def _use_own_vector_store(self, file_ids: List[str],
+                              progress: Callable[[str], None] = _ignore_progress) -> Dict[str, str]:
+        # Copy-on-write: a shared store is left untouched and this session gets its own
+        previous = self.vector_store_id if self.owns_vector_store else None
+        vector_store = self.resources.create_vector_store(self.session_id)
+        self.vector_store_id = vector_store.id
+        self.owns_vector_store = True
+        self.file_ids = []
+        failed = self._attach_files(file_ids, progress)
+        self._bind_thread()
+        if previous:
+            self.resources.release(previous)
+        return failed
+
+    def _bind_thread(self) -> None:
+        # The conversation carries on, searching the session's current vector store
+        if self.thread_id:
+            get_client().beta.threads.update(
+                self.thread_id,
+                tool_resources={
+                    "file_search": {
+                        "vector_store_ids": [self.vector_store_id]
+                    }
+                }
             )
-            return messages.data
+
+    @metrics.timed("add_documents")
+    def add_documents(self, uploaded_files,
+                      progress: Callable[[str], None] = _ignore_progress) -> List[Optional[str]]:
+        # File ids in upload order; None for a file the vector store could not index
+        uploaded_files = list(uploaded_files)
+        if not uploaded_files:
+            return []
+        if not self.file_ids and len(uploaded_files) == 1:
+            # A knowledge base of one document uses the registry's shared store, reused if already indexed;
+            # only sets of several documents get a store of their own
+            previous = self.vector_store_id if self.owns_vector_store else None
+            file_id = self._use_registered_store(uploaded_files[0], progress)
+            if self.thread_id:
+                self._bind_thread()
+            else:
+                self.create_thread()
+            if previous:
+                self.resources.release(previous)
+            return [file_id]
+        progress(f"Uploading {len(uploaded_files)} document(s)")
+        workers = min(MAX_UPLOAD_WORKERS, len(uploaded_files))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            file_ids = list(pool.map(self._upload_file, uploaded_files))
+        self._index_in_background(list(zip(file_ids, uploaded_files)))
+        new_ids = [file_id for file_id in dict.fromkeys(file_ids) if file_id not in self.file_ids]
+        progress("Indexing in the vector store")
+        if self.vector_store_id and self.owns_vector_store:
+            failed = self._attach_files(new_ids, progress)
+        else:
+            failed = self._use_own_vector_store(self.file_ids + new_ids, progress)
+        names = {file_id: uploaded_file.name for file_id, uploaded_file in zip(file_ids, uploaded_files)}
+        for file_id, reason in failed.items():
+            _report("warning", f"Could not index {names.get(file_id, file_id)}: {reason}")
+        if new_ids and all(file_id in failed for file_id in new_ids):
+            raise Exception(f"None of the {len(new_ids)} document(s) could be indexed")
+        if not self.thread_id:
+            self.create_thread()
+        return [None if file_id in failed else file_id for file_id in file_ids]
+
+    @metrics.timed("remove_document")
+    def remove_document(self, file_id: str, progress: Callable[[str], None] = _ignore_progress) -> None:
+        if file_id not in self.file_ids:
+            return
+        remaining = [other for other in self.file_ids if other != file_id]
+        if self.owns_vector_store:
+            # The file object stays: the registry may hand it to other sessions
+            get_client().vector_stores.files.delete(
+                file_id=file_id,
+                vector_store_id=self.vector_store_id
+            )
+            self.file_ids = remaining
+            self.answer_cache.invalidate(self.vector_store_id)
+            self.single_flight.forget(self.vector_store_id)
+        else:
+            progress("Copying the knowledge base without the removed document")
+            for other, reason in self._use_own_vector_store(remaining, progress).items():
+                _report("warning", f"Could not copy document {other} to the new vector store: {reason}")
+
+    @metrics.timed("local_search")
+    def search_similar_chunks(self, query: str, top_k: int = 3) -> List["SearchResult"]:
+        try:
+            # Ranked locally against this session's files; no assistant run involved
+            return self.retriever.search(query, top_k=top_k, document_ids=self.file_ids)
         except Exception as e:
-            st.error(f"Error searching documents: {str(e)}")
+            _report("error", f"Error searching documents: {str(e)}")
             raise
 
-    def search_similar_documents(self, query: str, top_k: int = 3) -> list:
-        return self.search_similar_chunks(query, top_k=top_k)
+    def search_similar_documents(self, query: str, top_k: int = 3) -> List["SearchResult"]:
+        # Best-scoring chunk per document, for the top_k documents
+        best = {}
+        for result in self.search_similar_chunks(query, top_k=top_k * 4):
+            if result.document_id not in best:
+                best[result.document_id] = result
+        return list(best.values())[:top_k]
 
-    def synthesize_answer(self, query: str, results) -> str:
+    def synthesize_answer(self, query: str, results: List["SearchResult"]) -> str:
         try:
             if not results:
                 return "I couldn't find any relevant information in the documents to answer your question."
             
-            # Get the latest assistant message
-            assistant_messages = [msg for msg in results if msg.role == "assistant"]
-            if not assistant_messages:
+            # Ground the run in the retrieved excerpts
+            excerpts = "\n\n".join(f"[{i + 1}] {result.text}" for i, result in enumerate(results))
+            answer = "".join(self._run(
+                query,
+                additional_instructions=f"Relevant excerpts from the user's documents:\n\n{excerpts}"
+            ))
+            if not answer:
                 return "I couldn't generate a response based on the documents."
-            
-            return assistant_messages[0].content[0].text.value
+            return answer
         except Exception as e:
-            st.error(f"Error generating answer: {str(e)}")
+            _report("error", f"Error generating answer: {str(e)}")
             raise
 
-    def ask_question(self, question: str) -> str:
+    def _run_params(self, tier: Optional["Tier"]) -> dict:
+        if tier is None:
+            return {"assistant_id": self.assistant_id}
+        return tier.run_params(self.assistant_id)
+
+    def _retrieval_confidence(self, question: str) -> Optional[float]:
+        # Keyword search of the local index only, so routing costs no embedding call
+        if not self.file_ids or not self.router.enabled or not self.local_index:
+            return None
+        from model_router import term_coverage
+        try:
+            results = self.retriever.search(question, top_k=1, document_ids=self.file_ids, mode="bm25")
+        except Exception as e:
+            logger.warning("Local search for routing failed: %s", e)
+            return None
+        return term_coverage(question, results[0].text) if results else 0.0
+
+    def _record_route(self, route: "Route", tier: int, started: float, escalated_from: Optional[int] = None,
+                      escalation: Optional[str] = None) -> None:
+        decision = self.router.record(route, tier, time.perf_counter() - started, escalated_from, escalation)
+        if self.last_run_stats is not None:
+            self.last_run_stats["route"] = decision
+
+    def _routed_stream(self, question: str) -> Iterator[str]:
+        # The question runs on the tier the router picks. A fast-tier answer is held back until enough
+        # of it has arrived to judge; an empty or hedging one is discarded and asked on the strongest tier.
+        route = self.router.route(question, self._retrieval_confidence(question))
+        started = time.perf_counter()
+        tier = self.router.tiers[route.tier]
+        if route.tier == self.router.strongest:
+            yield from self._run(question, tier=tier)
+            self._record_route(route, route.tier, started)
+            return
+        held = []
+        released = False
+        for delta in self._run(question, tier=tier):
+            if released:
+                yield delta
+                continue
+            held.append(delta)
+            if self.router.ready("".join(held)):
+                released = True
+                yield "".join(held)
+        self._record_route(route, route.tier, started)
+        weak = None if released else self.router.weak_answer("".join(held))
+        if weak is None:
+            if not released and held:
+                yield "".join(held)
+            return
+        self._discard_reply()
+        started = time.perf_counter()
+        yield from self._run(question, tier=self.router.tiers[self.router.strongest], new_message=False)
+        self._record_route(route, self.router.strongest, started, route.tier, weak)
+
+    def _discard_reply(self) -> None:
+        # The discarded answer leaves the thread, so it is not context for the next run. A run that
+        # posted no reply leaves nothing to delete; last_message_id may then be the question itself.
+        reply_id, self.last_reply_id = self.last_reply_id, None
+        if reply_id is None:
+            return
+        try:
+            get_client().beta.threads.messages.delete(message_id=reply_id, thread_id=self.thread_id)
+        except Exception as e:
+            logger.warning("Could not delete discarded reply %s: %s", reply_id, e)
+
+    def _stream_run(self, question: str, additional_instructions: Optional[str] = None,
+                    tier: Optional["Tier"] = None, new_message: bool = True) -> Iterator[str]:
+        # Add user message to the thread, unless the question is being asked again on another tier
+        if new_message:
+            with metrics.span("run.message_create"):
+                user_message = get_client().beta.threads.messages.create(
+                    thread_id=self.thread_id,
+                    role="user",
+                    content=question
+                )
+            self.last_message_id = user_message.id
+        self.resources.touch(self.thread_id, self.vector_store_id)
+        self.last_reply_id = None
+        # Stream the run instead of polling runs.retrieve until it completes
+        tracker = RunTracker(self.resilience.hedging.observe)
+        self.last_run_stats = tracker.stats
+        deadline = time.monotonic() + RUN_TIMEOUT_SECONDS
+        run_id = None
+        try:
+            with get_client().beta.threads.runs.stream(
+                thread_id=self.thread_id,
+                **self._run_params(tier),
+                additional_instructions=additional_instructions,
+                truncation_strategy=self.truncation_strategy,
+                timeout=RUN_TIMEOUT_SECONDS
+            ) as stream:
+                for event in stream:
+                    if event.event == "thread.run.created":
+                        run_id = event.data.id
+                    elif event.event in _RUN_ENDED:
+                        run_id = None
+                    text = tracker.on_event(event)
+                    if text:
+                        yield text
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"Run timed out after {RUN_TIMEOUT_SECONDS} seconds.")
+                run = stream.get_final_run()
+                # A run that failed may have no reply at all
+                replies = stream.get_final_messages() if run.status == "completed" else []
+        except (Exception, GeneratorExit) as e:
+            # Overran, dropped mid-stream or abandoned by the caller: stop the run server-side too
+            tracker.abandon("cancelled" if isinstance(e, GeneratorExit) else
+                            "timeout" if isinstance(e, TimeoutError) else "error")
+            if run_id is not None:
+                try:
+                    get_client().beta.threads.runs.cancel(thread_id=self.thread_id, run_id=run_id)
+                except Exception as cancel_error:
+                    logger.warning("Could not cancel run %s: %s", run_id, cancel_error)
+            raise
+        tracker.finish(run)
+        if replies:
+            self.last_message_id = self.last_reply_id = replies[-1].id
+        if run.status != "completed":
+            raise self.resilience.run_failed(run)
+
+    def _run(self, question: str, additional_instructions: Optional[str] = None, tier: Optional["Tier"] = None,
+             new_message: bool = True) -> Iterator[str]:
+        # A run that fails before any of its answer was shown is started again; the question is posted once
+        give_up_at = time.monotonic() + RUN_TIMEOUT_SECONDS
+        attempt = 0
+        while True:
+            posted = self.last_message_id
+            yielded = False
+            try:
+                for delta in self._stream_run(question, additional_instructions, tier, new_message):
+                    yielded = True
+                    yield delta
+                return
+            except Exception as e:
+                delay = None if yielded else self.resilience.run_retry_delay(e, attempt, give_up_at)
+                if delay is None:
+                    raise
+                logger.warning("Run failed (%s); starting it again in %.1fs", e, delay)
+            new_message = new_message and self.last_message_id == posted
+            attempt += 1
+            time.sleep(delay)
+
+    def fetch_new_messages(self) -> List["Message"]:
+        # Only what was added since the last fetch or run, a page at a time, oldest first
+        messages = []
+        while self.thread_id:
+            page = get_client().beta.threads.messages.list(
+                thread_id=self.thread_id,
+                order="asc",
+                limit=MESSAGE_PAGE_SIZE,
+                **({"after": self.last_message_id} if self.last_message_id else {})
+            )
+            messages.extend(page.data)
+            if page.data:
+                self.last_message_id = page.data[-1].id
+            if not page.has_more:
+                break
+        return messages
+
+    def _post_exchange(self, question: str, answer: str) -> None:
+        # A cached or shared answer never ran on this thread; post the exchange so later runs see it
+        try:
+            with metrics.span("run.message_create"):
+                user_message = get_client().beta.threads.messages.create(
+                    thread_id=self.thread_id, role="user", content=question)
+                self.last_message_id = user_message.id
+                reply = get_client().beta.threads.messages.create(
+                    thread_id=self.thread_id, role="assistant", content=answer)
+            self.last_message_id = self.last_reply_id = reply.id
+            self.resources.touch(self.thread_id, self.vector_store_id)
+        except Exception as e:
+            logger.warning("Could not add the cached answer to thread %s: %s", self.thread_id, e)
+
+    def _run_and_cache(self, question: str, vector_store_id: str) -> Iterator[str]:
+        deltas = []
+        for delta in self._routed_stream(question):
+            deltas.append(delta)
+            yield delta
+        # Only completed runs are cached, never partial or failed answers
+        if deltas:
+            self.answer_cache.put(vector_store_id, question, "".join(deltas))
+
+    def _shared_run(self, question: str, vector_store_id: str) -> Iterator[str]:
+        # A first question may still be in flight for another session; if so, wait on its run instead.
+        # That run posted to the other session's thread, so the exchange is added to this one afterwards
+        led = False
+
+        def lead() -> Iterator[str]:
+            nonlocal led
+            led = True
+            return self._run_and_cache(question, vector_store_id)
+
+        deltas = []
+        for delta in self.single_flight.stream(vector_store_id, question, lead):
+            deltas.append(delta)
+            yield delta
+        if not led and deltas:
+            self._post_exchange(question, "".join(deltas))
+
+    def ask_question_stream(self, question: str) -> Iterator[str]:
+        vector_store_id = self.vector_store_id
+        # Cached and shared answers were given with no conversation before them, so only a thread's
+        # first question is looked up, stored or coalesced; later ones depend on the turns before them
+        if vector_store_id and self.last_message_id is None:
+            with metrics.span("answer_cache.lookup"):
+                cached = self.answer_cache.get(vector_store_id, question)
+            metrics.events.inc(event="answer_cache_miss" if cached is None else "answer_cache_hit")
+            if cached is not None:
+                self._post_exchange(question, cached)
+                yield cached
+                return
+            answer = self._shared_run(question, vector_store_id)
+        else:
+            answer = self._routed_stream(question)
+        answered = False
         try:
-            # Add user message to the thread
-            client.beta.threads.messages.create(
+            for delta in answer:
+                answered = True
+                yield delta
+        except Exception as e:
+            from resilience import circuit_open
+            _report("error", f"Error processing question: {str(e)}")
+            if not answered:
+                yield ASSISTANT_UNAVAILABLE if circuit_open(e) else "[Assistant failed to answer]"
+
+    async def _apost_question(self, question: str) -> None:
+        with metrics.span("run.message_create"):
+            user_message = await get_async_client().beta.threads.messages.create(
                 thread_id=self.thread_id,
                 role="user",
                 content=question
             )
-            # Run the assistant on the thread
-            run = client.beta.threads.runs.create(
+        self.last_message_id = user_message.id
+
+    async def _astream_run(self, question: str, additional_instructions: Optional[str] = None,
+                           tier: Optional["Tier"] = None, new_message: bool = True,
+                           on_started: Optional[Callable[[], None]] = None) -> AsyncIterator[str]:
+        # _stream_run on the async client, for the query executor's loop
+        client = get_async_client()
+        if new_message:
+            await self._apost_question(question)
+        # The ledger is SQLite; keep its writes off the event loop
+        await asyncio.to_thread(self.resources.touch, self.thread_id, self.vector_store_id)
+        self.last_reply_id = None
+
+        def started(queued_seconds: float) -> None:
+            self.resilience.hedging.observe(queued_seconds)
+            if on_started is not None:
+                on_started()
+
+        tracker = RunTracker(started)
+        self.last_run_stats = tracker.stats
+        deadline = time.monotonic() + RUN_TIMEOUT_SECONDS
+        run_id = None
+        try:
+            async with client.beta.threads.runs.stream(
                 thread_id=self.thread_id,
-                assistant_id=self.assistant_id
-            )
-            # Wait for the run to complete
-            import time
-            waited = 0
+                **self._run_params(tier),
+                additional_instructions=additional_instructions,
+                truncation_strategy=self.truncation_strategy,
+                timeout=RUN_TIMEOUT_SECONDS
+            ) as stream:
+                async for event in stream:
+                    if event.event == "thread.run.created":
+                        run_id = event.data.id
+                    elif event.event in _RUN_ENDED:
+                        run_id = None
+                    text = tracker.on_event(event)
+                    if text:
+                        yield text
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"Run timed out after {RUN_TIMEOUT_SECONDS} seconds.")
+                run = await stream.get_final_run()
+                replies = await stream.get_final_messages() if run.status == "completed" else []
+        except (asyncio.CancelledError, Exception) as e:
+            # The user reset the session, a hedge won, the run overran or the stream dropped: stop it
+            # server-side too
+            tracker.abandon("cancelled" if isinstance(e, asyncio.CancelledError) else
+                            "timeout" if isinstance(e, TimeoutError) else "error")
+            if run_id is not None:
+                try:
+                    await client.beta.threads.runs.cancel(thread_id=self.thread_id, run_id=run_id)
+                except Exception as cancel_error:
+                    logger.warning("Could not cancel run %s: %s", run_id, cancel_error)
+            raise
+        tracker.finish(run)
+        if replies:
+            self.last_message_id = self.last_reply_id = replies[-1].id
+        if run.status != "completed":
+            raise self.resilience.run_failed(run)
+
+    async def _arun(self, question: str, additional_instructions: Optional[str] = None,
+                    tier: Optional["Tier"] = None, new_message: bool = True) -> AsyncIterator[str]:
+        # _run for the query executor's loop, where a run may also be hedged
+        give_up_at = time.monotonic() + RUN_TIMEOUT_SECONDS
+        attempt = 0
+        while True:
+            posted = self.last_message_id
+            yielded = False
+            try:
+                async for delta in self._ahedged_run(question, additional_instructions, tier, new_message):
+                    yielded = True
+                    yield delta
+                return
+            except Exception as e:
+                delay = None if yielded else self.resilience.run_retry_delay(e, attempt, give_up_at)
+                if delay is None:
+                    raise
+                logger.warning("Run failed (%s); starting it again in %.1fs", e, delay)
+            new_message = new_message and self.last_message_id == posted
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _aclone_thread(self) -> str:
+        # A new thread holding the text of the messages the run would see, the question included
+        page = await get_async_client().beta.threads.messages.list(
+            thread_id=self.thread_id,
+            order="desc",
+            limit=min(self.context_messages or MESSAGE_PAGE_SIZE, MESSAGE_PAGE_SIZE)
+        )
+        messages = []
+        for message in reversed(page.data):
+            text = "".join(part.text.value for part in message.content if part.type == "text")
+            if text:
+                messages.append({"role": message.role, "content": text})
+        return await asyncio.to_thread(self.resources.create_thread, self.vector_store_id, self.session_id, messages)
+
+    async def _ahedged_run(self, question: str, additional_instructions: Optional[str] = None,
+                           tier: Optional["Tier"] = None, new_message: bool = True) -> AsyncIterator[str]:
+        # A thread runs one run at a time, so a run still queued after the hedge delay is duplicated on a
+        # copy of the thread. Whichever starts first answers; the other is cancelled, server-side too.
+        delay = self.resilience.hedging.delay()
+        if delay is None:
+            async for delta in self._astream_run(question, additional_instructions, tier, new_message):
+                yield delta
+            return
+        if new_message:
+            await self._apost_question(question)
+        winner = asyncio.get_running_loop().create_future()
+        queues = {}
+        tasks = {}
+
+        def start(name: str, candidate: "AdvancedRAG") -> None:
+            def started() -> None:
+                if not winner.done():
+                    winner.set_result(name)
+            queues[name] = asyncio.Queue()
+            tasks[name] = asyncio.ensure_future(_drain(
+                candidate._astream_run(question, additional_instructions, tier, False, started), queues[name]))
+
+        start("primary", self)
+        clone = None
+        losers = []
+        try:
+            await asyncio.wait([winner, tasks["primary"]], timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            if not winner.done() and not tasks["primary"].done() and self.resilience.hedging.allow():
+                try:
+                    clone = copy.copy(self)
+                    clone.thread_id = await self._aclone_thread()
+                except Exception as e:
+                    logger.warning("Could not hedge run on thread %s: %s", self.thread_id, e)
+                    clone = None
+                else:
+                    start("hedge", clone)
+            # The first to start wins; one that ends without starting has failed and is out of the race
+            pending = set(tasks.values())
+            while not winner.done() and pending:
+                done, _ = await asyncio.wait(pending | {winner}, return_when=asyncio.FIRST_COMPLETED)
+                pending -= done
+            name = winner.result() if winner.done() else "primary"
+            losers = [task for other, task in tasks.items() if other != name]
+            for task in losers:
+                task.cancel()
+            if clone is not None:
+                self.resilience.hedging.record(name)
             while True:
-                run_status = client.beta.threads.runs.retrieve(
-                    thread_id=self.thread_id,
-                    run_id=run.id
-                )
-                if run_status.status == 'completed':
+                delta = await queues[name].get()
+                if delta is None:
                     break
-                elif run_status.status == 'failed':
-                    raise Exception("Run failed")
-                time.sleep(0.2)
-                waited += 0.2
-                if waited > 60:
-                    raise Exception("Run timed out after 60 seconds.")
-            # Get the latest message
-            messages = client.beta.threads.messages.list(
+                yield delta
+            # Raises the winner's error, if it failed
+            await tasks[name]
+            if name == "hedge":
+                # The primary's cancel request goes out before its thread is waited on
+                await asyncio.wait(losers)
+                await self._aadopt_reply(clone)
+        finally:
+            # Losers are left to finish cancelling their runs
+            for task in tasks.values():
+                if task not in losers:
+                    task.cancel()
+            if clone is not None:
+                await asyncio.to_thread(self.resources.release, clone.thread_id)
+
+    async def _await_thread_idle(self) -> None:
+        # The losing primary run may still be cancelling, or was abandoned before its cancel went out
+        client = get_async_client()
+        deadline = time.monotonic() + RUN_SETTLE_TIMEOUT_SECONDS
+        delay = RUN_SETTLE_POLL_SECONDS
+        while True:
+            page = await client.beta.threads.runs.list(thread_id=self.thread_id, order="desc", limit=1)
+            run = page.data[0] if page.data else None
+            if run is None or run.status not in _RUN_ACTIVE:
+                return
+            if run.status != "cancelling":
+                await client.beta.threads.runs.cancel(thread_id=self.thread_id, run_id=run.id)
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"Run {run.id} was still {run.status} after {RUN_SETTLE_TIMEOUT_SECONDS} seconds.")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, INDEX_POLL_MAX_SECONDS)
+
+    async def _aadopt_reply(self, clone: "AdvancedRAG") -> None:
+        # The hedge answered on its own thread; its answer joins the session's thread as the reply
+        self.last_run_stats = clone.last_run_stats
+        client = get_async_client()
+        try:
+            await self._await_thread_idle()
+            page = await client.beta.threads.messages.list(thread_id=clone.thread_id, order="desc", limit=1)
+            reply = await client.beta.threads.messages.create(
                 thread_id=self.thread_id,
-                order='desc',
-                limit=1
+                role="assistant",
+                content="".join(part.text.value for message in page.data for part in message.content
+                                if part.type == "text")
             )
-            if not messages.data:
-                return "No response received from the assistant."
-            return messages.data[0].content[0].text.value
         except Exception as e:
-            st.error(f"Error processing question: {str(e)}")
-            return "[Assistant failed to answer]"
+            logger.warning("Could not copy the hedged reply into thread %s: %s", self.thread_id, e)
+            return
+        self.last_message_id = self.last_reply_id = reply.id
+
+    async def _arouted_stream(self, question: str) -> AsyncIterator[str]:
+        # _routed_stream for the query executor's loop
+        confidence = (await asyncio.to_thread(self._retrieval_confidence, question)
+                      if self.file_ids and self.router.enabled and self.local_index else None)
+        route = self.router.route(question, confidence)
+        started = time.perf_counter()
+        tier = self.router.tiers[route.tier]
+        if route.tier == self.router.strongest:
+            async for delta in self._arun(question, tier=tier):
+                yield delta
+            self._record_route(route, route.tier, started)
+            return
+        held = []
+        released = False
+        async for delta in self._arun(question, tier=tier):
+            if released:
+                yield delta
+                continue
+            held.append(delta)
+            if self.router.ready("".join(held)):
+                released = True
+                yield "".join(held)
+        self._record_route(route, route.tier, started)
+        weak = None if released else self.router.weak_answer("".join(held))
+        if weak is None:
+            if not released and held:
+                yield "".join(held)
+            return
+        await self._adiscard_reply()
+        started = time.perf_counter()
+        async for delta in self._arun(question, tier=self.router.tiers[self.router.strongest],
+                                      new_message=False):
+            yield delta
+        self._record_route(route, self.router.strongest, started, route.tier, weak)
+
+    async def _adiscard_reply(self) -> None:
+        reply_id, self.last_reply_id = self.last_reply_id, None
+        if reply_id is None:
+            return
+        try:
+            await get_async_client().beta.threads.messages.delete(message_id=reply_id, thread_id=self.thread_id)
+        except Exception as e:
+            logger.warning("Could not delete discarded reply %s: %s", reply_id, e)
+
+    async def _apost_exchange(self, question: str, answer: str) -> None:
+        try:
+            await self._apost_question(question)
+            with metrics.span("run.message_create"):
+                reply = await get_async_client().beta.threads.messages.create(
+                    thread_id=self.thread_id, role="assistant", content=answer)
+            self.last_message_id = self.last_reply_id = reply.id
+            await asyncio.to_thread(self.resources.touch, self.thread_id, self.vector_store_id)
+        except Exception as e:
+            logger.warning("Could not add the cached answer to thread %s: %s", self.thread_id, e)
+
+    async def _arun_and_cache(self, question: str, vector_store_id: str) -> AsyncIterator[str]:
+        deltas = []
+        async for delta in self._arouted_stream(question):
+            deltas.append(delta)
+            yield delta
+        if deltas:
+            await asyncio.to_thread(self.answer_cache.put, vector_store_id, question, "".join(deltas))
+
+    async def _ashared_run(self, question: str, vector_store_id: str) -> AsyncIterator[str]:
+        led = False
+
+        def lead() -> AsyncIterator[str]:
+            nonlocal led
+            led = True
+            return self._arun_and_cache(question, vector_store_id)
+
+        deltas = []
+        async for delta in self.single_flight.astream(vector_store_id, question, lead):
+            deltas.append(delta)
+            yield delta
+        if not led and deltas:
+            await self._apost_exchange(question, "".join(deltas))
+
+    async def _answer(self, question: str, handle: "QueryHandle") -> str:
+        # The blocking caches run on worker threads so the loop only ever waits on the network
+        vector_store_id = self.vector_store_id
+        if vector_store_id and self.last_message_id is None:
+            with metrics.span("answer_cache.lookup"):
+                cached = await asyncio.to_thread(self.answer_cache.get, vector_store_id, question)
+            metrics.events.inc(event="answer_cache_miss" if cached is None else "answer_cache_hit")
+            if cached is not None:
+                await self._apost_exchange(question, cached)
+                handle.put(cached)
+                return cached
+            answer = self._ashared_run(question, vector_store_id)
+        else:
+            answer = self._arouted_stream(question)
+        deltas = []
+        async for delta in answer:
+            deltas.append(delta)
+            handle.put(delta)
+        return "".join(deltas)
+
+    def submit_question(self, question: str) -> "QueryHandle":
+        # Answered on the process-wide query executor; the caller gets a handle to stream or wait on,
+        # and errors are raised from it rather than reported here
+        return get_query_executor().submit(lambda handle: self._answer(question, handle), key=self)
+
+    def cancel_questions(self) -> int:
+        # Stops this session's unfinished questions, including their runs
+        return get_query_executor().cancel(self)
+
+    def close(self) -> None:
+        # The session is over: stop its runs and hand its threads and private stores to the sweeper.
+        # Shared stores stay; the registry hands them to the next upload of the same bytes.
+        self.cancel_questions()
+        self.resources.release_owner(self.session_id)
+
+    def ask_question(self, question: str) -> str:
+        response = "".join(self.ask_question_stream(question))
+        if not response:
+            return "No response received from the assistant."
+        return response
 
     def create_assistant(self, name: str = "Document Assistant") -> str:
         try:
-            assistant = client.beta.assistants.create(
+            assistant = get_client().beta.assistants.create(
                 instructions="Use the file provided as your knowledge base to best respond to customer queries.",
-                model="gpt-4-1106-preview",
+                model=ASSISTANT_MODEL,
                 tools=[{"type": "file_search"}],
                 name=name
             )
             self.assistant_id = assistant.id
             return self.assistant_id
         except Exception as e:
-            st.error(f"Error creating assistant: {str(e)}")
+            _report("error", f"Error creating assistant: {str(e)}")
             raise
 
-    def transcribe_audio(self, audio_bytes):
-        import traceback
+    @metrics.timed("transcribe.segment")
+    def _transcribe(self, name: str, audio_bytes: bytes) -> str:
+        transcript = get_client().audio.transcriptions.create(
+            model="whisper-1",
+            file=(name, audio_bytes),
+            language="en"
+        )
+        return transcript.text
+
+    @metrics.timed("transcribe")
+    def transcribe_audio(self, audio_bytes, long_audio: Optional[bool] = None):
         try:
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-                tmp.write(audio_bytes)
-                tmp.flush()
-                tmp_path = tmp.name
-            with open(tmp_path, "rb") as audio_file:
-                transcript = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    language="en"
-                )
-            os.remove(tmp_path)
-            return transcript.text
+            from audio_chunking import split_wav, stitch_transcripts, wav_seconds
+
+            seconds = wav_seconds(audio_bytes)
+            if long_audio is None:
+                long_audio = seconds is not None and seconds > LONG_AUDIO_SECONDS
+            if not long_audio or seconds is None:
+                # The recorder hands us the whole WAV in memory; send those bytes as-is
+                return self._transcribe("audio.wav", audio_bytes)
+            # Long notes are cut at silences and the segments transcribed side by side,
+            # so latency follows the longest segment rather than the whole recording
+            try:
+                segments = split_wav(audio_bytes)
+            except Exception as e:
+                # A WAV we cannot cut is still one the API may accept whole
+                logger.warning("Could not split audio (%s); transcribing it in one request", e)
+                return self._transcribe("audio.wav", audio_bytes)
+            names = [f"audio-{i:03d}.wav" for i in range(len(segments))]
+            with ThreadPoolExecutor(max_workers=min(MAX_TRANSCRIBE_WORKERS, len(segments))) as pool:
+                texts = list(pool.map(self._transcribe, names, segments))
+            return stitch_transcripts(texts)
         except Exception as e:
-            st.error(f"Error transcribing audio: {str(e)}")
-            st.error(traceback.format_exc())
+            _report("error", f"Error transcribing audio: {str(e)}")
+            _report("error", traceback.format_exc())
             return "[Transcription failed]"
 
+    @metrics.timed("speech")
+    def _speech(self, text: str, voice: str = "alloy", response_format: str = "mp3") -> bytes:
+        from speech_cache import speech_key
+
+        # Content-addressed: the same text in the same voice and format is synthesized once per host
+        key = speech_key(text, voice, response_format, TTS_MODEL)
+        cached = self.speech_cache.get(key, response_format)
+        metrics.events.inc(event="speech_cache_miss" if cached is None else "speech_cache_hit")
+        if cached is not None:
+            return cached
+        response = get_client().audio.speech.create(
+            model=TTS_MODEL,
+            voice=voice,
+            input=text,
+            response_format=response_format
+        )
+        self.speech_cache.put(key, response_format, response.content)
+        return response.content
+
     def synthesize_speech(self, text, voice="alloy", response_format="mp3"):
-        import traceback
+        # Called on the speech pipeline's workers, which cannot render to the page; None tells the
+        # caller synthesis failed, and the page reports it from the script thread
         try:
-            response = client.audio.speech.create(
-                model="tts-1",
-                voice=voice,
-                input=text,
-                response_format=response_format
-            )
-            return response.content
+            return self._speech(text, voice, response_format)
         except Exception as e:
-            st.error(f"Error synthesizing speech: {str(e)}")
-            st.error(traceback.format_exc())
+            logger.warning("Error synthesizing speech: %s", e)
             return None
 
+    def speech_pipeline(self, voice: str = "alloy", response_format: str = "mp3") -> "SpeechPipeline":
+        # Feed answer deltas in; sentences are synthesized concurrently and read back in order
+        from speech_pipeline import SpeechPipeline
+        return SpeechPipeline(lambda sentence: self.synthesize_speech(sentence, voice, response_format))
+
 def file_hash(uploaded_file):
+    # getvalue() shares BytesIO's buffer; getbuffer() would force a copy of it. Callers hash once per upload
     return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
 
 def main():
+    import streamlit as st
+    from streamlit_chat import message
+
+    if not get_setting("OPENAI_API_KEY"):
+        st.error("OpenAI API key not found. Please add it to your Streamlit Cloud secrets.")
+        st.stop()
+
     st.title("Document Q&A Assistant (Text Only, Streamlit Cloud Ready)")
     if 'rag' not in st.session_state:
         st.session_state.rag = AdvancedRAG()
     if 'messages' not in st.session_state:
-        st.session_state.messages = []
+        st.session_state.messages = deque(maxlen=MESSAGE_HISTORY_LIMIT)
     if 'assistant_created' not in st.session_state:
         st.session_state.assistant_created = False
     if 'last_uploaded_file_hash' not in st.session_state:
         st.session_state.last_uploaded_file_hash = None
     if 'disable_widgets' not in st.session_state:
         st.session_state.disable_widgets = False
+    if 'upload_hashes' not in st.session_state:
+        st.session_state.upload_hashes = {}  # uploader file_id -> content hash
 
     def reset_all():
+        # The old session's runs are cancelled and its threads and stores deleted by the next sweep
+        st.session_state.rag.close()
         st.session_state.rag = AdvancedRAG()
-        st.session_state.messages = []
+        st.session_state.messages = deque(maxlen=MESSAGE_HISTORY_LIMIT)
         st.session_state.assistant_created = False
         st.session_state.last_uploaded_file_hash = None
         st.session_state.disable_widgets = False
@@ -287,7 +1291,11 @@ def main():
 
     uploaded_file = st.file_uploader("Upload a document", type=['pdf', 'txt', 'docx'], disabled=st.session_state.disable_widgets)
     if uploaded_file:
-        current_hash = file_hash(uploaded_file)
+        # Hash each upload once, not on every rerun
+        current_hash = st.session_state.upload_hashes.get(uploaded_file.file_id)
+        if current_hash is None:
+            current_hash = file_hash(uploaded_file)
+            st.session_state.upload_hashes = {uploaded_file.file_id: current_hash}
         if current_hash != st.session_state.last_uploaded_file_hash:
             reset_all()
             st.session_state.disable_widgets = True
@@ -319,12 +1327,16 @@ def main():
             user_question = prompt
             st.session_state.messages.append((user_question, True))
             try:
-                with st.spinner("Thinking..."):
-                    response = st.session_state.rag.ask_question(user_question)
-                    st.session_state.messages.append((response, False))
-                    st.write("Assistant:", response)
+                st.write("Assistant:")
+                response = st.write_stream(st.session_state.rag.submit_question(user_question).deltas())
+                st.session_state.messages.append((response or "No response received from the assistant.", False))
             except Exception as e:
-                st.error(f"Error processing question: {str(e)}")
+                from resilience import circuit_open
+                if circuit_open(e):
+                    st.write(ASSISTANT_UNAVAILABLE)
+                    st.session_state.messages.append((ASSISTANT_UNAVAILABLE, False))
+                else:
+                    st.error(f"Error processing question: {str(e)}")
             finally:
                 st.session_state.disable_widgets = False
         for i, (msg, is_user) in enumerate(st.session_state.messages):
@@ -0,0 +1,105 @@
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Rows assigned to centroids per matrix product; bounds the (rows, n_lists) score buffer
+ASSIGN_BLOCK_ROWS = 16384
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    # k-means on the unit sphere: assignment by dot product, centroids re-normalised each step
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            # Re-seed dead centroids on random points so every list stays useful
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    # Inverted-file index: centroids plus, per centroid, the row ids assigned to it.
+    # Vectors stay with the caller; search returns candidate rows to be scored exactly.
+    def __init__(self, n_lists: Optional[int] = None, nprobe: int = 8, sample_per_list: int = 64, seed: int = 0):
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.sample_per_list = sample_per_list
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_rows = 0
+        self.size = 0
+        self._pending: List[List[np.ndarray]] = []
+        self._lists: List[np.ndarray] = []
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def list_count(self, n_rows: int) -> int:
+        return self.n_lists or int(np.clip(np.sqrt(n_rows), 1, 4096))
+
+    def training_rows(self, n_rows: int) -> np.ndarray:
+        # Sorted so sampling from a memory-mapped matrix reads pages in order
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(n_rows, self.list_count(n_rows) * self.sample_per_list)
+        return np.sort(rng.choice(n_rows, sample_size, replace=False))
+
+    def train(self, sample: np.ndarray, n_rows: int) -> None:
+        self.centroids = spherical_kmeans(sample, self.list_count(n_rows), seed=self.seed)
+        self.trained_rows = n_rows
+        self.reset()
+
+    def reset(self) -> None:
+        n_lists = 0 if self.centroids is None else len(self.centroids)
+        self._pending = [[] for _ in range(n_lists)]
+        self._lists = [np.empty(0, dtype=np.int64) for _ in range(n_lists)]
+        self.size = 0
+
+    def add(self, vectors: np.ndarray, first_row: int) -> None:
+        # Incremental insert: new rows join their nearest existing centroid
+        for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+            assignment = np.argmax(block @ self.centroids.T, axis=1)
+            rows = np.arange(first_row + start, first_row + start + len(block))
+            order = np.argsort(assignment, kind="stable")
+            lists, bounds = np.unique(assignment[order], return_index=True)
+            for list_id, group in zip(lists, np.split(rows[order], bounds[1:])):
+                self._pending[list_id].append(group)
+        self.size += len(vectors)
+
+    def add_blocks(self, blocks: Iterable[Tuple[int, np.ndarray]]) -> None:
+        for first_row, vectors in blocks:
+            self.add(vectors, first_row)
+
+    def _list(self, list_id: int) -> np.ndarray:
+        if self._pending[list_id]:
+            self._lists[list_id] = np.concatenate([self._lists[list_id]] + self._pending[list_id])
+            self._pending[list_id] = []
+        return self._lists[list_id]
+
+    def candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        centroid_scores = self.centroids @ query
+        probed = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self._list(int(list_id)) for list_id in probed])
+
+
+def recall_at_k(exact: List[List[object]], approximate: List[List[object]]) -> float:
+    # Fraction of the exact top-k that the approximate search also returned, averaged over queries
+    recalls = [len(set(a) & set(e)) / len(e) for e, a in zip(exact, approximate) if e]
+    return float(np.mean(recalls)) if recalls else 1.0
+
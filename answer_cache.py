@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from retrieval import Embedder
+
+CacheKey = Tuple[str, str]
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+class _StoreEmbeddings:
+    # Unit-normalised question embeddings for one vector store, kept in one contiguous matrix
+    def __init__(self, dim: int, capacity: int = 64):
+        self.matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self.keys: List[Optional[CacheKey]] = []
+        self.free_rows: List[int] = []
+
+    def add(self, key: CacheKey, vector: np.ndarray) -> int:
+        if self.free_rows:
+            row = self.free_rows.pop()
+            self.keys[row] = key
+        else:
+            row = len(self.keys)
+            if row == self.matrix.shape[0]:
+                grown = np.zeros((row * 2, self.matrix.shape[1]), dtype=np.float32)
+                grown[:row] = self.matrix
+                self.matrix = grown
+            self.keys.append(key)
+        self.matrix[row] = vector
+        return row
+
+    def remove(self, row: int) -> None:
+        self.keys[row] = None
+        self.matrix[row] = 0.0
+        self.free_rows.append(row)
+
+    def best_match(self, vector: np.ndarray) -> Tuple[Optional[CacheKey], float]:
+        n = len(self.keys)
+        if n == len(self.free_rows):
+            return None, -1.0
+        # Free rows are zeroed, so they score 0 and never beat a real match above the threshold
+        scores = self.matrix[:n] @ vector
+        row = int(np.argmax(scores))
+        return self.keys[row], float(scores[row])
+
+
+class _Entry:
+    __slots__ = ("answer", "expires_at", "row")
+
+    def __init__(self, answer: str, expires_at: float, row: Optional[int]):
+        self.answer = answer
+        self.expires_at = expires_at
+        self.row = row
+
+
+class AnswerCache:
+    def __init__(self, embedder: Optional[Embedder] = None, similarity_threshold: float = 0.95,
+                 max_entries: int = 1024, ttl_seconds: float = 3600.0):
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[CacheKey, _Entry]" = OrderedDict()
+        self._embeddings: Dict[str, _StoreEmbeddings] = {}
+        # Recent question embeddings, so a miss followed by put() embeds the question once
+        self._recent_vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _embed(self, question: str) -> Optional[np.ndarray]:
+        if self.embedder is None:
+            return None
+        with self._lock:
+            vector = self._recent_vectors.get(question)
+        if vector is not None:
+            return vector
+        try:
+            vector = np.asarray(self.embedder([question])[0], dtype=np.float32)
+        except Exception:
+            # An embedding outage degrades the cache to exact matches only
+            return None
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        vector = vector / norm
+        with self._lock:
+            self._recent_vectors[question] = vector
+            if len(self._recent_vectors) > 256:
+                self._recent_vectors.popitem(last=False)
+        return vector
+
+    def _drop(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key)
+        if entry.row is not None:
+            self._embeddings[key[0]].remove(entry.row)
+
+    def _live_entry(self, key: CacheKey) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, vector_store_id: str, question: str) -> Optional[str]:
+        normalized = normalize_question(question)
+        key = (vector_store_id, normalized)
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is not None:
+                self.hits += 1
+                return entry.answer
+            has_embeddings = vector_store_id in self._embeddings
+        vector = self._embed(normalized) if has_embeddings else None
+        with self._lock:
+            store = self._embeddings.get(vector_store_id)
+            if vector is not None and store is not None:
+                match, score = store.best_match(vector)
+                if match is not None and score >= self.similarity_threshold:
+                    entry = self._live_entry(match)
+                    if entry is not None:
+                        self.hits += 1
+                        self.semantic_hits += 1
+                        return entry.answer
+            self.misses += 1
+            return None
+
+    def put(self, vector_store_id: str, question: str, answer: str) -> None:
+        normalized = normalize_question(question)
+        key = (vector_store_id, normalized)
+        vector = self._embed(normalized)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            row = None
+            if vector is not None:
+                store = self._embeddings.get(vector_store_id)
+                if store is None:
+                    store = self._embeddings[vector_store_id] = _StoreEmbeddings(vector.shape[0])
+                row = store.add(key, vector)
+            self._entries[key] = _Entry(answer, time.monotonic() + self.ttl_seconds, row)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, vector_store_id: str) -> None:
+        # Called whenever the documents behind a vector store change
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == vector_store_id]:
+                del self._entries[key]
+            self._embeddings.pop(vector_store_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._embeddings.clear()
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Set
+
+from metrics import Gauge, metrics
+
+# Assistant runs streamed at once by the whole process; later questions wait on the loop, not in a thread
+MAX_INFLIGHT_RUNS = int(os.environ.get("RAG_MAX_INFLIGHT_RUNS", "256"))
+
+_DONE = object()
+
+inflight_runs = Gauge("rag_query_inflight", "Questions being answered on the query executor.")
+waiting_runs = Gauge("rag_query_waiting", "Questions waiting for a free slot on the query executor.")
+metrics.register(inflight_runs)
+metrics.register(waiting_runs)
+
+
+class QueryHandle:
+    # What a session gets back for a submitted question: the whole answer as a future,
+    # and the answer text as it streams in
+    def __init__(self):
+        self.future: Future = Future()
+        self.submitted_at = time.perf_counter()
+        self.first_delta_at: Optional[float] = None
+        self._deltas: "queue.Queue" = queue.Queue()
+
+    def put(self, text: str) -> None:
+        # Called on the executor's loop
+        if self.first_delta_at is None:
+            self.first_delta_at = time.perf_counter()
+        self._deltas.put(text)
+
+    def _close(self, future: Future) -> None:
+        # Runs once the future settles, whichever way; every delta was queued before this
+        self._deltas.put(_DONE)
+
+    def deltas(self, timeout: Optional[float] = None) -> Iterator[str]:
+        # Blocks the caller only on a queue; the run itself is awaited on the executor's loop.
+        # A reader that stops early (a Streamlit rerun interrupting write_stream) cancels the run.
+        try:
+            while True:
+                item = self._deltas.get(timeout=timeout)
+                if item is _DONE:
+                    break
+                yield item
+        except GeneratorExit:
+            self.cancel()
+            raise
+        # Surface the query's error or cancellation once what did arrive has been streamed
+        self.future.result()
+
+    def result(self, timeout: Optional[float] = None) -> str:
+        return self.future.result(timeout)
+
+    def cancel(self) -> bool:
+        return self.future.cancel()
+
+    def done(self) -> bool:
+        return self.future.done()
+
+
+class QueryExecutor:
+    # A process-wide asyncio loop on its own thread. Sessions submit questions and get QueryHandles back;
+    # at most max_inflight run at a time, and a session's questions can be cancelled together.
+    def __init__(self, max_inflight: int = MAX_INFLIGHT_RUNS):
+        self.max_inflight = max_inflight
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = asyncio.Semaphore(max_inflight)
+        self._lock = threading.Lock()
+        self._sessions: "weakref.WeakKeyDictionary[Any, Set[QueryHandle]]" = weakref.WeakKeyDictionary()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="query-executor", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable[[QueryHandle], Awaitable[str]], key: Any = None) -> QueryHandle:
+        # fn(handle) is awaited on the loop; it should handle.put() text as it arrives and return the answer
+        handle = QueryHandle()
+        handle.future = asyncio.run_coroutine_threadsafe(self._run(fn, handle), self._loop)
+        handle.future.add_done_callback(handle._close)
+        if key is not None:
+            with self._lock:
+                handles = self._sessions.get(key)
+                if handles is None:
+                    handles = self._sessions[key] = set()
+                handles.add(handle)
+            handle.future.add_done_callback(lambda future: self._forget(key, handle))
+        return handle
+
+    def _forget(self, key: Any, handle: QueryHandle) -> None:
+        with self._lock:
+            handles = self._sessions.get(key)
+            if handles is not None:
+                handles.discard(handle)
+
+    async def _run(self, fn: Callable[[QueryHandle], Awaitable[str]], handle: QueryHandle) -> str:
+        waiting_runs.inc()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            waiting_runs.dec()
+        metrics.record("query.queue_wait", time.perf_counter() - handle.submitted_at)
+        inflight_runs.inc()
+        try:
+            return await fn(handle)
+        finally:
+            inflight_runs.dec()
+            self._semaphore.release()
+
+    def cancel(self, key: Any) -> int:
+        # Cancel every unfinished question of one session, e.g. when the user resets it
+        with self._lock:
+            handles = list(self._sessions.get(key, ()))
+        return sum(handle.cancel() for handle in handles)
+
+    def stats(self) -> Dict[str, float]:
+        return {"in_flight": inflight_runs.value(), "waiting": waiting_runs.value(),
+                "max_inflight": self.max_inflight}
@@ -0,0 +1,163 @@
+import io
+import re
+import wave
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# Target segment length; each cut is moved to the quietest frame within SEARCH_SECONDS of the target
+SEGMENT_SECONDS = 60.0
+SEARCH_SECONDS = 10.0
+# Audio repeated at the start of each segment so words on a boundary are heard whole at least once
+OVERLAP_SECONDS = 1.0
+FRAME_MS = 30
+# How many words at a segment boundary are compared when removing text transcribed twice
+MAX_OVERLAP_WORDS = 12
+
+# 24-bit samples are widened to int32 when read and packed back to three bytes when written
+_SAMPLE_DTYPES = {1: np.uint8, 2: np.int16, 3: np.int32, 4: np.int32}
+_WORD_RE = re.compile(r"[\w']+")
+
+
+class WavAudio(NamedTuple):
+    samples: np.ndarray  # (frames,) mono, in the source sample width
+    rate: int
+    sample_width: int
+
+    @property
+    def seconds(self) -> float:
+        return len(self.samples) / self.rate
+
+
+def is_wav(data: bytes) -> bool:
+    return len(data) >= 12 and data[:4] == b"RIFF" and data[8:12] == b"WAVE"
+
+
+def wav_seconds(data: bytes) -> Optional[float]:
+    if not is_wav(data):
+        return None
+    try:
+        with wave.open(io.BytesIO(data), "rb") as reader:
+            return reader.getnframes() / reader.getframerate()
+    except (wave.Error, EOFError):
+        return None
+
+
+def read_wav(data: bytes) -> WavAudio:
+    with wave.open(io.BytesIO(data), "rb") as reader:
+        channels = reader.getnchannels()
+        sample_width = reader.getsampwidth()
+        rate = reader.getframerate()
+        frames = reader.readframes(reader.getnframes())
+    if sample_width not in _SAMPLE_DTYPES:
+        raise ValueError(f"Unsupported WAV sample width: {sample_width * 8} bits")
+    dtype = _SAMPLE_DTYPES[sample_width]
+    if sample_width == 3:
+        samples = _unpack_int24(frames)
+    else:
+        samples = np.frombuffer(frames, dtype=dtype)
+    samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+    if channels > 1:
+        # Transcription does not need stereo; mixing down halves what each segment uploads.
+        # Channels are summed column by column, which is far faster than reducing along axis 1.
+        mixed = samples[:, 0].astype(np.int64 if sample_width >= 3 else np.int32)
+        for channel in range(1, channels):
+            mixed += samples[:, channel]
+        samples = (mixed // channels).astype(dtype)
+    else:
+        samples = samples[:, 0]
+    return WavAudio(samples, rate, sample_width)
+
+
+def _unpack_int24(frames: bytes) -> np.ndarray:
+    # Each little-endian 3-byte sample goes into the top bytes of an int32; the arithmetic shift
+    # back down sign-extends it
+    raw = np.frombuffer(frames, dtype=np.uint8)
+    raw = raw[:len(raw) - len(raw) % 3].reshape(-1, 3)
+    widened = np.zeros((len(raw), 4), dtype=np.uint8)
+    widened[:, 1:] = raw
+    return widened.view("<i4")[:, 0] >> 8
+
+
+def _pack_int24(samples: np.ndarray) -> bytes:
+    return samples.astype("<i4").view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+
+def write_wav(audio: WavAudio, start: int, end: int) -> bytes:
+    out = io.BytesIO()
+    with wave.open(out, "wb") as writer:
+        writer.setnchannels(1)
+        writer.setsampwidth(audio.sample_width)
+        writer.setframerate(audio.rate)
+        samples = audio.samples[start:end]
+        writer.writeframes(_pack_int24(samples) if audio.sample_width == 3 else samples.tobytes())
+    return out.getvalue()
+
+
+def frame_rms(samples: np.ndarray, frame_length: int) -> np.ndarray:
+    # One RMS value per non-overlapping frame, in a single vectorized pass
+    usable = len(samples) - len(samples) % frame_length
+    frames = samples[:usable].astype(np.float32).reshape(-1, frame_length)
+    if samples.dtype == np.uint8:
+        frames -= 128.0
+    return np.sqrt(np.mean(frames * frames, axis=1))
+
+
+def find_split_points(audio: WavAudio, segment_seconds: float = SEGMENT_SECONDS,
+                      search_seconds: float = SEARCH_SECONDS, frame_ms: int = FRAME_MS) -> List[int]:
+    # Sample offsets to cut at: near every segment_seconds, at the quietest frame in the search window
+    frame_length = max(1, audio.rate * frame_ms // 1000)
+    rms = frame_rms(audio.samples, frame_length)
+    frames_per_segment = max(1, int(segment_seconds * 1000 / frame_ms))
+    search = int(search_seconds * 1000 / frame_ms)
+    cuts = []
+    previous = 0
+    while len(rms) - previous > frames_per_segment + search:
+        target = previous + frames_per_segment
+        low, high = max(previous + 1, target - search), min(len(rms), target + search + 1)
+        cut = low + int(np.argmin(rms[low:high]))
+        cuts.append(cut)
+        previous = cut
+    # Cut in the middle of the quiet frame
+    return [cut * frame_length + frame_length // 2 for cut in cuts]
+
+
+def split_wav(data: bytes, segment_seconds: float = SEGMENT_SECONDS, search_seconds: float = SEARCH_SECONDS,
+              overlap_seconds: float = OVERLAP_SECONDS) -> List[bytes]:
+    audio = read_wav(data)
+    bounds = [0] + find_split_points(audio, segment_seconds, search_seconds) + [len(audio.samples)]
+    overlap = int(overlap_seconds * audio.rate)
+    return [write_wav(audio, max(0, start - overlap), end) for start, end in zip(bounds, bounds[1:])]
+
+
+def _words(text: str) -> List[Tuple[str, int]]:
+    # Normalized words with the character offset where each one ends
+    return [(match.group().lower(), match.end()) for match in _WORD_RE.finditer(text)]
+
+
+def stitch_transcripts(texts: List[str], max_overlap_words: int = MAX_OVERLAP_WORDS) -> str:
+    # Join segment transcripts in order, dropping the words a segment repeats from the previous one
+    result = ""
+    for text in texts:
+        text = text.strip()
+        if not text:
+            continue
+        if result:
+            tail = [word for word, _ in _words(result)[-max_overlap_words:]]
+            head = _words(text)[:max_overlap_words]
+            skip = _overlap_length(tail, [word for word, _ in head])
+            if skip:
+                text = text[head[skip - 1][1]:].lstrip(" ,.;:!?-")
+            result = f"{result} {text}" if text else result
+        else:
+            result = text
+    return result
+
+
+def _overlap_length(tail: List[str], head: List[str]) -> int:
+    # Longest suffix of tail that is also a prefix of head
+    for size in range(min(len(tail), len(head)), 0, -1):
+        if tail[-size:] == head[:size]:
+            return size
+    return 0
+
@@ -0,0 +1,225 @@
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Set
+
+import advanced_rag
+from advanced_rag import RUN_TIMEOUT_SECONDS, AdvancedRAG
+
+# Answers a JSONL file of questions against one or more documents without the UI. Every question gets
+# its own thread on the same vector store, so answers never depend on the order they were asked in.
+# Results are appended to the output as they finish; rerunning with the same output skips questions
+# that were already answered and retries the ones that failed.
+
+DEFAULT_WORKERS = 8
+# Waiting on a question also covers the queue in front of it on the query executor
+QUESTION_TIMEOUT_SECONDS = RUN_TIMEOUT_SECONDS * 2
+PROGRESS_EVERY = 50
+# Ledger owner of the private stores batch runs create; they outlive the run so that the printed
+# vector_store_id can be passed back with --vector-store-id, and expire like session stores once unused
+BATCH_OWNER = "batch_qa"
+
+
+class Document(io.BytesIO):
+    # Just enough of Streamlit's UploadedFile for AdvancedRAG
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            super().__init__(f.read())
+        self.name = os.path.basename(path)
+
+
+def load_questions(path: str, id_field: str, question_field: str) -> List[dict]:
+    # One JSON object per line. The text is question_field, or else title and body joined, as in
+    # requests.jsonl; the id is id_field, then request_id, then the line number.
+    questions = []
+    seen: Set[str] = set()
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            text = record.get(question_field)
+            if not text:
+                text = "\n\n".join(str(record[field]) for field in ("title", "body") if record.get(field))
+            if not text:
+                raise ValueError(f"{path}:{line_number}: no '{question_field}', 'title' or 'body'")
+            question_id = record.get(id_field, record.get("request_id", line_number))
+            if str(question_id) in seen:
+                raise ValueError(f"{path}:{line_number}: duplicate id {question_id!r}")
+            seen.add(str(question_id))
+            questions.append({"id": question_id, "question": text})
+    return questions
+
+
+def answered_ids(path: str) -> Set[str]:
+    # Ids whose latest result in an earlier run's output is an answer, not an error
+    latest: Dict[str, bool] = {}
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # A line cut short when that run was killed
+                continue
+            latest[str(result.get("id"))] = result.get("error") is None
+    return {question_id for question_id, ok in latest.items() if ok}
+
+
+class ResultWriter:
+    def __init__(self, path: str):
+        # Start on a fresh line if an earlier run died mid-write
+        needs_newline = False
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self._file = open(path, "a", encoding="utf-8")
+        if needs_newline:
+            self._file.write("\n")
+        self._lock = threading.Lock()
+
+    def write(self, result: dict) -> None:
+        line = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def ingest(paths: List[str]) -> AdvancedRAG:
+    # One document goes through the registry, so a store indexed by an earlier run is reused
+    rag = AdvancedRAG()
+    documents = [Document(path) for path in paths]
+
+    def log(message: str) -> None:
+        print(message, file=sys.stderr, flush=True)
+
+    if len(documents) == 1:
+        rag.upload_document(documents[0], progress=log)
+    else:
+        rag.add_documents(documents, progress=log)
+    return rag
+
+
+def answer(item: dict, vector_store_id: str, file_ids: List[str], timeout: float) -> dict:
+    rag = AdvancedRAG()
+    rag.vector_store_id = vector_store_id
+    # The local index of these files gives model routing its retrieval confidence
+    rag.file_ids = list(file_ids)
+    started = time.perf_counter()
+    result = {"id": item["id"], "question": item["question"], "answer": None, "error": None}
+    handle = None
+    try:
+        rag.create_thread()
+        handle = rag.submit_question(item["question"])
+        result["answer"] = handle.result(timeout)
+    except Exception as e:
+        if handle is not None:
+            handle.cancel()
+        result["error"] = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+    finally:
+        rag.close()
+    finished = time.perf_counter()
+    result["seconds"] = round(finished - started, 3)
+    if handle is not None and handle.first_delta_at is not None:
+        result["first_token_seconds"] = round(handle.first_delta_at - started, 3)
+    # None when the answer came from the cache or from an identical question's run
+    result["run"] = rag.last_run_stats
+    return result
+
+
+def _quantile(ordered: List[float], q: float) -> Optional[float]:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+
+def run(questions: List[dict], vector_store_id: str, file_ids: List[str], writer: ResultWriter, workers: int,
+        timeout: float) -> Iterator[dict]:
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-qa")
+    futures = [pool.submit(answer, item, vector_store_id, file_ids, timeout) for item in questions]
+    try:
+        for future in as_completed(futures):
+            result = future.result()
+            writer.write(result)
+            yield result
+    finally:
+        # Interrupted: questions not yet started are dropped; those already asked finish or time out
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions against documents, without the UI")
+    parser.add_argument("documents", nargs="*", help="documents to upload as the knowledge base")
+    parser.add_argument("--questions", required=True, help="JSONL file, one question per line")
+    parser.add_argument("--output", required=True, help="JSONL results; appended to, and resumed from")
+    parser.add_argument("--vector-store-id", help="ask against an existing vector store instead of uploading")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="questions answered at once")
+    parser.add_argument("--timeout", type=float, default=QUESTION_TIMEOUT_SECONDS, help="seconds per question")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--question-field", default="question")
+    args = parser.parse_args()
+    if bool(args.documents) == bool(args.vector_store_id):
+        parser.error("give either documents or --vector-store-id")
+
+    questions = load_questions(args.questions, args.id_field, args.question_field)
+    done = answered_ids(args.output)
+    pending = [item for item in questions if str(item["id"]) not in done]
+    print(f"{len(questions)} questions, {len(questions) - len(pending)} already answered", file=sys.stderr)
+
+    owner = None
+    file_ids: List[str] = []
+    if args.vector_store_id:
+        vector_store_id = args.vector_store_id
+    else:
+        owner = ingest(args.documents)
+        vector_store_id, file_ids = owner.vector_store_id, owner.file_ids
+
+    writer = ResultWriter(args.output)
+    started = time.perf_counter()
+    seconds: List[float] = []
+    errors = 0
+    try:
+        for count, result in enumerate(run(pending, vector_store_id, file_ids, writer, args.workers, args.timeout), 1):
+            if result["error"] is not None:
+                errors += 1
+            else:
+                seconds.append(result["seconds"])
+            if count % PROGRESS_EVERY == 0 or count == len(pending):
+                elapsed = time.perf_counter() - started
+                print(f"{count}/{len(pending)} done, {errors} failed, {count / elapsed:.1f} questions/s",
+                      file=sys.stderr, flush=True)
+    finally:
+        writer.close()
+        if owner is not None:
+            if owner.owns_vector_store:
+                owner.resources.ledger.reassign(owner.vector_store_id, BATCH_OWNER)
+            owner.close()
+        # The threads opened for the questions are deleted now rather than by a later sweep
+        advanced_rag.get_resources().sweep()
+
+    seconds.sort()
+    wall = time.perf_counter() - started
+    print(json.dumps({
+        "questions": len(questions),
+        "skipped": len(questions) - len(pending),
+        "answered": len(seconds),
+        "errors": errors,
+        "wall_seconds": round(wall, 2),
+        "questions_per_s": round(len(pending) / wall, 2) if wall else 0.0,
+        "p50_seconds": _quantile(seconds, 0.5),
+        "p95_seconds": _quantile(seconds, 0.95),
+        "vector_store_id": vector_store_id,
+    }, indent=2))
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
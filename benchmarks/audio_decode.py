@@ -0,0 +1,65 @@
+import argparse
+import json
+import os
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from streamlit_audio_recorder.st_audiorec import decode_audio  # noqa: E402
+
+# The recorder produces 16-bit stereo WAV at 44.1 kHz
+BYTES_PER_SECOND = 44100 * 2 * 2
+
+
+def legacy_decode(raw_audio_data: dict) -> bytes:
+    # The per-sample conversion st_audiorec used before decode_audio
+    ind, raw_audio_data = zip(*raw_audio_data['arr'].items())
+    ind = np.array(ind, dtype=int)
+    raw_audio_data = np.array(raw_audio_data)
+    sorted_ints = raw_audio_data[ind]
+    stream = BytesIO(b"".join([int(v).to_bytes(1, "big") for v in sorted_ints]))
+    return stream.read()
+
+
+def _best_of(fn, payload, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(payload)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time st_audiorec payload decoding against recording length")
+    parser.add_argument("--seconds", type=int, nargs="+", default=[5, 15, 30, 60])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    rows = []
+    for seconds in args.seconds:
+        wav = rng.integers(0, 256, size=seconds * BYTES_PER_SECOND, dtype=np.uint8).tobytes()
+        # What the old frontend sent: a JSON object with one key per byte
+        legacy_payload = {"arr": {str(i): value for i, value in enumerate(wav)}}
+        row = {
+            "seconds": seconds,
+            "bytes": len(wav),
+            "bytes_payload_ms": round(_best_of(decode_audio, wav, args.repeat), 3),
+            "dict_payload_ms": round(_best_of(decode_audio, legacy_payload, args.repeat), 2),
+        }
+        assert decode_audio(legacy_payload) == wav
+        if not args.skip_legacy:
+            row["legacy_dict_payload_ms"] = round(_best_of(legacy_decode, legacy_payload, 1), 2)
+        rows.append(row)
+    print(json.dumps({"bytes_per_second": BYTES_PER_SECOND, "results": rows}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
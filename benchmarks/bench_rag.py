@@ -0,0 +1,179 @@
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import wave
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict, List
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_openai import parse_assignments, start_mock_server  # noqa: E402
+
+# Drives AdvancedRAG end to end against the local mock API: every session uploads a document, asks
+# questions, transcribes a voice note and synthesizes a reply, with sessions running concurrently.
+OPERATIONS = ("upload_document", "ask_question", "transcribe_audio", "synthesize_speech")
+
+
+class Upload(BytesIO):
+    # Just enough of Streamlit's UploadedFile for AdvancedRAG
+    def __init__(self, name: str, data: bytes):
+        super().__init__(data)
+        self.name = name
+
+
+def percentile(samples: List[float], q: float) -> float:
+    return float(np.percentile(samples, q)) if samples else 0.0
+
+
+def make_document(session: int, paragraphs: int) -> bytes:
+    lines = [f"Benchmark document {session}, section {i}: policy FX-{session:04d}-{i} covers item {i * 7}."
+             for i in range(paragraphs)]
+    return "\n\n".join(lines).encode("utf-8")
+
+
+def make_wav(seconds: float, rate: int = 16000) -> bytes:
+    # Tone bursts separated by near-silence, so long notes have places to split
+    t = np.arange(int(seconds * rate)) / rate
+    signal = np.sin(2 * np.pi * 220 * t) * (np.sin(2 * np.pi * 0.25 * t) > -0.2)
+    samples = (signal * 8000).astype(np.int16)
+    out = io.BytesIO()
+    with wave.open(out, "wb") as writer:
+        writer.setnchannels(1)
+        writer.setsampwidth(2)
+        writer.setframerate(rate)
+        writer.writeframes(samples.tobytes())
+    return out.getvalue()
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def time(self, operation: str, fn, *args, failed=lambda result: False):
+        # AdvancedRAG reports most failures in-band (a placeholder string or None), so `failed` decides
+        started = time.perf_counter()
+        try:
+            result = fn(*args)
+            ok = not failed(result)
+        except Exception:
+            result, ok = None, False
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            if ok:
+                self.samples[operation].append(elapsed)
+            else:
+                self.errors[operation] += 1
+        return result if ok else None
+
+    def summary(self, wall_seconds: float) -> Dict[str, dict]:
+        report = {}
+        for operation in OPERATIONS:
+            samples = self.samples.get(operation, [])
+            report[operation] = {
+                "count": len(samples),
+                "errors": self.errors.get(operation, 0),
+                "p50_ms": round(percentile(samples, 50) * 1000, 2),
+                "p95_ms": round(percentile(samples, 95) * 1000, 2),
+                "p99_ms": round(percentile(samples, 99) * 1000, 2),
+                "mean_ms": round(float(np.mean(samples)) * 1000, 2) if samples else 0.0,
+                "throughput_per_s": round(len(samples) / wall_seconds, 3) if wall_seconds else 0.0,
+            }
+        return report
+
+
+def run_session(rag_factory, session: int, args, recorder: Recorder, wav: bytes) -> None:
+    rag = rag_factory()
+    document = Upload(f"bench-{session}.txt", make_document(session, args.paragraphs))
+    if recorder.time("upload_document", rag.upload_document, document) is None:
+        return
+    for turn in range(args.questions):
+        question = f"What does policy FX-{session:04d}-{turn} cover?" if not args.repeat_questions \
+            else f"What does policy FX-0000-{turn} cover?"
+        recorder.time("ask_question", rag.ask_question, question,
+                      failed=lambda answer: answer.startswith("[") or answer.startswith("No response"))
+    if args.audio_seconds > 0:
+        recorder.time("transcribe_audio", rag.transcribe_audio, wav,
+                      failed=lambda text: text == "[Transcription failed]")
+    reply = f"Session {session} reply. Policy FX-{session:04d} covers the listed items."
+    recorder.time("synthesize_speech", rag.synthesize_speech, reply, failed=lambda audio: audio is None)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark AdvancedRAG against a local mock OpenAI API")
+    parser.add_argument("--sessions", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--questions", type=int, default=3, help="questions per session")
+    parser.add_argument("--paragraphs", type=int, default=40, help="paragraphs per uploaded document")
+    parser.add_argument("--audio-seconds", type=float, default=20.0, help="voice note length; 0 skips")
+    parser.add_argument("--repeat-questions", action="store_true", help="ask every session the same questions")
+    parser.add_argument("--latency", action="append", metavar="OPERATION=DIST")
+    parser.add_argument("--fault", action="append", metavar="OPERATION=RATE[:KIND]")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply every mock latency")
+    parser.add_argument("--answer-words", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    server = start_mock_server(parse_assignments(args.latency), parse_assignments(args.fault),
+                               args.latency_scale, args.seed, answer_words=args.answer_words)
+    scratch = tempfile.mkdtemp(prefix="rag-bench-")
+    # Everything the app persists goes to a throwaway directory; settings must be in place before import
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-mock",
+        "OPENAI_BASE_URL": server.base_url,
+        "ASSISTANT_ID": "asst_mock",
+        "RAG_INDEX_PATH": os.path.join(scratch, "chunks.idx"),
+        "RAG_REGISTRY_PATH": os.path.join(scratch, "registry.sqlite3"),
+        "RAG_SPEECH_CACHE_PATH": os.path.join(scratch, "speech"),
+        "RAG_RESOURCE_LEDGER_PATH": os.path.join(scratch, "resources.sqlite3"),
+    })
+    import advanced_rag
+
+    recorder = Recorder()
+    wav = make_wav(args.audio_seconds) if args.audio_seconds > 0 else b""
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for future in [pool.submit(run_session, advanced_rag.AdvancedRAG, session, args, recorder, wav)
+                           for session in range(args.sessions)]:
+                future.result()
+        wall_seconds = time.perf_counter() - started
+    finally:
+        server.shutdown()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "python": platform.python_version(),
+        "wall_seconds": round(wall_seconds, 3),
+        "operations": recorder.summary(wall_seconds),
+        "server": server.state.stats(),
+        "embeddings": advanced_rag.get_embedder().stats(),
+        "single_flight": advanced_rag.get_single_flight().stats(),
+        "resilience": advanced_rag.get_resilience().stats(),
+        "stages": advanced_rag.metrics.stage_summary(),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Each probe runs in a fresh interpreter so nothing is warm from a previous one
+PROBES = {
+    "import_advanced_rag": "import advanced_rag",
+    "first_client": (
+        "import time, process_resources; t = time.perf_counter(); process_resources.get_client(); "
+        "print(time.perf_counter() - t)"
+    ),
+    "first_session": (
+        "import time, advanced_rag; t = time.perf_counter(); advanced_rag.AdvancedRAG(); "
+        "print(time.perf_counter() - t)"
+    ),
+}
+
+
+def _run(code: str, env: Dict[str, str]) -> float:
+    # Wall time of the whole interpreter, or the inner timing when the probe prints one
+    wrapped = (
+        "import time; _t = time.perf_counter()\n"
+        f"{code}\n"
+        "print(time.perf_counter() - _t)"
+    )
+    result = subprocess.run([sys.executable, "-c", wrapped], cwd=ROOT, env=env, capture_output=True,
+                            text=True, check=True)
+    lines = result.stdout.split()
+    return float(lines[0]) if len(lines) > 1 else float(lines[-1])
+
+
+def import_profile(module: str, env: Dict[str, str], top: int) -> List[Dict[str, object]]:
+    # Heaviest direct imports of `module` by cumulative import time, from -X importtime
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    packages: Dict[str, int] = {}
+    children: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        cumulative = cumulative.strip()
+        # Nesting is two spaces per level after the separator; depth 1 is what `module` itself imports
+        # and children are printed before their parent, so they are collected until the parent appears
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if not cumulative.isdigit():
+            continue
+        if depth == 1:
+            children[name.strip()] = int(cumulative)
+        elif depth == 0:
+            if name.strip() == module:
+                packages = children
+            children = {}
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [{"module": name, "cumulative_ms": round(us / 1000, 2)} for name, us in ranked]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure import and cold-start time of the RAG modules")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # Client construction needs a key but never sends a request
+    env.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    scratch = tempfile.mkdtemp(prefix="rag-bench-")
+    env.setdefault("RAG_INDEX_PATH", os.path.join(scratch, "chunks.idx"))
+    env.setdefault("RAG_REGISTRY_PATH", os.path.join(scratch, "registry.sqlite3"))
+    report = {"python": sys.version.split()[0], "repeat": args.repeat, "probes": {}}
+    for name, code in PROBES.items():
+        samples = [_run(code, env) * 1000 for _ in range(args.repeat)]
+        report["probes"][name] = {
+            "median_ms": round(statistics.median(samples), 2),
+            "min_ms": round(min(samples), 2),
+            "max_ms": round(max(samples), 2),
+        }
+    report["import_profile"] = import_profile("advanced_rag", env, args.top)
+    shutil.rmtree(scratch, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
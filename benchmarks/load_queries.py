@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+
+# How many concurrent chat sessions one process sustains. Each level opens that many sessions, and every
+# session asks its questions back to back, either through the asyncio query executor (submit_question)
+# or with one blocking thread per session (ask_question_stream). The mock API runs in a separate process
+# so its threads and CPU are not counted against the app.
+
+
+def percentile_ms(samples: List[float], q: float) -> float:
+    return round(float(np.percentile(samples, q)) * 1000, 1) if samples else 0.0
+
+
+def start_mock(args) -> "tuple[subprocess.Popen, str]":
+    command = [sys.executable, os.path.join(ROOT, "mock_openai.py"), "--port", "0",
+               "--latency-scale", str(args.latency_scale), "--answer-words", str(args.answer_words),
+               "--seed", str(args.seed)]
+    for spec in args.latency or []:
+        command += ["--latency", spec]
+    for spec in args.fault or []:
+        command += ["--fault", spec]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    match = re.search(r"(http://\S+/v1)", process.stdout.readline())
+    if match is None:
+        process.kill()
+        raise RuntimeError("mock server did not start")
+    return process, match.group(1)
+
+
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: List[float] = []
+        self.first_tokens: List[float] = []
+        self.errors = 0
+
+    def add(self, seconds: float, first_token: float) -> None:
+        with self._lock:
+            self.latencies.append(seconds)
+            self.first_tokens.append(first_token)
+
+    def fail(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+
+class Sampler:
+    # Peak threads in this process and peak runs in flight on the executor, sampled every 50 ms
+    def __init__(self, executor=None):
+        self.executor = executor
+        self.peak_threads = 0
+        self.peak_inflight = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(0.05):
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            if self.executor is not None:
+                self.peak_inflight = max(self.peak_inflight, int(self.executor.stats()["in_flight"]))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_async(sessions, questions: int, results: Results) -> None:
+    # Every session's next question is submitted from the previous one's completion callback,
+    # so no thread ever waits on a run
+    remaining = threading.Semaphore(0)
+    total = len(sessions) * questions
+
+    def ask(rag, turn: int) -> None:
+        handle = rag.submit_question(f"Question {turn} from {id(rag)}?")
+
+        def done(future) -> None:
+            if future.cancelled() or future.exception() is not None:
+                results.fail()
+            else:
+                finished = time.perf_counter()
+                results.add(finished - handle.submitted_at, (handle.first_delta_at or finished) - handle.submitted_at)
+            if turn + 1 < questions:
+                ask(rag, turn + 1)
+            remaining.release()
+
+        handle.future.add_done_callback(done)
+
+    for rag in sessions:
+        ask(rag, 0)
+    for _ in range(total):
+        remaining.acquire()
+
+
+def run_sync(sessions, questions: int, results: Results) -> None:
+    def session(rag) -> None:
+        for turn in range(questions):
+            started = time.perf_counter()
+            first = None
+            try:
+                for _ in rag.ask_question_stream(f"Question {turn} from {id(rag)}?"):
+                    first = first or time.perf_counter()
+                if first is None:
+                    raise RuntimeError("empty answer")
+            except Exception:
+                results.fail()
+                continue
+            results.add(time.perf_counter() - started, first - started)
+
+    with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+        list(pool.map(session, sessions))
+
+
+def make_sessions(advanced_rag, count: int):
+    # Sessions with a thread and no vector store, so every question is a full streamed run
+    def make(_):
+        rag = advanced_rag.AdvancedRAG()
+        rag.thread_id = advanced_rag.get_client().beta.threads.create().id
+        return rag
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        return list(pool.map(make, range(count)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the query executor against a local mock OpenAI API")
+    parser.add_argument("--levels", default="25,50,100,200,400", help="concurrent sessions per level")
+    parser.add_argument("--questions", type=int, default=3, help="questions per session, asked back to back")
+    parser.add_argument("--mode", choices=("async", "sync", "both"), default="both")
+    parser.add_argument("--max-inflight", type=int, default=256, help="RAG_MAX_INFLIGHT_RUNS for the executor")
+    parser.add_argument("--slo-p95-ms", type=float, default=10000.0,
+                        help="a level is sustained if answer p95 stays under this and errors under 1%%")
+    parser.add_argument("--latency", action="append", metavar="OPERATION=DIST")
+    parser.add_argument("--fault", action="append", metavar="OPERATION=RATE[:KIND]")
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--answer-words", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--hedge", action="store_true",
+                        help="hedge runs still queued past the p95 queue time (RAG_HEDGE_RUNS, executor only)")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    mock, base_url = start_mock(args)
+    scratch = tempfile.mkdtemp(prefix="rag-load-")
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-mock",
+        "OPENAI_BASE_URL": base_url,
+        "ASSISTANT_ID": "asst_mock",
+        "RAG_INDEX_PATH": os.path.join(scratch, "chunks.idx"),
+        "RAG_REGISTRY_PATH": os.path.join(scratch, "registry.sqlite3"),
+        "RAG_SPEECH_CACHE_PATH": os.path.join(scratch, "speech"),
+        "RAG_RESOURCE_LEDGER_PATH": os.path.join(scratch, "resources.sqlite3"),
+        "RAG_MAX_INFLIGHT_RUNS": str(args.max_inflight),
+    })
+    if args.hedge:
+        os.environ["RAG_HEDGE_RUNS"] = "1"
+    import advanced_rag
+
+    modes = ("async", "sync") if args.mode == "both" else (args.mode,)
+    levels = [int(level) for level in args.levels.split(",")]
+    rows: List[Dict[str, object]] = []
+    try:
+        for mode in modes:
+            executor = advanced_rag.get_query_executor() if mode == "async" else None
+            for level in levels:
+                sessions = make_sessions(advanced_rag, level)
+                results = Results()
+                started, cpu_started = time.perf_counter(), time.process_time()
+                with Sampler(executor) as sampler:
+                    (run_async if mode == "async" else run_sync)(sessions, args.questions, results)
+                wall = time.perf_counter() - started
+                cpu = time.process_time() - cpu_started
+                total = level * args.questions
+                p95 = percentile_ms(results.latencies, 95)
+                rows.append({
+                    "mode": mode,
+                    "sessions": level,
+                    "questions": total,
+                    "errors": results.errors,
+                    "wall_seconds": round(wall, 2),
+                    "answers_per_s": round(len(results.latencies) / wall, 2),
+                    "p50_ms": percentile_ms(results.latencies, 50),
+                    "p95_ms": p95,
+                    "p99_ms": percentile_ms(results.latencies, 99),
+                    "first_token_p50_ms": percentile_ms(results.first_tokens, 50),
+                    "first_token_p95_ms": percentile_ms(results.first_tokens, 95),
+                    # Near 1.0 means this process, not the API, is the bottleneck
+                    "cpu_utilisation": round(cpu / wall, 2),
+                    "peak_threads": sampler.peak_threads,
+                    "peak_runs_in_flight": sampler.peak_inflight if executor else None,
+                    "sustained": results.errors <= 0.01 * total and p95 <= args.slo_p95_ms,
+                })
+                print(json.dumps(rows[-1]), file=sys.stderr, flush=True)
+    finally:
+        mock.terminate()
+        mock.wait()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "python": platform.python_version(),
+        "levels": rows,
+        "max_sustained_sessions": {
+            mode: max([row["sessions"] for row in rows if row["mode"] == mode and row["sustained"]], default=0)
+            for mode in modes
+        },
+        # Retries, circuit states and hedges over the whole run
+        "resilience": advanced_rag.get_resilience().stats(),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,873 @@
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Stand-in for the parts of the OpenAI API this project calls: files, vector stores (and their files and
+# file batches), threads, messages, streamed runs, audio transcriptions and speech, and embeddings.
+# Every operation draws its latency from a configurable distribution and can inject failures.
+# The "runs.failed" fault lets a started run fail server-side (status failed, last_error server_error,
+# or rate_limit_exceeded for KIND 429) instead of failing the request, and "vector_stores.files.failed"
+# makes attached files end their indexing failed.
+# As on the real API, a thread refuses new messages and runs while a run on it is active, a cancelled
+# run stays "cancelling" for runs.cancelling before it is "cancelled", and a run whose stream the client
+# dropped without cancelling it carries on to the end.
+
+DEFAULT_LATENCY_MS = {
+    "files.create": "lognormal:300:0.4",
+    "files.delete": "lognormal:80:0.3",
+    "vector_stores.create": "lognormal:150:0.3",
+    "vector_stores.list": "lognormal:120:0.3",
+    "vector_stores.retrieve": "lognormal:60:0.3",
+    "vector_stores.delete": "lognormal:80:0.3",
+    "vector_stores.files.create": "lognormal:400:0.4",
+    "vector_stores.files.retrieve": "lognormal:60:0.3",
+    "vector_stores.files.delete": "lognormal:80:0.3",
+    "vector_stores.file_batches.create": "lognormal:600:0.4",
+    "vector_stores.file_batches.retrieve": "lognormal:60:0.3",
+    "vector_stores.file_batches.list_files": "lognormal:60:0.3",
+    # From attaching a file until file_search can see it; polled, never slept on
+    "vector_stores.indexing": "lognormal:1500:0.5",
+    "threads.create": "lognormal:100:0.3",
+    "threads.update": "lognormal:80:0.3",
+    "threads.delete": "lognormal:80:0.3",
+    "messages.create": "lognormal:90:0.3",
+    "messages.list": "lognormal:90:0.3",
+    "messages.delete": "lognormal:80:0.3",
+    # Until the run is created, then queued for runs.queue; then a file_search step, and each delta
+    # after the first adds runs.delta
+    "runs.create": "lognormal:650:0.5",
+    "runs.queue": "fixed:0",
+    "runs.file_search": "lognormal:250:0.4",
+    "runs.delta": "fixed:15",
+    # Runs that override the model stream at runs.delta.<model> when it is set
+    "runs.delta.gpt-4o-mini": "fixed:6",
+    "runs.cancel": "lognormal:80:0.3",
+    "runs.cancelling": "lognormal:300:0.4",
+    "runs.list": "lognormal:60:0.3",
+    "runs.retrieve": "lognormal:60:0.3",
+    "audio.transcriptions": "lognormal:1200:0.4",
+    "audio.speech": "lognormal:500:0.4",
+    "embeddings": "lognormal:120:0.3",
+}
+FAULT_KINDS = ("500", "503", "429", "reset", "hang")
+ANSWER_WORDS = 40
+HEDGE_ANSWER = "I couldn't find that in the provided documents."
+EMBEDDING_DIM = 1536
+ACTIVE_RUN_STATUSES = ("queued", "in_progress", "requires_action", "cancelling")
+_FILENAME_RE = re.compile(rb'filename="([^"]*)"')
+
+
+class Latency:
+    # "fixed:MS", "uniform:LO:HI", "normal:MEAN:SD" or "lognormal:MEDIAN:SIGMA", all in milliseconds
+    def __init__(self, spec: str):
+        kind, *params = spec.split(":")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution {spec!r}")
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            ms = self.params[0]
+        elif self.kind == "uniform":
+            ms = rng.uniform(*self.params)
+        elif self.kind == "normal":
+            ms = rng.gauss(*self.params)
+        else:
+            ms = self.params[0] * rng.lognormvariate(0.0, self.params[1])
+        return max(0.0, ms) / 1000.0
+
+
+class Fault:
+    # "RATE" or "RATE:KIND"; KIND is one of FAULT_KINDS and defaults to 500
+    def __init__(self, spec: str):
+        rate, _, kind = spec.partition(":")
+        self.rate = float(rate)
+        self.kind = kind or "500"
+        if self.kind not in FAULT_KINDS:
+            raise ValueError(f"Unknown fault kind {self.kind!r}; expected one of {FAULT_KINDS}")
+
+
+def parse_assignments(values: List[str]) -> Dict[str, str]:
+    # ["runs.create=fixed:200", "audio.speech=0.1:429"] -> {"runs.create": "fixed:200", ...}
+    assignments = {}
+    for value in values or []:
+        name, _, spec = value.partition("=")
+        if not spec:
+            raise ValueError(f"Expected OPERATION=SPEC, got {value!r}")
+        assignments[name] = spec
+    return assignments
+
+
+def _now() -> int:
+    return int(time.time())
+
+
+def _new_id(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+def _file_counts(completed: int = 0, in_progress: int = 0, failed: int = 0) -> dict:
+    return {"in_progress": in_progress, "completed": completed, "failed": failed, "cancelled": 0,
+            "total": completed + in_progress + failed}
+
+
+def _text_message(message_id: str, thread_id: str, role: str, text: str, run_id: Optional[str] = None,
+                  assistant_id: Optional[str] = None, status: str = "completed") -> dict:
+    return {
+        "id": message_id, "object": "thread.message", "created_at": _now(), "thread_id": thread_id,
+        "role": role, "status": status, "assistant_id": assistant_id, "run_id": run_id, "attachments": [],
+        "metadata": {}, "completed_at": _now() if status == "completed" else None, "incomplete_at": None,
+        "incomplete_details": None,
+        "content": [{"type": "text", "text": {"value": text, "annotations": []}}] if text else [],
+    }
+
+
+class MockState:
+    def __init__(self, latency: Dict[str, str], faults: Dict[str, str], latency_scale: float = 1.0,
+                 seed: int = 0):
+        specs = dict(DEFAULT_LATENCY_MS)
+        specs.update(latency)
+        self.latency = {name: Latency(spec) for name, spec in specs.items()}
+        self.faults = {name: Fault(spec) for name, spec in faults.items()}
+        self.latency_scale = latency_scale
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.files: Dict[str, dict] = {}
+        self.vector_stores: Dict[str, dict] = {}
+        # (vector store, file) -> monotonic time its indexing completes
+        self.indexed_at: Dict[Tuple[str, str], float] = {}
+        # (vector store, file) pairs whose indexing ends failed
+        self.index_failures: set = set()
+        self.batches: Dict[str, Tuple[str, List[str]]] = {}
+        self.threads: Dict[str, dict] = {}
+        self.messages: Dict[str, List[dict]] = defaultdict(list)
+        # run id -> {"id", "thread_id", "assistant_id", "status", "body"}, in creation order
+        self.runs: Dict[str, dict] = {}
+        self.requests: Dict[str, int] = defaultdict(int)
+        self.injected: Dict[str, int] = defaultdict(int)
+
+    def delay(self, operation: str) -> float:
+        latency = self.latency.get(operation)
+        if latency is None:
+            return 0.0
+        with self._lock:
+            return latency.sample(self._rng) * self.latency_scale
+
+    def chance(self, rate: float) -> bool:
+        with self._lock:
+            return self._rng.random() < rate
+
+    def fault(self, operation: str) -> Optional[str]:
+        fault = self.faults.get(operation) or self.faults.get("*")
+        with self._lock:
+            self.requests[operation] += 1
+            if fault is not None and self._rng.random() < fault.rate:
+                self.injected[operation] += 1
+                return fault.kind
+        return None
+
+    def active_run(self, thread_id: str) -> Optional[dict]:
+        for run in reversed(list(self.runs.values())):
+            if run["thread_id"] == thread_id and run["status"] in ACTIVE_RUN_STATUSES:
+                return run
+        return None
+
+    def start_run(self, thread_id: str, assistant_id: str, body: dict) -> Optional[dict]:
+        # None while another run on the thread is active
+        with self._lock:
+            if self.active_run(thread_id) is not None:
+                return None
+            run = {"id": _new_id("run"), "thread_id": thread_id, "assistant_id": assistant_id, "status": "queued",
+                   "body": body}
+            self.runs[run["id"]] = run
+            return run
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"requests": dict(self.requests), "injected_faults": dict(self.injected)}
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.requests.clear()
+            self.injected.clear()
+
+
+def _embedding(text: str, dimensions: int) -> np.ndarray:
+    # Deterministic per text, so repeated inputs embed identically
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, delayed ACKs add ~40 ms per response
+    disable_nagle_algorithm = True
+    server: "MockServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- plumbing ---
+
+    def _body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b"".join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _json_body(self, raw: bytes) -> dict:
+        return json.loads(raw) if raw else {}
+
+    def _send(self, status: int, payload: bytes, content_type: str = "application/json",
+              headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("x-request-id", _new_id("req"))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _json(self, payload: dict, status: int = 200) -> None:
+        self._send(status, json.dumps(payload).encode("utf-8"))
+
+    def _error(self, status: int, message: str, headers: Optional[Dict[str, str]] = None) -> None:
+        error_type = "rate_limit_exceeded" if status == 429 else "server_error" if status >= 500 else "invalid_request_error"
+        body = {"error": {"message": message, "type": error_type, "param": None, "code": error_type}}
+        self._send(status, json.dumps(body).encode("utf-8"), headers=headers)
+
+    def _inject(self, operation: str) -> bool:
+        # True when a fault was injected and the request is already answered (or dropped)
+        kind = self.server.state.fault(operation)
+        time.sleep(self.server.state.delay(operation))
+        if kind is None:
+            return False
+        if kind == "429":
+            self._error(429, "Rate limit reached (injected)", {"retry-after": "0.2"})
+        elif kind in ("500", "503"):
+            self._error(int(kind), f"Injected {kind} for {operation}")
+        elif kind == "hang":
+            # Long enough for any client timeout to fire first
+            time.sleep(self.server.hang_seconds)
+            self.close_connection = True
+        else:
+            self.close_connection = True
+        return True
+
+    def _chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _event(self, event: str, data) -> None:
+        payload = data if isinstance(data, str) else json.dumps(data)
+        self._chunk(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+
+    # --- routing ---
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+    def _route(self, method: str) -> None:
+        path = self.path.split("?", 1)[0].rstrip("/")
+        path = path[len("/v1"):] if path.startswith("/v1") else path
+        parts = path.strip("/").split("/")
+        raw = self._body()
+        for route_method, pattern, handler in ROUTES:
+            if route_method != method or len(pattern) != len(parts):
+                continue
+            if all(p.startswith("{") or p == part for p, part in zip(pattern, parts)):
+                args = [part for p, part in zip(pattern, parts) if p.startswith("{")]
+                try:
+                    handler(self, raw, *args)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+                return
+        self._error(404, f"No mock for {method} {self.path}")
+
+    # --- files ---
+
+    def files_create(self, raw: bytes) -> None:
+        if self._inject("files.create"):
+            return
+        match = _FILENAME_RE.search(raw)
+        file_obj = {
+            "id": _new_id("file"), "object": "file", "bytes": len(raw), "created_at": _now(),
+            "filename": match.group(1).decode("utf-8", "replace") if match else "upload",
+            "purpose": "assistants", "status": "processed", "status_details": None,
+        }
+        self.server.state.files[file_obj["id"]] = file_obj
+        self._json(file_obj)
+
+    def files_delete(self, raw: bytes, file_id: str) -> None:
+        if self._inject("files.delete"):
+            return
+        self.server.state.files.pop(file_id, None)
+        self._json({"id": file_id, "object": "file", "deleted": True})
+
+    # --- vector stores ---
+
+    def _vector_store(self, store_id: str) -> Optional[dict]:
+        store = self.server.state.vector_stores.get(store_id)
+        if store is None:
+            self._error(404, f"No vector store found with id '{store_id}'.")
+        return store
+
+    def vector_stores_create(self, raw: bytes) -> None:
+        if self._inject("vector_stores.create"):
+            return
+        body = self._json_body(raw)
+        store = {
+            "id": _new_id("vs"), "object": "vector_store", "created_at": _now(), "name": body.get("name", ""),
+            "usage_bytes": 0, "file_counts": _file_counts(), "status": "completed", "last_active_at": _now(),
+            "metadata": {}, "expires_after": body.get("expires_after"), "expires_at": None, "file_ids": [],
+        }
+        self.server.state.vector_stores[store["id"]] = store
+        self._json(self._store_json(store))
+
+    def vector_stores_list(self, raw: bytes) -> None:
+        if self._inject("vector_stores.list"):
+            return
+        query = dict(part.split("=", 1) for part in self.path.partition("?")[2].split("&") if "=" in part)
+        stores = sorted(self.server.state.vector_stores.values(), key=lambda store: store["created_at"],
+                        reverse=query.get("order", "desc") == "desc")
+        ids = [store["id"] for store in stores]
+        if query.get("after") in ids:
+            stores = stores[ids.index(query["after"]) + 1:]
+        limit = int(query.get("limit", 20))
+        page = [self._store_json(store) for store in stores[:limit]]
+        self._json({"object": "list", "data": page, "first_id": page[0]["id"] if page else None,
+                    "last_id": page[-1]["id"] if page else None, "has_more": len(stores) > limit})
+
+    def vector_stores_retrieve(self, raw: bytes, store_id: str) -> None:
+        if self._inject("vector_stores.retrieve"):
+            return
+        store = self._vector_store(store_id)
+        if store is not None:
+            self._json(self._store_json(store))
+
+    def vector_stores_delete(self, raw: bytes, store_id: str) -> None:
+        if self._inject("vector_stores.delete"):
+            return
+        self.server.state.vector_stores.pop(store_id, None)
+        self._json({"id": store_id, "object": "vector_store.deleted", "deleted": True})
+
+    def _attach(self, store: dict, file_ids: List[str]) -> None:
+        state = self.server.state
+        store["file_ids"].extend(file_ids)
+        for file_id in file_ids:
+            state.indexed_at[(store["id"], file_id)] = time.monotonic() + state.delay("vector_stores.indexing")
+            if state.fault("vector_stores.files.failed") is not None:
+                state.index_failures.add((store["id"], file_id))
+
+    def _file_status(self, store_id: str, file_id: str) -> str:
+        state = self.server.state
+        if time.monotonic() < state.indexed_at.get((store_id, file_id), 0.0):
+            return "in_progress"
+        return "failed" if (store_id, file_id) in state.index_failures else "completed"
+
+    def _counts(self, store_id: str, file_ids: List[str]) -> dict:
+        statuses = [self._file_status(store_id, file_id) for file_id in file_ids]
+        return _file_counts(statuses.count("completed"), statuses.count("in_progress"), statuses.count("failed"))
+
+    def _store_json(self, store: dict) -> dict:
+        payload = {k: v for k, v in store.items() if k != "file_ids"}
+        payload["file_counts"] = self._counts(store["id"], store["file_ids"])
+        payload["status"] = "in_progress" if payload["file_counts"]["in_progress"] else "completed"
+        return payload
+
+    def _store_file_json(self, store_id: str, file_id: str) -> dict:
+        status = self._file_status(store_id, file_id)
+        last_error = {"code": "server_error", "message": "Injected indexing failure"} if status == "failed" else None
+        return {"id": file_id, "object": "vector_store.file", "usage_bytes": 0, "created_at": _now(),
+                "vector_store_id": store_id, "status": status, "last_error": last_error}
+
+    def vector_store_files_create(self, raw: bytes, store_id: str) -> None:
+        if self._inject("vector_stores.files.create"):
+            return
+        store = self._vector_store(store_id)
+        if store is None:
+            return
+        file_id = self._json_body(raw)["file_id"]
+        self._attach(store, [file_id])
+        self._json(self._store_file_json(store_id, file_id))
+
+    def vector_store_files_retrieve(self, raw: bytes, store_id: str, file_id: str) -> None:
+        if self._inject("vector_stores.files.retrieve"):
+            return
+        store = self._vector_store(store_id)
+        if store is None:
+            return
+        if file_id not in store["file_ids"]:
+            self._error(404, f"No file found with id '{file_id}' in vector store '{store_id}'.")
+            return
+        self._json(self._store_file_json(store_id, file_id))
+
+    def vector_store_files_delete(self, raw: bytes, store_id: str, file_id: str) -> None:
+        if self._inject("vector_stores.files.delete"):
+            return
+        store = self._vector_store(store_id)
+        if store is None:
+            return
+        store["file_ids"] = [other for other in store["file_ids"] if other != file_id]
+        self._json({"id": file_id, "object": "vector_store.file.deleted", "deleted": True})
+
+    def _batch_json(self, batch_id: str) -> dict:
+        store_id, file_ids = self.server.state.batches[batch_id]
+        counts = self._counts(store_id, file_ids)
+        return {"id": batch_id, "object": "vector_store.files_batch", "created_at": _now(),
+                "vector_store_id": store_id, "status": "in_progress" if counts["in_progress"] else "completed",
+                "file_counts": counts}
+
+    def vector_store_file_batches_create(self, raw: bytes, store_id: str) -> None:
+        if self._inject("vector_stores.file_batches.create"):
+            return
+        store = self._vector_store(store_id)
+        if store is None:
+            return
+        file_ids = self._json_body(raw).get("file_ids", [])
+        self._attach(store, file_ids)
+        batch_id = _new_id("vsfb")
+        self.server.state.batches[batch_id] = (store_id, file_ids)
+        self._json(self._batch_json(batch_id))
+
+    def vector_store_file_batches_retrieve(self, raw: bytes, store_id: str, batch_id: str) -> None:
+        if self._inject("vector_stores.file_batches.retrieve"):
+            return
+        if batch_id not in self.server.state.batches:
+            self._error(404, f"No file batch found with id '{batch_id}'.")
+            return
+        self._json(self._batch_json(batch_id))
+
+    def vector_store_file_batches_files(self, raw: bytes, store_id: str, batch_id: str) -> None:
+        if self._inject("vector_stores.file_batches.list_files"):
+            return
+        if batch_id not in self.server.state.batches:
+            self._error(404, f"No file batch found with id '{batch_id}'.")
+            return
+        query = dict(part.split("=", 1) for part in self.path.partition("?")[2].split("&") if "=" in part)
+        files = [self._store_file_json(store_id, file_id) for file_id in self.server.state.batches[batch_id][1]]
+        if "filter" in query:
+            files = [vs_file for vs_file in files if vs_file["status"] == query["filter"]]
+        ids = [vs_file["id"] for vs_file in files]
+        if query.get("after") in ids:
+            files = files[ids.index(query["after"]) + 1:]
+        limit = int(query.get("limit", 20))
+        page = files[:limit]
+        self._json({"object": "list", "data": page, "first_id": page[0]["id"] if page else None,
+                    "last_id": page[-1]["id"] if page else None, "has_more": len(files) > limit})
+
+    # --- threads, messages, runs ---
+
+    def _thread_json(self, thread: dict) -> dict:
+        return {"id": thread["id"], "object": "thread", "created_at": thread["created_at"], "metadata": {},
+                "tool_resources": thread["tool_resources"]}
+
+    def threads_create(self, raw: bytes) -> None:
+        if self._inject("threads.create"):
+            return
+        body = self._json_body(raw)
+        thread = {"id": _new_id("thread"), "created_at": _now(), "tool_resources": body.get("tool_resources")}
+        self.server.state.threads[thread["id"]] = thread
+        for seed in body.get("messages") or []:
+            content = seed.get("content")
+            text = content if isinstance(content, str) else " ".join(part.get("text", "") for part in content or [])
+            self.server.state.messages[thread["id"]].append(
+                _text_message(_new_id("msg"), thread["id"], seed.get("role", "user"), text))
+        self._json(self._thread_json(thread))
+
+    def _thread(self, thread_id: str) -> Optional[dict]:
+        thread = self.server.state.threads.get(thread_id)
+        if thread is None:
+            self._error(404, f"No thread found with id '{thread_id}'.")
+        return thread
+
+    def threads_update(self, raw: bytes, thread_id: str) -> None:
+        if self._inject("threads.update"):
+            return
+        thread = self._thread(thread_id)
+        if thread is not None:
+            thread["tool_resources"] = self._json_body(raw).get("tool_resources", thread["tool_resources"])
+            self._json(self._thread_json(thread))
+
+    def threads_delete(self, raw: bytes, thread_id: str) -> None:
+        if self._inject("threads.delete"):
+            return
+        if self.server.state.threads.pop(thread_id, None) is None:
+            self._error(404, f"No thread found with id '{thread_id}'.")
+            return
+        self.server.state.messages.pop(thread_id, None)
+        self._json({"id": thread_id, "object": "thread.deleted", "deleted": True})
+
+    def _refuse_if_busy(self, thread_id: str) -> bool:
+        run = self.server.state.active_run(thread_id)
+        if run is not None:
+            self._error(400, f"Can't add messages to {thread_id} while a run {run['id']} is active.")
+        return run is not None
+
+    def messages_create(self, raw: bytes, thread_id: str) -> None:
+        if self._inject("messages.create"):
+            return
+        if self._thread(thread_id) is None or self._refuse_if_busy(thread_id):
+            return
+        body = self._json_body(raw)
+        content = body.get("content")
+        text = content if isinstance(content, str) else " ".join(part.get("text", "") for part in content or [])
+        message = _text_message(_new_id("msg"), thread_id, body.get("role", "user"), text)
+        self.server.state.messages[thread_id].append(message)
+        self._json(message)
+
+    def messages_delete(self, raw: bytes, thread_id: str, message_id: str) -> None:
+        if self._inject("messages.delete"):
+            return
+        if self._thread(thread_id) is None:
+            return
+        messages = self.server.state.messages[thread_id]
+        messages[:] = [message for message in messages if message["id"] != message_id]
+        self._json({"id": message_id, "object": "thread.message.deleted", "deleted": True})
+
+    def messages_list(self, raw: bytes, thread_id: str) -> None:
+        if self._inject("messages.list"):
+            return
+        if self._thread(thread_id) is None:
+            return
+        query = dict(part.split("=", 1) for part in self.path.partition("?")[2].split("&") if "=" in part)
+        messages = list(self.server.state.messages[thread_id])
+        if query.get("order", "desc") == "desc":
+            messages.reverse()
+        ids = [message["id"] for message in messages]
+        if query.get("after") in ids:
+            messages = messages[ids.index(query["after"]) + 1:]
+        limit = int(query.get("limit", 20))
+        page = messages[:limit]
+        self._json({"object": "list", "data": page, "first_id": page[0]["id"] if page else None,
+                    "last_id": page[-1]["id"] if page else None, "has_more": len(messages) > limit})
+
+    def _run(self, run_id: str, thread_id: str, assistant_id: str, status: str, body: dict,
+             usage: Optional[dict] = None, last_error: Optional[dict] = None) -> dict:
+        return {
+            "id": run_id, "object": "thread.run", "created_at": _now(), "thread_id": thread_id,
+            "assistant_id": assistant_id, "status": status, "required_action": None, "last_error": last_error,
+            "expires_at": None, "started_at": _now(), "cancelled_at": None,
+            "failed_at": _now() if status == "failed" else None,
+            "completed_at": _now() if status == "completed" else None, "model": body.get("model", "mock"),
+            "instructions": "", "tools": [], "metadata": {}, "usage": usage, "incomplete_details": None,
+            "max_completion_tokens": None, "max_prompt_tokens": None,
+            "truncation_strategy": body.get("truncation_strategy") or {"type": "auto", "last_messages": None},
+            "tool_choice": "auto", "response_format": "auto", "parallel_tool_calls": True, "temperature": 1.0,
+            "top_p": 1.0,
+        }
+
+    def _step(self, step_id: str, run_id: str, thread_id: str, assistant_id: str, status: str,
+              details: dict) -> dict:
+        return {
+            "id": step_id, "object": "thread.run.step", "created_at": _now(), "run_id": run_id,
+            "assistant_id": assistant_id, "thread_id": thread_id, "type": details["type"], "status": status,
+            "step_details": details, "last_error": None, "expired_at": None, "cancelled_at": None,
+            "failed_at": None, "completed_at": _now() if status == "completed" else None, "metadata": {},
+            "usage": None,
+        }
+
+    def runs_create(self, raw: bytes, thread_id: str) -> None:
+        if self._inject("runs.create"):
+            return
+        if self._thread(thread_id) is None:
+            return
+        body = self._json_body(raw)
+        state = self.server.state
+        if not body.get("stream"):
+            self._error(400, "The mock only implements streamed runs")
+            return
+        assistant_id = body.get("assistant_id", "asst_mock")
+        run = state.start_run(thread_id, assistant_id, body)
+        if run is None:
+            self._error(400, f"Thread {thread_id} already has an active run {state.active_run(thread_id)['id']}.")
+            return
+        run_id, message_id = run["id"], _new_id("msg")
+        history = state.messages[thread_id]
+        question = history[-1]["content"][0]["text"]["value"] if history and history[-1]["content"] else ""
+        words = self.server.answer_words(question)
+        model = body.get("model")
+        if model and self.server.hedge_rate and state.chance(self.server.hedge_rate):
+            # A smaller model that could not answer from the documents
+            words = HEDGE_ANSWER.split()
+        delta_latency = f"runs.delta.{model}" if f"runs.delta.{model}" in state.latency else "runs.delta"
+        connected = [True]
+
+        def emit(event: str, data) -> None:
+            # A run outlives a dropped stream; it just has nobody to stream to
+            if connected[0]:
+                try:
+                    self._event(event, data)
+                except (BrokenPipeError, ConnectionResetError):
+                    connected[0] = False
+
+        def advance(status: str, seconds: float = 0.0, **fields) -> bool:
+            # Sleeps, then moves the run on; False once it has been cancelled instead
+            deadline = time.monotonic() + seconds
+            while run["status"] != "cancelling" and time.monotonic() < deadline:
+                time.sleep(min(0.02, deadline - time.monotonic()))
+            if run["status"] == "cancelling":
+                time.sleep(state.delay("runs.cancelling"))
+                run["status"] = "cancelled"
+                emit("thread.run.cancelled", self._run(run_id, thread_id, assistant_id, "cancelled", body))
+                return False
+            if run["status"] != status:
+                run["status"] = status
+                emit(f"thread.run.{status}", self._run(run_id, thread_id, assistant_id, status, body, **fields))
+            return True
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            emit("thread.run.created", self._run(run_id, thread_id, assistant_id, "queued", body))
+            if not advance("in_progress", state.delay("runs.queue")):
+                return
+            failure = state.fault("runs.failed")
+            if failure is not None:
+                code = "rate_limit_exceeded" if failure == "429" else "server_error"
+                advance("failed", last_error={"code": code, "message": f"Injected {code}"})
+                return
+            search_step = (_new_id("step"), run_id, thread_id, assistant_id)
+            search = {"type": "tool_calls", "tool_calls": [
+                {"id": _new_id("call"), "type": "file_search", "file_search": {}}]}
+            emit("thread.run.step.created", self._step(*search_step, "in_progress", search))
+            if not advance("in_progress", state.delay("runs.file_search")):
+                return
+            emit("thread.run.step.completed", self._step(*search_step, "completed", search))
+            message_step = (_new_id("step"), run_id, thread_id, assistant_id)
+            creation = {"type": "message_creation", "message_creation": {"message_id": message_id}}
+            emit("thread.run.step.created", self._step(*message_step, "in_progress", creation))
+            emit("thread.message.created", _text_message(message_id, thread_id, "assistant", "", run_id,
+                                                         assistant_id, "in_progress"))
+            for index, word in enumerate(words):
+                if index and not advance("in_progress", state.delay(delta_latency)):
+                    return
+                emit("thread.message.delta", {
+                    "id": message_id, "object": "thread.message.delta",
+                    "delta": {"content": [{"index": 0, "type": "text",
+                                           "text": {"value": word if index == 0 else " " + word, "annotations": []}}]},
+                })
+            answer = " ".join(words)
+            message = _text_message(message_id, thread_id, "assistant", answer, run_id, assistant_id)
+            history.append(message)
+            emit("thread.message.completed", message)
+            emit("thread.run.step.completed", self._step(*message_step, "completed", creation))
+            # Rough token counts: the whole thread as prompt, one token per answer word
+            prompt_tokens = sum(len(m["content"][0]["text"]["value"].split()) for m in history[:-1] if m["content"])
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                     "total_tokens": prompt_tokens + len(words)}
+            advance("completed", usage=usage)
+        finally:
+            emit("done", "[DONE]")
+            if connected[0]:
+                try:
+                    self._chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+    def _find_run(self, thread_id: str, run_id: str) -> Optional[dict]:
+        run = self.server.state.runs.get(run_id)
+        if run is None or run["thread_id"] != thread_id:
+            self._error(404, f"No run found with id '{run_id}'.")
+            return None
+        return run
+
+    def _run_json(self, run: dict) -> dict:
+        return self._run(run["id"], run["thread_id"], run["assistant_id"], run["status"], run["body"])
+
+    def runs_cancel(self, raw: bytes, thread_id: str, run_id: str) -> None:
+        if self._inject("runs.cancel"):
+            return
+        run = self._find_run(thread_id, run_id)
+        if run is None:
+            return
+        if run["status"] not in ACTIVE_RUN_STATUSES:
+            self._error(400, f"Cannot cancel run with status '{run['status']}'.")
+            return
+        run["status"] = "cancelling"
+        self._json(self._run_json(run))
+
+    def runs_retrieve(self, raw: bytes, thread_id: str, run_id: str) -> None:
+        if self._inject("runs.retrieve"):
+            return
+        run = self._find_run(thread_id, run_id)
+        if run is not None:
+            self._json(self._run_json(run))
+
+    def runs_list(self, raw: bytes, thread_id: str) -> None:
+        if self._inject("runs.list"):
+            return
+        if self._thread(thread_id) is None:
+            return
+        query = dict(part.split("=", 1) for part in self.path.partition("?")[2].split("&") if "=" in part)
+        runs = [run for run in self.server.state.runs.values() if run["thread_id"] == thread_id]
+        if query.get("order", "desc") == "desc":
+            runs.reverse()
+        limit = int(query.get("limit", 20))
+        page = [self._run_json(run) for run in runs[:limit]]
+        self._json({"object": "list", "data": page, "first_id": page[0]["id"] if page else None,
+                    "last_id": page[-1]["id"] if page else None, "has_more": len(runs) > limit})
+
+    # --- audio and embeddings ---
+
+    def audio_transcriptions(self, raw: bytes) -> None:
+        if self._inject("audio.transcriptions"):
+            return
+        # One word per ~16 KB of audio, enough for the stitching logic to have something to join
+        words = max(1, len(raw) // 16384)
+        self._json({"text": " ".join(f"word{i}" for i in range(words))})
+
+    def audio_speech(self, raw: bytes) -> None:
+        if self._inject("audio.speech"):
+            return
+        body = self._json_body(raw)
+        # A silent-looking 64 kbit/s MPEG-1 layer III stream, about 60 ms of audio per character
+        seconds = 0.06 * len(body.get("input", ""))
+        header = bytes([0xFF, 0xFB, 0x50, 0x00])
+        data = header + bytes(max(0, int(seconds * 8000) - len(header)))
+        self._send(200, data, content_type="audio/mpeg")
+
+    def embeddings(self, raw: bytes) -> None:
+        if self._inject("embeddings"):
+            return
+        body = self._json_body(raw)
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dimensions = int(body.get("dimensions") or EMBEDDING_DIM)
+        data = []
+        for index, text in enumerate(inputs):
+            vector = _embedding(str(text), dimensions)
+            encoded = base64.b64encode(vector.tobytes()).decode("ascii") \
+                if body.get("encoding_format") == "base64" else vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": encoded})
+        tokens = sum(len(str(text).split()) for text in inputs)
+        self._json({"object": "list", "data": data, "model": body.get("model", "mock"),
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+
+ROUTES: List[Tuple[str, Tuple[str, ...], Callable]] = [
+    ("POST", ("files",), MockHandler.files_create),
+    ("DELETE", ("files", "{id}"), MockHandler.files_delete),
+    ("POST", ("vector_stores",), MockHandler.vector_stores_create),
+    ("GET", ("vector_stores",), MockHandler.vector_stores_list),
+    ("GET", ("vector_stores", "{id}"), MockHandler.vector_stores_retrieve),
+    ("DELETE", ("vector_stores", "{id}"), MockHandler.vector_stores_delete),
+    ("POST", ("vector_stores", "{id}", "files"), MockHandler.vector_store_files_create),
+    ("GET", ("vector_stores", "{id}", "files", "{id}"), MockHandler.vector_store_files_retrieve),
+    ("DELETE", ("vector_stores", "{id}", "files", "{id}"), MockHandler.vector_store_files_delete),
+    ("POST", ("vector_stores", "{id}", "file_batches"), MockHandler.vector_store_file_batches_create),
+    ("GET", ("vector_stores", "{id}", "file_batches", "{id}"), MockHandler.vector_store_file_batches_retrieve),
+    ("GET", ("vector_stores", "{id}", "file_batches", "{id}", "files"), MockHandler.vector_store_file_batches_files),
+    ("POST", ("threads",), MockHandler.threads_create),
+    ("POST", ("threads", "{id}"), MockHandler.threads_update),
+    ("DELETE", ("threads", "{id}"), MockHandler.threads_delete),
+    ("POST", ("threads", "{id}", "messages"), MockHandler.messages_create),
+    ("GET", ("threads", "{id}", "messages"), MockHandler.messages_list),
+    ("DELETE", ("threads", "{id}", "messages", "{id}"), MockHandler.messages_delete),
+    ("POST", ("threads", "{id}", "runs"), MockHandler.runs_create),
+    ("GET", ("threads", "{id}", "runs"), MockHandler.runs_list),
+    ("GET", ("threads", "{id}", "runs", "{id}"), MockHandler.runs_retrieve),
+    ("POST", ("threads", "{id}", "runs", "{id}", "cancel"), MockHandler.runs_cancel),
+    ("POST", ("audio", "transcriptions"), MockHandler.audio_transcriptions),
+    ("POST", ("audio", "speech"), MockHandler.audio_speech),
+    ("POST", ("embeddings",), MockHandler.embeddings),
+]
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # Load tests open hundreds of connections at once; the default backlog of 5 drops their SYNs
+    request_queue_size = 1024
+
+    def __init__(self, address: Tuple[str, int], state: MockState, answer_words: int = ANSWER_WORDS,
+                 hang_seconds: float = 300.0, hedge_rate: float = 0.0):
+        super().__init__(address, MockHandler)
+        self.state = state
+        self.hang_seconds = hang_seconds
+        self._answer_words = answer_words
+        # Share of runs with a model override that answer HEDGE_ANSWER, to exercise escalation
+        self.hedge_rate = hedge_rate
+
+    def answer_words(self, question: str) -> List[str]:
+        words = [f"answer{i}" for i in range(self._answer_words)]
+        # Sentence breaks every 10 words so the speech pipeline has something to split on
+        return [word + "." if (i + 1) % 10 == 0 else word for i, word in enumerate(words)]
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-response (timeouts, hedged requests) are expected, not errors
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_mock_server(latency: Optional[Dict[str, str]] = None, faults: Optional[Dict[str, str]] = None,
+                      latency_scale: float = 1.0, seed: int = 0, host: str = "127.0.0.1", port: int = 0,
+                      **options) -> MockServer:
+    # Serves from a daemon thread; call shutdown() when done
+    server = MockServer((host, port), MockState(latency or {}, faults or {}, latency_scale, seed), **options)
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a local mock of the OpenAI endpoints used by the app")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", action="append", metavar="OPERATION=DIST",
+                        help="e.g. runs.create=lognormal:900:0.5 (milliseconds)")
+    parser.add_argument("--fault", action="append", metavar="OPERATION=RATE[:KIND]",
+                        help=f"e.g. audio.speech=0.1:429; KIND is one of {', '.join(FAULT_KINDS)}; '*' matches all")
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--answer-words", type=int, default=ANSWER_WORDS)
+    parser.add_argument("--hedge-rate", type=float, default=0.0,
+                        help="share of runs with a model override that reply they could not find the answer")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    state = MockState(parse_assignments(args.latency), parse_assignments(args.fault), args.latency_scale, args.seed)
+    server = MockServer((args.host, args.port), state, answer_words=args.answer_words, hedge_rate=args.hedge_rate)
+    print(f"Mock OpenAI API on {server.base_url} (set OPENAI_BASE_URL to use it)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(state.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
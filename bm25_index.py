@@ -0,0 +1,117 @@
+import math
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Identifiers such as "E-42", "AB1234.5" or "v2_rc1" are kept whole and also split into parts
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_PART_RE = re.compile(r"[-_./]")
+
+RRF_K = 60
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if _PART_RE.search(token):
+            tokens.extend(part for part in _PART_RE.split(token) if part)
+    return tokens
+
+
+class BM25Index:
+    # Inverted index over rows (chunks). Postings are sorted int32 row ids with parallel
+    # int32 term frequencies; appends are buffered per term and compacted on first read.
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.size = 0
+        self.doc_lengths = np.zeros(0, dtype=np.int32)
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._pending: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+
+    def add(self, texts: Iterable[str]) -> None:
+        lengths = []
+        for text in texts:
+            counts: Dict[str, int] = defaultdict(int)
+            tokens = tokenize(text)
+            for token in tokens:
+                counts[token] += 1
+            row = self.size + len(lengths)
+            for token, count in counts.items():
+                self._pending[token].append((row, count))
+            lengths.append(len(tokens))
+        self.doc_lengths = np.concatenate([self.doc_lengths, np.asarray(lengths, dtype=np.int32)])
+        self.size += len(lengths)
+
+    def _postings_for(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        pending = self._pending.pop(term, None)
+        postings = self._postings.get(term)
+        if pending:
+            rows = np.fromiter((row for row, _ in pending), dtype=np.int32, count=len(pending))
+            tfs = np.fromiter((count for _, count in pending), dtype=np.int32, count=len(pending))
+            if postings is not None:
+                # Rows only ever grow, so appending keeps the arrays sorted
+                rows = np.concatenate([postings[0], rows])
+                tfs = np.concatenate([postings[1], tfs])
+            postings = self._postings[term] = (rows, tfs)
+        return postings
+
+    def document_frequencies(self, terms: Iterable[str]) -> Dict[str, int]:
+        frequencies = {}
+        for term in terms:
+            postings = self._postings_for(term)
+            frequencies[term] = 0 if postings is None else len(postings[0])
+        return frequencies
+
+    @property
+    def total_length(self) -> int:
+        return int(self.doc_lengths.sum())
+
+    def score(self, idf: Dict[str, float], avgdl: float) -> Tuple[np.ndarray, np.ndarray]:
+        # idf and avgdl come from the caller so several segments can share corpus statistics
+        all_rows, contributions = [], []
+        for term, weight in idf.items():
+            postings = self._postings_for(term)
+            if postings is None:
+                continue
+            rows, tfs = postings
+            lengths = self.doc_lengths[rows]
+            norm = self.k1 * (1.0 - self.b + self.b * lengths / max(avgdl, 1e-9))
+            all_rows.append(rows)
+            contributions.append(weight * tfs * (self.k1 + 1.0) / (tfs + norm))
+        if not all_rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+        return rows, np.bincount(inverse, weights=np.concatenate(contributions))
+
+    def keep_rows(self, rows: np.ndarray) -> None:
+        # Drop every row not in `rows` (sorted) and renumber the survivors densely
+        remap = np.full(self.size, -1, dtype=np.int32)
+        remap[rows] = np.arange(len(rows), dtype=np.int32)
+        for term in list(self._pending) + list(self._postings):
+            postings = self._postings_for(term)
+            if postings is None:
+                continue
+            new_rows = remap[postings[0]]
+            keep = new_rows >= 0
+            if keep.any():
+                self._postings[term] = (new_rows[keep], postings[1][keep])
+            else:
+                del self._postings[term]
+        self.doc_lengths = self.doc_lengths[rows]
+        self.size = len(rows)
+
+
+def bm25_idf(document_count: int, document_frequency: int) -> float:
+    return math.log(1.0 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[object]], k: int = RRF_K) -> List[Tuple[object, float]]:
+    fused: Dict[object, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            fused[key] += 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -1,10 +1,82 @@
 import streamlit as st
+import streamlit.components.v1 as components
 from streamlit_chat import message
-import os
-from advanced_rag import AdvancedRAG
+from advanced_rag import (ASSISTANT_UNAVAILABLE, MESSAGE_HISTORY_LIMIT, AdvancedRAG, file_hash, get_ingestion_jobs,
+                          get_single_flight)
 import time
 from streamlit_audio_recorder.st_audiorec import st_audiorec
 import traceback
+import base64
+import json
+import uuid
+from collections import deque
+from metrics import metrics, start_exporters
+from resilience import circuit_open
+
+# Session logs are ring buffers: only the most recent entries are kept and rendered
+DEBUG_LOG_LIMIT = 100
+# How often the page refreshes while documents are ingesting in the background
+INGEST_POLL_SECONDS = 1.0
+
+
+def add_message(role, content):
+    # Ids keep counting past the ring buffer's size so widget keys stay unique
+    st.session_state.messages.append({"role": role, "content": content, "id": st.session_state.next_message_id})
+    st.session_state.next_message_id += 1
+
+
+def stream_reply(deltas):
+    # An open circuit breaker is an expected state, not a crash: show it as the reply
+    try:
+        return st.write_stream(deltas)
+    except Exception as e:
+        if not circuit_open(e):
+            raise
+        st.session_state.debug_info.append(f"Assistant unavailable: {str(e)}")
+        st.write(ASSISTANT_UNAVAILABLE)
+        return ASSISTANT_UNAVAILABLE
+
+
+# Appends one clip to a queue kept on the app's page, which plays each clip when the previous one ends.
+# The audio element lives on the parent page, so playback carries on after the script reruns.
+_QUEUE_CLIP_HTML = """<script>
+const page = window.parent;
+const speech = page.ragSpeech = page.ragSpeech || {queue: [], seen: new Set(), playing: false};
+function playNext() {
+  const src = speech.queue.shift();
+  speech.playing = src !== undefined;
+  if (!speech.playing) return;
+  const audio = new page.Audio(src);
+  audio.onended = playNext;
+  audio.onerror = playNext;
+  audio.play().catch(playNext);
+}
+if (!speech.seen.has(%(id)s)) {
+  speech.seen.add(%(id)s);
+  speech.queue.push(%(src)s);
+  if (!speech.playing) playNext();
+}
+</script>"""
+
+
+class SpeechPlayer:
+    # Hands clips to the browser in order as they are synthesized; the script never waits for playback
+    def __init__(self, response_format="mp3"):
+        self.mime = "audio/mpeg" if response_format == "mp3" else f"audio/{response_format}"
+        self.failed = 0
+
+    def play(self, clips):
+        for _, clip in clips:
+            if not clip:
+                # Synthesis failed on a TTS worker, which has already logged why
+                self.failed += 1
+                continue
+            src = f"data:{self.mime};base64,{base64.b64encode(clip).decode()}"
+            components.html(_QUEUE_CLIP_HTML % {"id": json.dumps(uuid.uuid4().hex), "src": json.dumps(src)},
+                            height=0)
+
+# Serves /metrics on RAG_METRICS_PORT and/or keeps RAG_METRICS_FILE current; once per process
+start_exporters()
 
 # Page config
 st.set_page_config(
@@ -25,7 +97,9 @@ try:
     if 'thread_created' not in st.session_state:
         st.session_state.thread_created = False
     if 'messages' not in st.session_state:
-        st.session_state.messages = []
+        st.session_state.messages = deque(maxlen=MESSAGE_HISTORY_LIMIT)
+    if 'next_message_id' not in st.session_state:
+        st.session_state.next_message_id = 0
     if 'user_input' not in st.session_state:
         st.session_state.user_input = ""
     if 'last_error' not in st.session_state:
@@ -33,7 +107,13 @@ try:
     if 'last_response' not in st.session_state:
         st.session_state.last_response = ""
     if 'debug_info' not in st.session_state:
-        st.session_state.debug_info = []
+        st.session_state.debug_info = deque(maxlen=DEBUG_LOG_LIMIT)
+    if 'documents' not in st.session_state:
+        st.session_state.documents = {}  # content hash -> file_id (None while ingesting or after a failure)
+    if 'ingest_jobs' not in st.session_state:
+        st.session_state.ingest_jobs = {}  # background job id -> content hashes it adds
+    if 'upload_hashes' not in st.session_state:
+        st.session_state.upload_hashes = {}  # uploader file_id -> content hash
 except Exception as e:
     st.error(f"Error initializing session state: {str(e)}")
     st.error(traceback.format_exc())
@@ -63,33 +143,69 @@ with st.sidebar:
     st.title("📚 Document Setup")
     
     # File uploader
-    uploaded_file = st.file_uploader("Upload your document", type=['pdf', 'txt', 'docx'])
+    uploaded_files = st.file_uploader("Upload your documents", type=['pdf', 'txt', 'docx'], accept_multiple_files=True)
+    # The script reruns every second while jobs run, so each upload is hashed only once
+    known_hashes = st.session_state.upload_hashes
+    st.session_state.upload_hashes = {f.file_id: known_hashes.get(f.file_id) or file_hash(f) for f in uploaded_files or []}
+    uploaded_by_hash = {st.session_state.upload_hashes[f.file_id]: f for f in uploaded_files or []}
+    new_hashes = [h for h in uploaded_by_hash if h not in st.session_state.documents]
+    # Documents still being ingested are removed once their job has finished
+    ingesting = {h for hashes in st.session_state.ingest_jobs.values() for h in hashes}
+    removed_hashes = [h for h in st.session_state.documents if h not in uploaded_by_hash and h not in ingesting]
+    jobs = get_ingestion_jobs()
+    rag = st.session_state.rag
+    
+    # Uploads and indexing run as background jobs; this script only submits them and polls their status
+    try:
+        for h in removed_hashes:
+            file_id = st.session_state.documents.pop(h)
+            if file_id:
+                job_id = jobs.submit("Removing a document", rag.remove_document, file_id, key=rag)
+                st.session_state.ingest_jobs[job_id] = []
+                st.session_state.debug_info.append(f"Removing document with ID: {file_id} ({job_id})")
+        if new_hashes:
+            files = [uploaded_by_hash[h] for h in new_hashes]
+            label = ", ".join(f.name for f in files)
+            job_id = jobs.submit(f"Adding {label}", rag.add_documents, files, key=rag)
+            st.session_state.ingest_jobs[job_id] = new_hashes
+            for h in new_hashes:
+                st.session_state.documents[h] = None
+            st.session_state.debug_info.append(f"Ingesting {label} ({job_id})")
+    except Exception as e:
+        st.session_state.last_error = str(e)
+        st.session_state.debug_info.append(f"Error processing document: {str(e)}")
+        st.error(f"Error processing document: {str(e)}")
+        st.error(traceback.format_exc())
     
-    if uploaded_file and not st.session_state.vector_store_created:
-        with st.spinner("Processing document..."):
-            try:
-                # Save the uploaded file temporarily
-                with open(uploaded_file.name, "wb") as f:
-                    f.write(uploaded_file.getvalue())
-                
-                # Upload document
-                file_id = st.session_state.rag.upload_document(uploaded_file)
-                st.session_state.debug_info.append(f"Document uploaded with ID: {file_id}")
-                
-                # Mark as ready
-                st.session_state.vector_store_created = True
-                st.session_state.assistant_created = True
-                st.session_state.thread_created = True
-                
-                # Clean up temporary file
-                os.remove(uploaded_file.name)
-                
-                st.success("Document processed successfully!")
-            except Exception as e:
-                st.session_state.last_error = str(e)
-                st.session_state.debug_info.append(f"Error processing document: {str(e)}")
-                st.error(f"Error processing document: {str(e)}")
-                st.error(traceback.format_exc())
+    for job_id, hashes in list(st.session_state.ingest_jobs.items()):
+        job = jobs.get(job_id)
+        if job is not None and job.done:
+            # Problems the job ran into without failing, such as files the vector store could not index
+            for warning in job.warnings:
+                st.session_state.last_error = warning
+                st.session_state.debug_info.append(f"Warning processing document ({job_id}): {warning}")
+                st.warning(warning)
+        if job is None or job.status == "failed":
+            del st.session_state.ingest_jobs[job_id]
+            error = job.error if job is not None else "job was lost"
+            st.session_state.last_error = error
+            st.session_state.debug_info.append(f"Error processing document ({job_id}): {error}")
+            st.error(f"{job.label if job is not None else job_id} failed: {error}")
+        elif job.status == "completed":
+            del st.session_state.ingest_jobs[job_id]
+            for h, file_id in zip(hashes, job.result or []):
+                st.session_state.documents[h] = file_id
+                if file_id:
+                    st.session_state.debug_info.append(f"Document uploaded with ID: {file_id}")
+            st.success(f"{job.label}: ready ({job.elapsed():.1f}s)")
+        else:
+            st.info(f"⏳ {job.label}: {job.message} ({job.elapsed():.0f}s)")
+    
+    # Chat is enabled as soon as one document has finished indexing; later ones keep ingesting
+    ready = any(st.session_state.documents.values())
+    st.session_state.vector_store_created = ready
+    st.session_state.assistant_created = ready
+    st.session_state.thread_created = ready
     
     # Display status
     st.markdown("---")
@@ -102,13 +218,33 @@ with st.sidebar:
     st.markdown("---")
     st.subheader("Chat Management")
     if st.button("Clear Chat History"):
-        st.session_state.messages = []
+        st.session_state.rag.cancel_questions()
+        st.session_state.messages.clear()
         st.success("Chat history cleared.")
     if st.session_state.messages:
         import json
-        chat_json = json.dumps(st.session_state.messages, indent=2)
+        chat_json = json.dumps(list(st.session_state.messages), indent=2)
         st.download_button("Download Chat History (JSON)", chat_json, file_name="chat_history.json", mime="application/json")
 
+    # --- SIDEBAR: Metrics ---
+    st.markdown("---")
+    with st.expander("📈 Metrics"):
+        last_run = st.session_state.rag.last_run_stats
+        if last_run:
+            st.markdown("**Last answer**")
+            st.json(last_run)
+        stages = metrics.stage_summary()
+        if stages:
+            st.markdown(f"**Stages** (last {len(metrics.recent)} spans, all sessions)")
+            st.dataframe(stages, hide_index=True)
+        else:
+            st.caption("No requests yet.")
+        coalesced = get_single_flight().stats()
+        if coalesced["saved"]:
+            st.caption(f"Runs saved by joining identical questions in flight: {coalesced['saved']}")
+        st.download_button("Download Metrics (Prometheus)", metrics.render(), file_name="rag_metrics.prom",
+                           mime="text/plain")
+
 # --- Dedicated Chatbot Screen ---
 st.title("🤖 AI Document Assistant")
 st.markdown("Upload a document in the sidebar and start chatting!")
@@ -145,28 +281,34 @@ if not missing_secrets and st.session_state.vector_store_created:
                         user_question = st.session_state.rag.transcribe_audio(audio_bytes)
                         st.success(f"Transcribed: {user_question}")
                         st.session_state.user_input = user_question
-                        st.session_state.messages.append({
-                            "role": "user",
-                            "content": user_question,
-                            "id": len(st.session_state.messages)
-                        })
+                        add_message("user", user_question)
                         st.info("Voice note sent to assistant.")
-                        with st.spinner("Thinking..."):
+                        with st.chat_message("assistant"):
                             try:
-                                response = st.session_state.rag.ask_question(user_question)
-                                st.session_state.messages.append({
-                                    "role": "assistant",
-                                    "content": response,
-                                    "id": len(st.session_state.messages)
-                                })
+                                # Each sentence is synthesized as soon as it is complete and played in order,
+                                # so the first one is heard while the rest of the answer is still streaming
+                                speech = st.session_state.rag.speech_pipeline()
+                                player = SpeechPlayer()
+
+                                def speak_along(deltas):
+                                    for delta in deltas:
+                                        speech.feed(delta)
+                                        yield delta
+                                        player.play(speech.ready())
+
+                                handle = st.session_state.rag.submit_question(user_question)
+                                response = stream_reply(speak_along(handle.deltas()))
+                                add_message("assistant", response)
                                 st.success("Assistant replied.")
-                                with st.spinner("Synthesizing speech..."):
-                                    tts_audio = st.session_state.rag.synthesize_speech(response)
-                                    st.audio(tts_audio, format="audio/mp3")
+                                player.play(speech.drain())
+                                if player.failed:
+                                    st.session_state.debug_info.append(
+                                        f"Speech synthesis failed for {player.failed} sentence(s)")
+                                    st.warning(f"{player.failed} sentence(s) of the reply could not be read aloud")
                                 st.session_state.user_input = ""
                                 st.session_state.last_error = ""
                                 st.session_state.last_response = response
-                                st.experimental_rerun()
+                                st.rerun()
                             except Exception as e:
                                 st.session_state.last_error = str(e)
                                 st.session_state.debug_info.append(f"Error getting assistant reply: {str(e)}")
@@ -184,23 +326,16 @@ if not missing_secrets and st.session_state.vector_store_created:
         user_input = st.text_input("Ask a question about your document:", key="user_input", value=st.session_state.user_input)
         send_text = st.button("Send Message", key="send_text")
         if send_text and user_input:
-            st.session_state.messages.append({
-                "role": "user",
-                "content": user_input,
-                "id": len(st.session_state.messages)
-            })
-            with st.spinner("Thinking..."):
+            add_message("user", user_input)
+            with st.chat_message("assistant"):
                 try:
-                    response = st.session_state.rag.ask_question(user_input)
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": response,
-                        "id": len(st.session_state.messages)
-                    })
+                    # The run is streamed on the shared query executor; this script only drains its deltas
+                    response = stream_reply(st.session_state.rag.submit_question(user_input).deltas())
+                    add_message("assistant", response)
                     st.session_state.user_input = ""
                     st.session_state.last_error = ""
                     st.session_state.last_response = response
-                    st.experimental_rerun()
+                    st.rerun()
                 except Exception as e:
                     st.session_state.last_error = str(e)
                     st.session_state.debug_info.append(f"Error in text chat: {str(e)}")
@@ -217,4 +352,9 @@ else:
 
 # Footer
 st.markdown("---")
-st.markdown("Built with ❤️ using OpenAI's Assistants API and Streamlit") 
\ No newline at end of file
+st.markdown("Built with ❤️ using OpenAI's Assistants API and Streamlit")
+
+# Poll running ingestion jobs: rerun shortly so their progress and readiness show up without user input
+if st.session_state.ingest_jobs:
+    time.sleep(INGEST_POLL_SECONDS)
+    st.rerun()
\ No newline at end of file
@@ -0,0 +1,144 @@
+import io
+import os
+import re
+import unicodedata
+from collections import deque
+from typing import BinaryIO, Iterable, Iterator, List, Sequence
+
+CHUNK_TOKENS = 256
+CHUNK_OVERLAP_TOKENS = 48
+# Characters decoded per read from plain-text uploads
+TEXT_READ_SIZE = 64 * 1024
+
+_CONTROL_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class WordTokenizer:
+    # Fallback when tiktoken is unavailable: whitespace-separated words approximate tokens
+    def encode(self, text: str) -> List[str]:
+        return text.split()
+
+    def decode(self, tokens: Sequence[str]) -> str:
+        return " ".join(tokens)
+
+
+_default_tokenizer = None
+
+
+def default_tokenizer():
+    global _default_tokenizer
+    if _default_tokenizer is None:
+        try:
+            import tiktoken
+            _default_tokenizer = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _default_tokenizer = WordTokenizer()
+    return _default_tokenizer
+
+
+def count_tokens(text: str, tokenizer=None) -> int:
+    return len((tokenizer or default_tokenizer()).encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int, tokenizer=None) -> str:
+    tokenizer = tokenizer or default_tokenizer()
+    tokens = tokenizer.encode(text)
+    return text if len(tokens) <= max_tokens else tokenizer.decode(tokens[:max_tokens])
+
+
+def _iter_text(stream: BinaryIO) -> Iterator[str]:
+    # Decode incrementally and cut each block at its last whitespace so no word is split
+    reader = io.TextIOWrapper(stream, encoding="utf-8", errors="replace", newline="")
+    try:
+        carry = ""
+        while True:
+            block = reader.read(TEXT_READ_SIZE)
+            if not block:
+                break
+            block = carry + block
+            cut = max(block.rfind(" "), block.rfind("\n"))
+            if cut == -1:
+                carry = block
+                continue
+            carry = block[cut + 1:]
+            yield block[:cut + 1]
+        if carry:
+            yield carry
+    finally:
+        # Detach so closing the wrapper never closes the caller's upload buffer
+        reader.detach()
+
+
+def iter_segments(name: str, stream: BinaryIO) -> Iterator[str]:
+    # Pages of a PDF, paragraphs of a DOCX, or blocks of a text file, read lazily
+    extension = os.path.splitext(name)[1].lower()
+    stream.seek(0)
+    if extension == ".pdf":
+        try:
+            from pypdf import PdfReader
+        except ImportError as e:
+            raise ImportError("pypdf is required to index PDF files locally") from e
+        for page in PdfReader(stream).pages:
+            yield page.extract_text() or ""
+    elif extension == ".docx":
+        try:
+            import docx
+        except ImportError as e:
+            raise ImportError("python-docx is required to index DOCX files locally") from e
+        for paragraph in docx.Document(stream).paragraphs:
+            yield paragraph.text
+    else:
+        yield from _iter_text(stream)
+
+
+def normalize_segments(segments: Iterable[str]) -> Iterator[str]:
+    for segment in segments:
+        segment = unicodedata.normalize("NFKC", segment)
+        segment = _WHITESPACE_RE.sub(" ", _CONTROL_RE.sub(" ", segment)).strip()
+        if segment:
+            yield segment
+
+
+def iter_chunks(segments: Iterable[str], max_tokens: int = CHUNK_TOKENS,
+                overlap_tokens: int = CHUNK_OVERLAP_TOKENS, tokenizer=None) -> Iterator[str]:
+    # Sliding token window: emit max_tokens, keep the last overlap_tokens for the next chunk.
+    # Only the window and the current segment are ever held in memory.
+    if not 0 <= overlap_tokens < max_tokens:
+        raise ValueError("overlap_tokens must be at least 0 and smaller than max_tokens")
+    tokenizer = tokenizer or default_tokenizer()
+    window: deque = deque()
+    fresh = 0
+    for segment in segments:
+        for token in tokenizer.encode(segment + " "):
+            window.append(token)
+            fresh += 1
+            if len(window) == max_tokens:
+                yield tokenizer.decode(list(window)).strip()
+                for _ in range(max_tokens - overlap_tokens):
+                    window.popleft()
+                fresh = 0
+    if fresh:
+        yield tokenizer.decode(list(window)).strip()
+
+
+def iter_batches(items: Iterable[str], batch_size: int) -> Iterator[List[str]]:
+    batch: List[str] = []
+    for item in items:
+        if item:
+            batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_document_chunks(name: str, stream: BinaryIO, max_tokens: int = CHUNK_TOKENS,
+                         overlap_tokens: int = CHUNK_OVERLAP_TOKENS, tokenizer=None) -> Iterator[str]:
+    return iter_chunks(normalize_segments(iter_segments(name, stream)), max_tokens, overlap_tokens, tokenizer)
+
+
+def iter_text_chunks(text: str, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                     tokenizer=None) -> Iterator[str]:
+    return iter_chunks(normalize_segments([text]), max_tokens, overlap_tokens, tokenizer)
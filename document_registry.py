@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Optional
+
+# Shared by every session and process on the host, so identical uploads are ingested once
+DEFAULT_REGISTRY_PATH = os.environ.get(
+    "RAG_REGISTRY_PATH",
+    os.path.join(os.path.expanduser("~"), ".openai_rag", "registry.sqlite3")
+)
+
+
+class RegisteredDocument(NamedTuple):
+    content_hash: str
+    file_id: str
+    vector_store_id: Optional[str]
+    name: str
+
+
+class DocumentRegistry:
+    def __init__(self, path: str = DEFAULT_REGISTRY_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connect lazily so importing the app never touches the disk
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            if self.path != ":memory:":
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    content_hash TEXT PRIMARY KEY,
+                    file_id TEXT NOT NULL,
+                    vector_store_id TEXT,
+                    name TEXT NOT NULL DEFAULT '',
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+                """
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def lookup(self, content_hash: str) -> Optional[RegisteredDocument]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT content_hash, file_id, vector_store_id, name FROM documents WHERE content_hash = ?",
+                (content_hash,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE documents SET last_used_at = ? WHERE content_hash = ?",
+                (time.time(), content_hash)
+            )
+            conn.commit()
+            return RegisteredDocument(*row)
+
+    def register(self, content_hash: str, file_id: str, vector_store_id: Optional[str] = None,
+                 name: str = "") -> RegisteredDocument:
+        # First writer wins: a concurrent upload of the same bytes gets the existing entry back
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                """
+                INSERT INTO documents (content_hash, file_id, vector_store_id, name, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(content_hash) DO UPDATE SET
+                    vector_store_id = COALESCE(documents.vector_store_id, excluded.vector_store_id),
+                    last_used_at = excluded.last_used_at
+                """,
+                (content_hash, file_id, vector_store_id, name, now, now)
+            )
+            conn.commit()
+            row = conn.execute(
+                "SELECT content_hash, file_id, vector_store_id, name FROM documents WHERE content_hash = ?",
+                (content_hash,)
+            ).fetchone()
+            return RegisteredDocument(*row)
+
+    def forget(self, content_hash: str) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM documents WHERE content_hash = ?", (content_hash,))
+            conn.commit()
+
+    def forget_vector_store(self, vector_store_id: str) -> None:
+        # The store was deleted; its documents keep their files and get a new store on next upload
+        with self._lock:
+            conn = self._connect()
+            conn.execute("UPDATE documents SET vector_store_id = NULL WHERE vector_store_id = ?", (vector_store_id,))
+            conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,212 @@
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+from document_pipeline import count_tokens, truncate_tokens
+
+if TYPE_CHECKING:
+    import openai
+
+# Per-request limits of the embeddings endpoint, with headroom on tokens
+MAX_BATCH_ITEMS = 2048
+MAX_BATCH_TOKENS = 250_000
+MAX_INPUT_TOKENS = 8191
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    # Rate-limit reset headers look like "1s", "6m0s" or "250ms"; retry-after is plain seconds
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class _RateGate:
+    # Shared by all workers: once the server says stop, nobody sends until the window reopens
+    def __init__(self):
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        while True:
+            with self._lock:
+                delay = self._blocked_until - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def block_for(self, seconds: float) -> None:
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+class EmbeddingService:
+    def __init__(self, client: Union["openai.OpenAI", Callable[[], "openai.OpenAI"]], model: str = "text-embedding-3-small",
+                 max_batch_items: int = MAX_BATCH_ITEMS, max_batch_tokens: int = MAX_BATCH_TOKENS,
+                 max_concurrency: int = 4, max_retries: int = 6, cache_size: int = 4096):
+        # `client` may be a zero-argument factory so the OpenAI client is only built when first needed
+        self._client = client
+        self.model = model
+        self.max_batch_items = max_batch_items
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._gate = _RateGate()
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embeddings")
+        self._stats_lock = threading.Lock()
+        # Wall time with at least one call in progress, so concurrent calls are not counted twice
+        self._stats = {"texts": 0, "embedded": 0, "cache_hits": 0, "truncated": 0, "requests": 0, "retries": 0,
+                       "rate_limited": 0, "tokens": 0, "busy_seconds": 0.0}
+        self._active_calls = 0
+        self._busy_since = 0.0
+
+    @property
+    def client(self) -> "openai.OpenAI":
+        client = self._client if hasattr(self._client, "embeddings") else self._client()
+        # Backoff is handled here, against the rate-limit headers, not by the SDK's own retries
+        return client.with_options(max_retries=0)
+
+    def _count(self, **deltas) -> None:
+        with self._stats_lock:
+            for key, value in deltas.items():
+                self._stats[key] += value
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["texts_per_second"] = stats["texts"] / stats["busy_seconds"] if stats["busy_seconds"] else 0.0
+        return stats
+
+    def _busy(self, delta: int) -> None:
+        with self._stats_lock:
+            now = time.perf_counter()
+            if self._active_calls == 0:
+                self._busy_since = now
+            self._active_calls += delta
+            if self._active_calls == 0:
+                self._stats["busy_seconds"] += now - self._busy_since
+
+    def _fit(self, text: str) -> str:
+        # The endpoint rejects the whole batch if any input is over its limit; embed the opening instead
+        if count_tokens(text) <= MAX_INPUT_TOKENS:
+            return text
+        self._count(truncated=1)
+        return truncate_tokens(text, MAX_INPUT_TOKENS)
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def _pack(self, texts: List[str]) -> List[List[str]]:
+        # Greedy packing under both the item and the token budget, in input order
+        batches, batch, batch_tokens = [], [], 0
+        for text in texts:
+            tokens = count_tokens(text)
+            if batch and (len(batch) == self.max_batch_items or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _observe_headers(self, headers) -> None:
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        if remaining is not None and remaining.isdigit() and int(remaining) == 0:
+            reset = parse_reset(headers.get("x-ratelimit-reset-requests"))
+            if reset:
+                self._gate.block_for(reset)
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_tokens is not None and remaining_tokens.isdigit() and int(remaining_tokens) == 0:
+            reset = parse_reset(headers.get("x-ratelimit-reset-tokens"))
+            if reset:
+                self._gate.block_for(reset)
+
+    def _embed_batch(self, batch: List[str]) -> np.ndarray:
+        import openai
+
+        for attempt in range(self.max_retries + 1):
+            self._gate.wait()
+            try:
+                raw = self.client.embeddings.with_raw_response.create(model=self.model, input=batch)
+            except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+                if attempt == self.max_retries:
+                    raise
+                self._count(retries=1)
+                response = getattr(e, "response", None)
+                delay = None
+                if isinstance(e, openai.RateLimitError):
+                    self._count(rate_limited=1)
+                    delay = parse_reset(response.headers.get("retry-after")) if response is not None else None
+                # Exponential backoff with full jitter unless the server named a delay
+                delay = delay if delay is not None else random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
+                self._gate.block_for(delay)
+                continue
+            self._count(requests=1)
+            self._observe_headers(raw.headers)
+            response = raw.parse()
+            if response.usage is not None:
+                self._count(tokens=response.usage.prompt_tokens)
+            ordered = sorted(response.data, key=lambda item: item.index)
+            return np.array([item.embedding for item in ordered], dtype=np.float32)
+        raise RuntimeError("unreachable")
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        self._busy(1)
+        try:
+            return self._embed(texts)
+        finally:
+            self._busy(-1)
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        keys = [self._key(text) for text in texts]
+        vectors: Dict[bytes, np.ndarray] = {}
+        with self._cache_lock:
+            for key in keys:
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    vectors[key] = cached
+        # Identical inputs, within this call or cached from earlier ones, are embedded once
+        missing: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+        self._count(cache_hits=len(texts) - len(missing))
+        if missing:
+            # Vectors are keyed by the original text, even when a truncated version was sent
+            missing_keys = iter(list(missing))
+            batches = self._pack([self._fit(text) for text in missing.values()])
+            for batch_vectors in self._pool.map(self._embed_batch, batches):
+                for vector in batch_vectors:
+                    vectors[next(missing_keys)] = vector
+            with self._cache_lock:
+                for key in missing:
+                    self._cache[key] = vectors[key]
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        self._count(texts=len(texts), embedded=len(missing))
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[key] for key in keys])
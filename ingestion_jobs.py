@@ -0,0 +1,129 @@
+import itertools
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, List, Optional, Tuple
+
+from metrics import metrics
+
+# Uploads and vector-store indexing run on this pool, outside Streamlit's script reruns
+INGEST_WORKERS = int(os.environ.get("RAG_INGEST_WORKERS", "4"))
+# Finished jobs kept for status lookups; the oldest are forgotten first
+JOB_HISTORY = 1000
+
+PENDING_STATUSES = ("queued", "running")
+
+_current = threading.local()
+
+
+class IngestionJob:
+    def __init__(self, job_id: str, label: str):
+        self.id = job_id
+        self.label = label
+        self.status = "queued"
+        self.message = "Waiting to start"
+        self.result: Any = None
+        self.error: Optional[str] = None
+        # Problems that did not fail the job, such as files the vector store could not index
+        self.warnings: List[str] = []
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status not in PENDING_STATUSES
+
+    def update(self, message: str) -> None:
+        # Progress callback handed to the job's function; read by the UI on its next rerun
+        self.message = message
+
+    def warn(self, message: str) -> None:
+        self.warnings.append(message)
+
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+
+def current_job() -> Optional[IngestionJob]:
+    # The job running on this worker thread, if any
+    return getattr(_current, "job", None)
+
+
+class IngestionJobs:
+    def __init__(self, max_workers: int = INGEST_WORKERS, history: int = JOB_HISTORY):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._history = history
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # Jobs for the same key (a session's AdvancedRAG) run one after another, in submission order:
+        # the first job of a key's queue is the one running, and each finished job hands the pool the next
+        self._queues: "weakref.WeakKeyDictionary[Any, Deque[Tuple[IngestionJob, Callable[..., Any], tuple]]]" = \
+            weakref.WeakKeyDictionary()
+
+    def submit(self, label: str, fn: Callable[..., Any], *args, key: Any = None) -> str:
+        # fn is called as fn(*args, progress=job.update) on a worker thread
+        with self._lock:
+            job = IngestionJob(f"job-{next(self._ids)}", label)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self._history:
+                oldest = next(iter(self._jobs.values()))
+                if not oldest.done:
+                    break
+                self._jobs.popitem(last=False)
+            if key is not None:
+                queue = self._queues.get(key)
+                if queue is None:
+                    queue = self._queues[key] = deque()
+                queue.append((job, fn, args))
+                if len(queue) > 1:
+                    return job.id
+        if key is None:
+            self._pool.submit(self._run, job, fn, args)
+        else:
+            self._pool.submit(self._run_next, key)
+        return job.id
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run_next(self, key: Any) -> None:
+        with self._lock:
+            job, fn, args = self._queues[key][0]
+        try:
+            self._run(job, fn, args)
+        finally:
+            with self._lock:
+                queue = self._queues[key]
+                queue.popleft()
+                more = bool(queue)
+            if more:
+                self._pool.submit(self._run_next, key)
+
+    def _run(self, job: IngestionJob, fn: Callable[..., Any], args: tuple) -> None:
+        job.started_at = time.time()
+        metrics.record("ingest.queue_wait", job.started_at - job.created_at)
+        job.status = "running"
+        job.message = "Starting"
+        _current.job = job
+        try:
+            with metrics.span("ingest.job"):
+                job.result = fn(*args, progress=job.update)
+        except Exception as e:
+            job.error = str(e)
+            job.finished_at = time.time()
+            job.message = f"Failed: {e}"
+            job.status = "failed"
+        else:
+            job.finished_at = time.time()
+            job.message = "Ready"
+            job.status = "completed"
+        finally:
+            _current.job = None
@@ -0,0 +1,303 @@
+import bisect
+import functools
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+# Seconds; wide enough for a fast cache hit and a slow run that is close to RUN_TIMEOUT_SECONDS
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RECENT_SPANS = 500
+
+METRICS_PORT = os.environ.get("RAG_METRICS_PORT")
+METRICS_FILE = os.environ.get("RAG_METRICS_FILE")
+METRICS_FILE_INTERVAL = float(os.environ.get("RAG_METRICS_FILE_INTERVAL", "15"))
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def value(self) -> float:
+        return self._value
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_number(self._value)}"]
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label set: [per-bucket counts (not cumulative), sum, count]
+        self._series: Dict[LabelValues, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = f'le="{_number(bound)}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Span(NamedTuple):
+    name: str
+    started_at: float  # wall clock, for display
+    seconds: float
+    status: str
+    attributes: dict
+
+
+class MetricsRegistry:
+    def __init__(self, recent_spans: int = RECENT_SPANS):
+        self.stage_seconds = Histogram(
+            "rag_stage_seconds", "Duration of RAG pipeline stages.", ("stage", "status"))
+        self.api_seconds = Histogram(
+            "rag_api_request_seconds", "OpenAI API request latency, to response headers.",
+            ("operation", "status_code"))
+        self.tokens = Counter(
+            "rag_tokens_total", "Tokens used by completed assistant runs.", ("kind",))
+        self.events = Counter(
+            "rag_events_total", "Notable pipeline events such as cache hits.", ("event",))
+        self._metrics = [self.stage_seconds, self.api_seconds, self.tokens, self.events]
+        self.recent: Deque[Span] = deque(maxlen=recent_spans)
+
+    def register(self, metric) -> None:
+        self._metrics.append(metric)
+
+    def record(self, name: str, seconds: float, status: str = "ok", **attributes) -> None:
+        self.stage_seconds.observe(seconds, stage=name, status=status)
+        self.recent.append(Span(name, time.time() - seconds, seconds, status, attributes))
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[dict]:
+        # The yielded dict can be filled in while the span runs; it is kept with the span
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            yield attributes
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.record(name, time.perf_counter() - started, status, **attributes)
+
+    def timed(self, name: str):
+        # Decorator form of span() for methods that are one stage end to end
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def stage_summary(self) -> List[dict]:
+        # Exact percentiles over the recent spans, for the in-app panel
+        by_stage: Dict[str, List[float]] = defaultdict(list)
+        errors: Dict[str, int] = defaultdict(int)
+        for span in list(self.recent):
+            by_stage[span.name].append(span.seconds)
+            if span.status != "ok":
+                errors[span.name] += 1
+        rows = []
+        for name, samples in sorted(by_stage.items()):
+            samples.sort()
+            rows.append({
+                "stage": name,
+                "count": len(samples),
+                "errors": errors[name],
+                "p50_ms": round(_quantile(samples, 0.5) * 1000, 1),
+                "p95_ms": round(_quantile(samples, 0.95) * 1000, 1),
+                "max_ms": round(samples[-1] * 1000, 1),
+            })
+        return rows
+
+
+def _quantile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+metrics = MetricsRegistry()
+
+# Ids in API paths are replaced so operations aggregate: /threads/thread_abc/runs -> threads.runs
+_STATIC_SEGMENTS = {
+    "files", "vector_stores", "file_batches", "threads", "messages", "runs", "cancel", "steps", "audio",
+    "transcriptions", "speech", "embeddings", "assistants", "content", "submit_tool_outputs", "models",
+}
+_VERSION_RE = re.compile(r"^v\d+$")
+
+
+def api_operation(method: str, path: str) -> str:
+    segments = [s for s in path.split("?", 1)[0].split("/") if s and not _VERSION_RE.match(s)]
+    names = [s for s in segments if s in _STATIC_SEGMENTS]
+    operation = ".".join(names) or "unknown"
+    # A trailing id means the call targets one object; mark it so create/retrieve/delete stay apart
+    if segments and segments[-1] not in _STATIC_SEGMENTS:
+        operation += ".item"
+    return f"{method.upper()} {operation}"
+
+
+def http_event_hooks() -> dict:
+    # httpx hooks for the shared OpenAI client: one timing per request, labelled by operation
+    def on_request(request) -> None:
+        request.extensions["rag_started"] = time.perf_counter()
+
+    def on_response(response) -> None:
+        request = response.request
+        started = request.extensions.get("rag_started")
+        if started is not None:
+            metrics.api_seconds.observe(time.perf_counter() - started,
+                                        operation=api_operation(request.method, request.url.path),
+                                        status_code=response.status_code)
+
+    return {"request": [on_request], "response": [on_response]}
+
+
+def async_http_event_hooks() -> dict:
+    # Same timings for the AsyncOpenAI client, whose httpx hooks must be coroutines
+    hooks = http_event_hooks()
+
+    def wrap(hook):
+        async def call(message) -> None:
+            hook(message)
+        return call
+
+    return {name: [wrap(hook) for hook in functions] for name, functions in hooks.items()}
+
+
+def write_metrics(path: str) -> None:
+    import tempfile
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+    with os.fdopen(fd, "w", encoding="utf-8") as out:
+        out.write(metrics.render())
+    # Atomic, so a node_exporter textfile collector never reads a partial file
+    os.replace(tmp_path, path)
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters(port: Optional[str] = METRICS_PORT, path: Optional[str] = METRICS_FILE,
+                    interval: float = METRICS_FILE_INTERVAL) -> None:
+    # Once per process: serve /metrics on RAG_METRICS_PORT and/or rewrite RAG_METRICS_FILE periodically
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    if port:
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", int(port)), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    if path:
+        def write_forever() -> None:
+            while True:
+                try:
+                    write_metrics(path)
+                except OSError:
+                    pass
+                time.sleep(interval)
+
+        threading.Thread(target=write_forever, name="metrics-file", daemon=True).start()
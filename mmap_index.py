@@ -0,0 +1,372 @@
+import json
+import os
+import re
+import shutil
+import struct
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+# Segment file layout (little endian, every section 64-byte aligned):
+#   header | vectors[rows, dim] (float16 or int8) | scales[rows] float32 | doc_codes[rows] int32
+#   | chunk_indices[rows] int32 | text_offsets[rows + 1] int64 | utf-8 text blob
+# An index is a list of immutable segments, each in a data file <path>.<generation>. The manifest
+# <path>.json lists them with their document ids and the documents removed from each, and is the
+# pointer readers follow. Writers hold <path>.lock, re-read the manifest, append a segment and
+# replace the manifest, so concurrent workers keep each other's documents. A file that is still
+# mapped is never replaced (Windows refuses that); unlisted data files are deleted once nothing maps them.
+MAGIC = b"RAGIDX01"
+FORMAT_VERSION = 1
+MANIFEST_VERSION = 2
+HEADER = struct.Struct("<8sI I Q I 16s 6Q")
+ALIGN = 64
+QUANTIZATIONS = {"float16": (1, np.float16), "int8": (2, np.int8)}
+_DTYPES = {code: (name, dtype) for name, (code, dtype) in QUANTIZATIONS.items()}
+
+# Rows dequantized per step while searching; bounds the float32 working set
+SEARCH_BLOCK_ROWS = 65536
+
+# Segments are merged into one when a save leaves more than this many, or when more than this share
+# of their documents have been removed
+COMPACT_SEGMENTS = 8
+COMPACT_REMOVED_SHARE = 0.25
+
+# One block of rows to write: (unit-normalised float32 vectors, texts, doc codes, chunk indices)
+IndexBlock = Tuple[np.ndarray, Sequence[str], np.ndarray, np.ndarray]
+# Identifies one installed manifest; a replaced manifest is a new inode even within one mtime tick
+IndexVersion = Tuple[int, int, int]
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def sidecar_path(path: str) -> str:
+    return path + ".json"
+
+
+def data_path(path: str, generation: str) -> str:
+    return f"{path}.{generation}"
+
+
+def segment_file(path: str, generation: str) -> str:
+    data = data_path(path, generation)
+    if not os.path.exists(data) and os.path.exists(path):
+        # Written before data files were versioned
+        return path
+    return data
+
+
+def index_version(path: str) -> Optional[IndexVersion]:
+    # Changes whenever a new manifest is installed; None while there is no index
+    try:
+        stat = os.stat(sidecar_path(path))
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+@contextmanager
+def index_lock(path: str) -> Iterator[None]:
+    # Serialises writers across processes and threads; readers never take it
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".lock", "a+b") as handle:
+        if os.name == "nt":
+            import msvcrt
+            handle.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+def _replace(source: str, target: str, attempts: int = 5) -> None:
+    # On Windows a reader holding the target open for a moment makes the rename fail; retry briefly
+    for attempt in range(attempts):
+        try:
+            os.replace(source, target)
+            return
+        except PermissionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.05 * (attempt + 1))
+
+
+def _remove_stale(path: str, keep: Set[str]) -> None:
+    # Data files no segment lists any more, and a pre-versioning data file at path itself
+    directory = os.path.dirname(os.path.abspath(path))
+    keep = {os.path.abspath(name) for name in keep}
+    stale = re.compile(re.escape(os.path.basename(path)) + r"(\.[0-9a-f]{32})?")
+    for name in os.listdir(directory):
+        candidate = os.path.join(directory, name)
+        if stale.fullmatch(name) and candidate not in keep:
+            try:
+                os.remove(candidate)
+            except OSError:
+                # Still mapped by a process on Windows; a later write removes it
+                pass
+
+
+def read_manifest(path: str) -> Optional[dict]:
+    try:
+        with open(sidecar_path(path), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get("format_version", 1) == FORMAT_VERSION:
+        # A single-file index from before segments: it becomes the first segment
+        return {"format_version": MANIFEST_VERSION, "dim": manifest["dim"], "segments": [{
+            "generation": manifest["generation"],
+            "quantization": manifest["quantization"],
+            "rows": manifest["rows"],
+            "document_ids": manifest["document_ids"],
+            "removed": [],
+        }]}
+    if manifest["format_version"] != MANIFEST_VERSION:
+        raise ValueError(f"{sidecar_path(path)} is not a version {MANIFEST_VERSION} index manifest")
+    return manifest
+
+
+def live_documents(manifest: Optional[dict]) -> Set[str]:
+    if manifest is None:
+        return set()
+    return {document_id for segment in manifest["segments"]
+            for document_id in set(segment["document_ids"]).difference(segment["removed"])}
+
+
+def write_manifest(path: str, manifest: dict) -> None:
+    # Call under index_lock(path). Readers switch to the new segment list atomically; data files it
+    # no longer lists are then deleted
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".rag-index-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as meta:
+            json.dump(dict(manifest, format_version=MANIFEST_VERSION), meta)
+        _replace(tmp_path, sidecar_path(path))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _remove_stale(path, {segment_file(path, segment["generation"]) for segment in manifest["segments"]})
+
+
+def quantize(vectors: np.ndarray, quantization: str) -> Tuple[np.ndarray, np.ndarray]:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if quantization == "float16":
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+    if quantization == "int8":
+        # Symmetric per-row scale so each row uses the full int8 range
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.rint(vectors / scales[:, None]).clip(-127, 127).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+    raise ValueError(f"Unknown quantization {quantization!r}; expected one of {sorted(QUANTIZATIONS)}")
+
+
+def write_segment(path: str, blocks: Iterable[IndexBlock], document_ids: List[str], dim: int,
+                  quantization: str = "int8") -> dict:
+    # Writes one segment's data file and returns its manifest entry; nothing reads it until a
+    # manifest lists it
+    code, _ = QUANTIZATIONS[quantization]
+    generation = uuid.uuid4().bytes
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    scales, doc_codes, chunk_indices, text_offsets = [], [], [], [0]
+    rows = 0
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".rag-index-")
+    try:
+        with os.fdopen(fd, "w+b") as out, tempfile.TemporaryFile() as texts:
+            # Vectors stream straight to disk; texts are spooled and appended at the end
+            vectors_offset = _aligned(HEADER.size)
+            out.seek(vectors_offset)
+            for vectors, block_texts, block_codes, block_chunks in blocks:
+                quantized, block_scales = quantize(vectors, quantization)
+                out.write(quantized.tobytes())
+                scales.append(block_scales)
+                doc_codes.append(np.asarray(block_codes, dtype=np.int32))
+                chunk_indices.append(np.asarray(block_chunks, dtype=np.int32))
+                for text in block_texts:
+                    encoded = text.encode("utf-8")
+                    texts.write(encoded)
+                    text_offsets.append(text_offsets[-1] + len(encoded))
+                rows += len(quantized)
+            sections = []
+            for array in (
+                np.concatenate(scales) if scales else np.zeros(0, dtype=np.float32),
+                np.concatenate(doc_codes) if doc_codes else np.zeros(0, dtype=np.int32),
+                np.concatenate(chunk_indices) if chunk_indices else np.zeros(0, dtype=np.int32),
+                np.asarray(text_offsets, dtype=np.int64),
+            ):
+                offset = _aligned(out.tell())
+                out.seek(offset)
+                out.write(array.tobytes())
+                sections.append(offset)
+            texts_offset = _aligned(out.tell())
+            out.seek(texts_offset)
+            texts.seek(0)
+            shutil.copyfileobj(texts, out)
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, FORMAT_VERSION, code, rows, dim, generation,
+                                  vectors_offset, *sections, texts_offset))
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, data_path(path, generation.hex()))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return {"generation": generation.hex(), "quantization": quantization, "rows": rows,
+            "document_ids": document_ids, "removed": []}
+
+
+def needs_compaction(manifest: dict) -> bool:
+    segments = manifest["segments"]
+    documents = sum(len(segment["document_ids"]) for segment in segments)
+    removed = sum(len(segment["removed"]) for segment in segments)
+    return len(segments) > COMPACT_SEGMENTS or removed > documents * COMPACT_REMOVED_SHARE
+
+
+def compact_segments(path: str, manifest: dict, quantization: str = "int8") -> List[dict]:
+    # The live rows of every segment, merged into a single new segment
+    document_ids = [document_id for segment in manifest["segments"] for document_id in segment["document_ids"]
+                    if document_id not in segment["removed"]]
+    if not document_ids:
+        return []
+    positions = {document_id: position for position, document_id in enumerate(document_ids)}
+
+    def blocks() -> Iterator[IndexBlock]:
+        for segment in manifest["segments"]:
+            index = MappedIndex.open_segment(path, segment)
+            removed = set(segment["removed"])
+            remap = np.array([-1 if document_id in removed else positions[document_id]
+                              for document_id in index.document_ids], dtype=np.int32)
+            for start, vectors in index.iter_blocks():
+                end = start + len(vectors)
+                codes = remap[index.doc_codes[start:end]]
+                keep = codes >= 0
+                yield (vectors[keep], [index.text(row) for row in np.flatnonzero(keep) + start],
+                       codes[keep], index.chunk_indices[start:end][keep])
+
+    return [write_segment(path, blocks(), document_ids, manifest["dim"], quantization)]
+
+
+def open_segments(path: str, opened: Dict[str, "MappedIndex"],
+                  attempts: int = 5) -> Tuple[Optional[IndexVersion], List[dict], List["MappedIndex"]]:
+    # The manifest's segments, reusing the already mapped ones in opened (keyed by generation).
+    # version is read first, so a write racing this open is picked up by the next check.
+    for attempt in range(attempts):
+        version = index_version(path)
+        manifest = read_manifest(path)
+        if manifest is None:
+            return version, [], []
+        try:
+            indexes = [opened.get(segment["generation"]) or MappedIndex.open_segment(path, segment)
+                       for segment in manifest["segments"]]
+        except FileNotFoundError:
+            # Compacted away between reading the manifest and opening it
+            time.sleep(0.05 * (attempt + 1))
+            continue
+        return version, manifest["segments"], indexes
+    raise ValueError(f"Segments listed for {path} keep disappearing")
+
+
+def _merge_top_k(best_scores: np.ndarray, best_rows: np.ndarray, scores: np.ndarray, rows: np.ndarray,
+                 k: int) -> Tuple[np.ndarray, np.ndarray]:
+    scores = np.concatenate([best_scores, scores])
+    rows = np.concatenate([best_rows, rows])
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        scores, rows = scores[keep], rows[keep]
+    return scores, rows
+
+
+class MappedIndex:
+    def __init__(self, path: str, header: tuple, document_ids: List[str]):
+        (_, _, code, rows, dim, generation, vectors_offset, scales_offset, codes_offset, chunks_offset,
+         offsets_offset, texts_offset) = header
+        self.path = path
+        self.generation = generation.hex()
+        self.rows = rows
+        self.dim = dim
+        self.quantization, dtype = _DTYPES[code]
+        self.document_ids = document_ids
+        if rows:
+            # Read-only maps: every process opening the same file shares its page cache
+            self.vectors = np.memmap(path, dtype=dtype, mode="r", offset=vectors_offset, shape=(rows, dim))
+            self.scales = np.memmap(path, dtype=np.float32, mode="r", offset=scales_offset, shape=(rows,))
+            self.doc_codes = np.memmap(path, dtype=np.int32, mode="r", offset=codes_offset, shape=(rows,))
+            self.chunk_indices = np.memmap(path, dtype=np.int32, mode="r", offset=chunks_offset, shape=(rows,))
+            self.text_offsets = np.memmap(path, dtype=np.int64, mode="r", offset=offsets_offset, shape=(rows + 1,))
+            text_bytes = int(self.text_offsets[-1])
+            self._texts = np.memmap(path, dtype=np.uint8, mode="r", offset=texts_offset,
+                                    shape=(text_bytes,)) if text_bytes else np.zeros(0, dtype=np.uint8)
+        else:
+            self.vectors = np.zeros((0, dim), dtype=dtype)
+            self.scales = np.zeros(0, dtype=np.float32)
+            self.doc_codes = np.zeros(0, dtype=np.int32)
+            self.chunk_indices = np.zeros(0, dtype=np.int32)
+            self.text_offsets = np.zeros(1, dtype=np.int64)
+            self._texts = np.zeros(0, dtype=np.uint8)
+
+    @classmethod
+    def open_segment(cls, path: str, segment: dict) -> "MappedIndex":
+        # Only the header is read here; the arrays are paged in on demand
+        data = segment_file(path, segment["generation"])
+        with open(data, "rb") as f:
+            header = HEADER.unpack(f.read(HEADER.size))
+        if header[0] != MAGIC or header[1] != FORMAT_VERSION:
+            raise ValueError(f"{data} is not a version {FORMAT_VERSION} index file")
+        if header[5].hex() != segment["generation"]:
+            raise ValueError(f"Manifest for {path} does not match the index file {data}")
+        return cls(data, header, segment["document_ids"])
+
+    def text(self, row: int) -> str:
+        start, end = int(self.text_offsets[row]), int(self.text_offsets[row + 1])
+        return bytes(self._texts[start:end]).decode("utf-8")
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        # Dequantized copies of selected rows; only their pages are touched
+        return self.vectors[rows].astype(np.float32) * self.scales[rows, None]
+
+    def score_rows(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        return (self.vectors[rows].astype(np.float32) @ query) * self.scales[rows]
+
+    def iter_blocks(self, block_rows: int = SEARCH_BLOCK_ROWS):
+        for start in range(0, self.rows, block_rows):
+            end = min(start + block_rows, self.rows)
+            yield start, self.vectors[start:end].astype(np.float32) * self.scales[start:end, None]
+
+    def search(self, query: np.ndarray, top_k: int, allowed_codes: Optional[np.ndarray] = None,
+               block_rows: int = SEARCH_BLOCK_ROWS) -> List[Tuple[int, float]]:
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        if top_k <= 0:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        for start in range(0, self.rows, block_rows):
+            end = min(start + block_rows, self.rows)
+            # Dequantizing is a per-row rescale, so it is applied to the dot products, not the block
+            scores = (self.vectors[start:end].astype(np.float32) @ query) * self.scales[start:end]
+            rows = np.arange(start, end)
+            if allowed_codes is not None:
+                mask = np.isin(self.doc_codes[start:end], allowed_codes)
+                scores, rows = scores[mask], rows[mask]
+            best_scores, best_rows = _merge_top_k(best_scores, best_rows, scores, rows, top_k)
+        order = np.argsort(-best_scores, kind="stable")
+        return [(int(best_rows[i]), float(best_scores[i])) for i in order]
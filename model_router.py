@@ -0,0 +1,156 @@
+import os
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+from bm25_index import tokenize
+from metrics import Counter, metrics
+
+# Ordered fastest first, as name=target pairs. A target is a model to run the assistant with, an
+# assistant id (asst_...) to run instead, or empty for the assistant's own model. Unset, or a single
+# tier, disables routing: every question runs on the assistant as configured.
+MODEL_TIERS = os.environ.get("RAG_MODEL_TIERS", "")
+# Questions longer than this many words go straight to the strongest tier
+LONG_QUESTION_WORDS = int(os.environ.get("RAG_ROUTE_LONG_WORDS", "25"))
+# Share of the question's terms found in the best local chunk below which the strongest tier answers
+MIN_RETRIEVAL_CONFIDENCE = float(os.environ.get("RAG_ROUTE_MIN_CONFIDENCE", "0.5"))
+# A fast-tier answer is shown once this much of it has arrived without hedging
+HOLD_CHARS = int(os.environ.get("RAG_ROUTE_HOLD_CHARS", "120"))
+
+_REASONING_RE = re.compile(
+    r"\b(why|explain|compare|comparison|difference|differences|differ|versus|vs|pros and cons|trade-?offs?|"
+    r"analy[sz]e|evaluate|summari[sz]e|implications?|relationship|impact|step[- ]by[- ]step|"
+    r"how (?:does|do|did|can|could|should|would|is|are))\b",
+    re.IGNORECASE
+)
+_LOOKUP_RE = re.compile(
+    r"^\s*(who|what|when|where|which|is|are|does|do|did|can|how (?:many|much|long|old)|define|list|name)\b",
+    re.IGNORECASE
+)
+_HEDGE_RE = re.compile(
+    r"\b(i (?:couldn't|could not|can't|cannot|was unable to|am unable to|don't|do not) "
+    r"(?:find|locate|see|determine|answer|know)|no (?:relevant )?information|"
+    r"not (?:mentioned|specified|provided|covered|stated) in|"
+    r"(?:doesn't|does not|don't|do not) (?:contain|mention|specify|include|say)|"
+    r"unable to (?:find|answer|determine))",
+    re.IGNORECASE
+)
+_STOPWORDS = frozenset(
+    "a an and are as at be by can could did do does for from had has have how i in is it its me my of on or "
+    "our should that the their there these this those to was we were what when where which who whom why will "
+    "with would you your".split()
+)
+
+route_decisions = Counter("rag_route_decisions_total", "Questions routed to each model tier, by deciding signal.",
+                          ("tier", "reason"))
+route_escalations = Counter("rag_route_escalations_total",
+                            "Fast-tier answers discarded and asked again on the strongest tier.",
+                            ("from_tier", "to_tier", "reason"))
+metrics.register(route_decisions)
+metrics.register(route_escalations)
+
+
+class Tier(NamedTuple):
+    name: str
+    model: Optional[str]
+    assistant_id: Optional[str]
+
+    def run_params(self, default_assistant_id: Optional[str]) -> dict:
+        params = {"assistant_id": self.assistant_id or default_assistant_id}
+        if self.model:
+            params["model"] = self.model
+        return params
+
+
+class Route(NamedTuple):
+    tier: int
+    reason: str
+    words: int
+    confidence: Optional[float]
+
+
+def parse_tiers(spec: str) -> List[Tier]:
+    tiers = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, target = part.partition("=")
+        target = target.strip() or None
+        if target is not None and target.startswith("asst_"):
+            tiers.append(Tier(name.strip(), None, target))
+        else:
+            tiers.append(Tier(name.strip(), target, None))
+    return tiers or [Tier("default", None, None)]
+
+
+def content_terms(text: str) -> List[str]:
+    return [term for term in dict.fromkeys(tokenize(text)) if term not in _STOPWORDS]
+
+
+def term_coverage(question: str, passage: str) -> Optional[float]:
+    # Share of the question's content terms that the passage contains
+    terms = content_terms(question)
+    if not terms:
+        return None
+    found = set(tokenize(passage))
+    return sum(term in found for term in terms) / len(terms)
+
+
+class ModelRouter:
+    # Picks the tier for each run from local signals only, and judges whether a fast-tier answer is
+    # good enough to show or should be asked again on the strongest tier
+    def __init__(self, tiers: Optional[List[Tier]] = None, long_words: int = LONG_QUESTION_WORDS,
+                 min_confidence: float = MIN_RETRIEVAL_CONFIDENCE, hold_chars: int = HOLD_CHARS):
+        self.tiers = tiers if tiers is not None else parse_tiers(MODEL_TIERS)
+        self.long_words = long_words
+        self.min_confidence = min_confidence
+        self.hold_chars = hold_chars
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.tiers) > 1
+
+    @property
+    def strongest(self) -> int:
+        return len(self.tiers) - 1
+
+    def route(self, question: str, confidence: Optional[float] = None) -> Route:
+        words = len(question.split())
+        if not self.enabled:
+            tier, reason = 0, "only_tier"
+        elif words > self.long_words:
+            tier, reason = self.strongest, "long"
+        elif question.count("?") > 1:
+            tier, reason = self.strongest, "multi_part"
+        elif _REASONING_RE.search(question):
+            tier, reason = self.strongest, "reasoning"
+        elif confidence is not None and confidence < self.min_confidence:
+            tier, reason = self.strongest, "low_retrieval"
+        else:
+            tier, reason = 0, "lookup" if _LOOKUP_RE.match(question) else "short"
+        route_decisions.inc(tier=self.tiers[tier].name, reason=reason)
+        return Route(tier, reason, words, None if confidence is None else round(confidence, 3))
+
+    def weak_answer(self, text: str) -> Optional[str]:
+        # Why an answer should be asked again, judged on its opening; None if it can be shown
+        if not text.strip():
+            return "empty"
+        if _HEDGE_RE.search(text[:self.hold_chars * 2]):
+            return "hedged"
+        return None
+
+    def ready(self, text: str) -> bool:
+        # Enough of a fast-tier answer has arrived, without hedging, to start showing it
+        return len(text) >= self.hold_chars and self.weak_answer(text) is None
+
+    def record(self, route: Route, tier: int, seconds: float, escalated_from: Optional[int] = None,
+               escalation: Optional[str] = None) -> Dict[str, object]:
+        # Per-tier run latency, labelled with what decided the route, for tuning the thresholds
+        name = self.tiers[tier].name
+        metrics.record(f"route.{name}", seconds, reason=route.reason, words=route.words,
+                       confidence=route.confidence)
+        decision = {"tier": name, "model": self.tiers[tier].model, "reason": route.reason,
+                    "words": route.words, "confidence": route.confidence}
+        if escalated_from is not None:
+            route_escalations.inc(from_tier=self.tiers[escalated_from].name, to_tier=name, reason=escalation)
+            decision.update(escalated_from=self.tiers[escalated_from].name, escalation=escalation)
+        return decision
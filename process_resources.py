@@ -0,0 +1,115 @@
+import functools
+import os
+import sys
+import threading
+from typing import TYPE_CHECKING, Callable, Optional, TypeVar
+
+if TYPE_CHECKING:
+    import openai
+
+    from resilience import Resilience
+
+T = TypeVar("T")
+
+# One keep-alive pool per process, shared by every session's AdvancedRAG
+HTTP_MAX_CONNECTIONS = int(os.environ.get("RAG_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("RAG_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("RAG_HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.environ.get("RAG_HTTP_TIMEOUT", "120"))
+
+
+def process_singleton(factory: Callable[[], T]) -> Callable[[], T]:
+    # Build on first call, exactly once per process, then return the same object without locking
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(factory)
+    def get() -> T:
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    return get
+
+
+def get_setting(name: str) -> Optional[str]:
+    # Environment first, then Streamlit secrets when running under Streamlit
+    value = os.environ.get(name)
+    if value:
+        return value
+    st = sys.modules.get("streamlit")
+    if st is not None:
+        try:
+            return st.secrets.get(name)
+        except Exception:
+            return None
+    return None
+
+
+def _api_key() -> str:
+    api_key = get_setting("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OpenAI API key not found. Set OPENAI_API_KEY or add it to your Streamlit secrets.")
+    return api_key
+
+
+@process_singleton
+def get_resilience() -> "Resilience":
+    # Breakers are per process, so both clients and every session see the same upstream health
+    from resilience import Resilience
+
+    return Resilience()
+
+
+@process_singleton
+def get_client() -> "openai.OpenAI":
+    import httpx
+    import openai
+
+    from metrics import http_event_hooks
+    from resilience import ResilientTransport
+
+    api_key = _api_key()
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    http_client = openai.DefaultHttpxClient(
+        # Retries and circuit breaking happen per request in the transport (resilience.py)
+        transport=ResilientTransport(httpx.HTTPTransport(limits=limits), get_resilience()),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=10.0),
+        # Every API call is timed per operation into rag_api_request_seconds
+        event_hooks=http_event_hooks(),
+    )
+    # The SDK's own retries would resend POSTs that may already have created a run or message
+    return openai.OpenAI(api_key=api_key, base_url=get_setting("OPENAI_BASE_URL"), http_client=http_client,
+                         max_retries=0)
+
+
+@process_singleton
+def get_async_client() -> "openai.AsyncOpenAI":
+    # Used only on the query executor's event loop (async_queries.py). A streamed run holds its
+    # connection for the whole run, so the pool must be at least as large as the runs allowed in flight.
+    import httpx
+    import openai
+
+    from async_queries import MAX_INFLIGHT_RUNS
+    from metrics import async_http_event_hooks
+    from resilience import AsyncResilientTransport
+
+    api_key = _api_key()
+    limits = httpx.Limits(
+        max_connections=max(HTTP_MAX_CONNECTIONS, MAX_INFLIGHT_RUNS + HTTP_MAX_KEEPALIVE),
+        max_keepalive_connections=max(HTTP_MAX_KEEPALIVE, MAX_INFLIGHT_RUNS),
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    http_client = openai.DefaultAsyncHttpxClient(
+        transport=AsyncResilientTransport(httpx.AsyncHTTPTransport(limits=limits), get_resilience()),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=10.0),
+        event_hooks=async_http_event_hooks(),
+    )
+    return openai.AsyncOpenAI(api_key=api_key, base_url=get_setting("OPENAI_BASE_URL"), http_client=http_client,
+                              max_retries=0)
@@ -0,0 +1,391 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+import httpx
+
+from metrics import Counter, api_operation, metrics
+
+# Attempts per API request, the first included. Idempotent requests retry on timeouts, resets, 429 and 5xx;
+# everything else only on 429 or when the connection was never made, so a run or message is never created twice.
+RETRY_ATTEMPTS = int(os.environ.get("RAG_RETRY_ATTEMPTS", "3"))
+RETRY_BASE_SECONDS = 0.25
+RETRY_MAX_SECONDS = 4.0
+# No retry starts once this long has passed since the first attempt, or the request's own read timeout
+RETRY_BUDGET_SECONDS = float(os.environ.get("RAG_RETRY_BUDGET_SECONDS", "20"))
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Operations that back off on their own (embedding_service.py paces itself against the rate-limit headers)
+SELF_RETRYING = frozenset({"POST embeddings"})
+
+# Assistant runs that fail server-side before any answer text was shown are started again, this many times
+RUN_ATTEMPTS = int(os.environ.get("RAG_RUN_ATTEMPTS", "3"))
+RETRYABLE_RUN_ERRORS = frozenset({"server_error", "rate_limit_exceeded"})
+
+# One breaker per API family (threads, vector_stores, files, audio, embeddings). It opens when at least
+# BREAKER_FAILURE_RATE of the last BREAKER_WINDOW outcomes were 5xx or connection failures, fails requests
+# fast for BREAKER_COOLDOWN_SECONDS, then lets one probe through.
+BREAKER_WINDOW = 20
+BREAKER_MIN_CALLS = 10
+BREAKER_FAILURE_RATE = float(os.environ.get("RAG_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_COOLDOWN_SECONDS = float(os.environ.get("RAG_BREAKER_COOLDOWN_SECONDS", "15"))
+
+# Hedged runs (query executor only): a run still queued after the HEDGE_QUANTILE of recent queue times is
+# duplicated on a fresh thread, the first to start wins and the other is cancelled
+HEDGE_RUNS = os.environ.get("RAG_HEDGE_RUNS", "").lower() in ("1", "true", "yes")
+HEDGE_QUANTILE = float(os.environ.get("RAG_HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_SAMPLES = 20
+HEDGE_SAMPLES = 200
+HEDGE_MIN_DELAY_SECONDS = 0.5
+# Hedges stay under this share of the runs started in the last HEDGE_RATIO_WINDOW_SECONDS
+HEDGE_MAX_RATIO = float(os.environ.get("RAG_HEDGE_MAX_RATIO", "0.1"))
+HEDGE_RATIO_WINDOW_SECONDS = 60.0
+
+api_retries = Counter("rag_api_retries_total", "API requests retried by the resilience layer.",
+                      ("operation", "reason"))
+run_retries = Counter("rag_run_retries_total", "Assistant runs started again after failing.", ("reason",))
+hedged_runs = Counter("rag_hedged_runs_total", "Runs duplicated after staying queued, by which one won.",
+                      ("winner",))
+circuit_rejections = Counter("rag_circuit_rejected_total", "Requests failed fast by an open circuit.", ("circuit",))
+circuit_transitions = Counter("rag_circuit_transitions_total", "Circuit breaker state changes.",
+                              ("circuit", "state"))
+metrics.register(api_retries)
+metrics.register(run_retries)
+metrics.register(hedged_runs)
+metrics.register(circuit_rejections)
+metrics.register(circuit_transitions)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, circuit: str, retry_in: float):
+        super().__init__(f"The {circuit} API is failing; requests are paused for {retry_in:.0f}s")
+        self.circuit = circuit
+        self.retry_in = retry_in
+
+
+class RunFailed(Exception):
+    def __init__(self, run):
+        super().__init__(f"Run {run.status}")
+        self.status = run.status
+        self.code = run.last_error.code if getattr(run, "last_error", None) is not None else None
+
+    @property
+    def retryable(self) -> bool:
+        return self.status == "failed" and self.code in RETRYABLE_RUN_ERRORS
+
+
+def circuit_open(error: BaseException) -> Optional[CircuitOpenError]:
+    # The SDK may wrap transport exceptions in APIConnectionError
+    while error is not None:
+        if isinstance(error, CircuitOpenError):
+            return error
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def backoff(attempt: int, retry_after: Optional[float] = None) -> float:
+    # Full jitter, unless the server said how long to wait
+    if retry_after is not None:
+        return min(retry_after, RETRY_MAX_SECONDS * 4)
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+def _retry_after(response: Optional[httpx.Response]) -> Optional[float]:
+    if response is None:
+        return None
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = response.headers.get(header)
+        if value:
+            try:
+                return float(value) * scale
+            except ValueError:
+                return None
+    return None
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_rate: float = BREAKER_FAILURE_RATE, cooldown: float = BREAKER_COOLDOWN_SECONDS):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _move(self, state: str) -> None:
+        self.state = state
+        circuit_transitions.inc(circuit=self.name, state=state)
+
+    def allow(self) -> None:
+        with self._lock:
+            if self.state == "closed":
+                return
+            now = time.monotonic()
+            if self.state == "open" and now - self._opened_at >= self.cooldown:
+                self._move("half_open")
+                self._probe_started = None
+            # One probe at a time; a probe that never reports back (cancelled) is replaced after a cooldown
+            if self.state == "half_open" and (self._probe_started is None
+                                              or now - self._probe_started >= self.cooldown):
+                self._probe_started = now
+                return
+            retry_in = max(0.0, self._opened_at + self.cooldown - now)
+        circuit_rejections.inc(circuit=self.name)
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            if self.state == "half_open":
+                if ok:
+                    self._outcomes.clear()
+                    self._move("closed")
+                else:
+                    self._opened_at = time.monotonic()
+                    self._move("open")
+                return
+            if self.state == "open":
+                return
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures >= self.failure_rate * len(self._outcomes):
+                self._opened_at = time.monotonic()
+                self._move("open")
+
+
+class HedgePolicy:
+    # When to duplicate a run that is still queued: after the HEDGE_QUANTILE of recent queue times,
+    # and only while hedges are a small share of recent runs
+    def __init__(self, enabled: bool = HEDGE_RUNS, quantile: float = HEDGE_QUANTILE,
+                 min_samples: int = HEDGE_MIN_SAMPLES, max_ratio: float = HEDGE_MAX_RATIO):
+        self.enabled = enabled
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.max_ratio = max_ratio
+        self._samples: Deque[float] = deque(maxlen=HEDGE_SAMPLES)
+        self._runs: Deque[float] = deque()
+        self._hedges: Deque[float] = deque()
+        self.wins = {"primary": 0, "hedge": 0}
+        self._lock = threading.Lock()
+
+    def observe(self, queued_seconds: float) -> None:
+        with self._lock:
+            self._samples.append(queued_seconds)
+
+    def _trim(self, now: float) -> None:
+        for events in (self._runs, self._hedges):
+            while events and now - events[0] > HEDGE_RATIO_WINDOW_SECONDS:
+                events.popleft()
+
+    def delay(self) -> Optional[float]:
+        # Called once per run; None means the run is not hedged
+        if not self.enabled:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            self._runs.append(now)
+            self._trim(now)
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return max(HEDGE_MIN_DELAY_SECONDS, ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))])
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            if len(self._hedges) >= self.max_ratio * len(self._runs):
+                return False
+            self._hedges.append(now)
+            return True
+
+    def record(self, winner: str) -> None:
+        with self._lock:
+            self.wins[winner] += 1
+        hedged_runs.inc(winner=winner)
+
+
+class Resilience:
+    # Process-wide: the breakers and retry rules used by the shared HTTP clients, and run-level
+    # retries and hedging used by AdvancedRAG
+    def __init__(self, attempts: int = RETRY_ATTEMPTS, run_attempts: int = RUN_ATTEMPTS,
+                 hedging: Optional[HedgePolicy] = None):
+        self.attempts = attempts
+        self.run_attempts = run_attempts
+        self.hedging = hedging if hedging is not None else HedgePolicy()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self._stats = {"retries": 0, "run_retries": 0}
+
+    def count(self, **deltas: int) -> None:
+        with self._lock:
+            for key, value in deltas.items():
+                self._stats[key] += value
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name)
+            return breaker
+
+    def retry_delay(self, attempt: int, give_up_at: float, retry_after: Optional[float] = None) -> Optional[float]:
+        # Seconds to wait before attempt + 1, or None to give up
+        if attempt + 1 >= self.attempts:
+            return None
+        delay = backoff(attempt, retry_after)
+        if time.monotonic() + delay >= give_up_at:
+            return None
+        return delay
+
+    def run_failed(self, run) -> RunFailed:
+        # A run failing server-side is an upstream failure even though its stream returned 200
+        error = RunFailed(run)
+        if error.retryable:
+            self.breaker("threads").record(False)
+        return error
+
+    def run_retry_delay(self, error: BaseException, attempt: int, give_up_at: float) -> Optional[float]:
+        import openai
+
+        if attempt + 1 >= self.run_attempts or circuit_open(error) is not None:
+            return None
+        if isinstance(error, RunFailed):
+            if not error.retryable:
+                return None
+            reason = error.code
+        elif isinstance(error, (openai.APIConnectionError, openai.InternalServerError, openai.RateLimitError)):
+            reason = type(error).__name__
+        else:
+            return None
+        retry_after = _retry_after(getattr(error, "response", None))
+        delay = backoff(attempt, retry_after)
+        if time.monotonic() + delay >= give_up_at:
+            return None
+        run_retries.inc(reason=reason)
+        self.count(run_retries=1)
+        return delay
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            stats = dict(self._stats, circuits={name: breaker.state for name, breaker in self._breakers.items()})
+        if self.hedging.enabled:
+            stats["hedged_runs"] = dict(self.hedging.wins)
+        return stats
+
+
+def circuit_name(path: str) -> str:
+    segments = [s for s in path.split("?", 1)[0].split("/") if s and s != "v1"]
+    return segments[0] if segments else "api"
+
+
+def _idempotent(method: str, operation: str) -> bool:
+    return method in ("GET", "HEAD", "DELETE", "OPTIONS") or operation.endswith(".cancel")
+
+
+def _error_reason(error: Exception, idempotent: bool) -> Optional[str]:
+    # Connection never made: safe to resend anything. Anything later only for idempotent requests.
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)):
+        return "connect"
+    if idempotent and isinstance(error, (httpx.ReadTimeout, httpx.WriteTimeout)):
+        return "timeout"
+    if idempotent and isinstance(error, (httpx.ReadError, httpx.WriteError, httpx.RemoteProtocolError)):
+        return "reset"
+    return None
+
+
+def _give_up_at(request: httpx.Request, started: float) -> float:
+    timeout = request.extensions.get("timeout") or {}
+    budget = min(RETRY_BUDGET_SECONDS, timeout.get("read") or RETRY_BUDGET_SECONDS)
+    return started + budget
+
+
+class _Attempts:
+    # Retry bookkeeping for one request, shared by the sync and async transports
+    def __init__(self, resilience: Resilience, request: httpx.Request):
+        self.resilience = resilience
+        self.operation = api_operation(request.method, request.url.path)
+        self.breaker = resilience.breaker(circuit_name(request.url.path))
+        self.idempotent = _idempotent(request.method, self.operation)
+        self.give_up_at = _give_up_at(request, time.monotonic())
+        self.attempt = 0
+
+    def after_error(self, error: Exception) -> Optional[float]:
+        self.breaker.record(False)
+        reason = _error_reason(error, self.idempotent)
+        return self._next(reason, None)
+
+    def after_response(self, response: httpx.Response) -> Optional[float]:
+        # 429 says nothing about the upstream's health, and a rate-limited request was never processed
+        self.breaker.record(response.status_code < 500)
+        if response.status_code not in RETRY_STATUSES or not (self.idempotent or response.status_code == 429):
+            return None
+        return self._next(str(response.status_code), _retry_after(response))
+
+    def _next(self, reason: Optional[str], retry_after: Optional[float]) -> Optional[float]:
+        if reason is None or self.operation in SELF_RETRYING:
+            return None
+        delay = self.resilience.retry_delay(self.attempt, self.give_up_at, retry_after)
+        if delay is not None:
+            api_retries.inc(operation=self.operation, reason=reason)
+            self.resilience.count(retries=1)
+            self.attempt += 1
+        return delay
+
+
+class ResilientTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport, resilience: Resilience):
+        self._transport = transport
+        self.resilience = resilience
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        attempts = _Attempts(self.resilience, request)
+        while True:
+            attempts.breaker.allow()
+            try:
+                response = self._transport.handle_request(request)
+            except httpx.TransportError as e:
+                delay = attempts.after_error(e)
+                if delay is None:
+                    raise
+            else:
+                delay = attempts.after_response(response)
+                if delay is None:
+                    return response
+                response.close()
+            time.sleep(delay)
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class AsyncResilientTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, resilience: Resilience):
+        self._transport = transport
+        self.resilience = resilience
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        attempts = _Attempts(self.resilience, request)
+        while True:
+            attempts.breaker.allow()
+            try:
+                response = await self._transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                delay = attempts.after_error(e)
+                if delay is None:
+                    raise
+            else:
+                delay = attempts.after_response(response)
+                if delay is None:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
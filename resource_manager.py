@@ -0,0 +1,414 @@
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from metrics import metrics
+
+if TYPE_CHECKING:
+    import openai
+    from document_registry import DocumentRegistry
+
+logger = logging.getLogger(__name__)
+
+# Every thread and vector store the app creates is recorded here with its owner and last use,
+# so abandoned ones can be deleted instead of piling up in the account
+DEFAULT_LEDGER_PATH = os.environ.get(
+    "RAG_RESOURCE_LEDGER_PATH",
+    os.path.join(os.path.expanduser("~"), ".openai_rag", "resources.sqlite3")
+)
+THREAD_TTL_SECONDS = float(os.environ.get("RAG_THREAD_TTL_HOURS", "24")) * 3600
+SESSION_STORE_TTL_SECONDS = float(os.environ.get("RAG_SESSION_STORE_TTL_HOURS", "24")) * 3600
+# Stores shared through the document registry live longer; they are what makes re-uploads instant
+SHARED_STORE_TTL_SECONDS = float(os.environ.get("RAG_SHARED_STORE_TTL_DAYS", "7")) * 86400
+SWEEP_INTERVAL_SECONDS = float(os.environ.get("RAG_SWEEP_INTERVAL_SECONDS", "300"))
+SWEEP_BATCH = 500
+SWEEP_WORKERS = 8
+# Last-used times are written at most this often per resource
+TOUCH_INTERVAL_SECONDS = 60
+
+# Threads created ahead of time for the most recently used vector stores
+RESERVE_THREADS_PER_STORE = int(os.environ.get("RAG_RESERVE_THREADS", "2"))
+RESERVE_STORES = 16
+# Reserved threads older than this are released rather than handed out, well before the sweeper's TTL
+RESERVE_MAX_AGE_SECONDS = 3600
+
+SHARED_OWNER = "registry"
+RESERVE_OWNER = "reserve"
+
+
+class TrackedResource(NamedTuple):
+    resource_id: str
+    kind: str  # "thread" or "vector_store"
+    owner: str
+
+
+class ResourceLedger:
+    def __init__(self, path: str = DEFAULT_LEDGER_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connect lazily so importing the app never touches the disk
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            if self.path != ":memory:":
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS resources (
+                    resource_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL,
+                    released INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS resources_last_used ON resources (released, last_used_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def track(self, resource_id: str, kind: str, owner: str) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO resources (resource_id, kind, owner, created_at, last_used_at, released)
+                VALUES (?, ?, ?, ?, ?, 0)
+                """,
+                (resource_id, kind, owner, now, now)
+            )
+            conn.commit()
+            self._touched[resource_id] = now
+
+    def touch(self, *resource_ids: Optional[str]) -> None:
+        now = time.time()
+        with self._lock:
+            due = [resource_id for resource_id in resource_ids
+                   if resource_id and now - self._touched.get(resource_id, 0.0) >= TOUCH_INTERVAL_SECONDS]
+            if not due:
+                return
+            conn = self._connect()
+            conn.executemany("UPDATE resources SET last_used_at = ? WHERE resource_id = ?",
+                             [(now, resource_id) for resource_id in due])
+            conn.commit()
+            for resource_id in due:
+                self._touched[resource_id] = now
+
+    def reassign(self, resource_id: str, owner: str) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("UPDATE resources SET owner = ?, last_used_at = ? WHERE resource_id = ?",
+                         (owner, now, resource_id))
+            conn.commit()
+            self._touched[resource_id] = now
+
+    def release(self, *resource_ids: Optional[str]) -> None:
+        # Released resources are deleted by the next sweep regardless of age
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("UPDATE resources SET released = 1 WHERE resource_id = ?",
+                             [(resource_id,) for resource_id in resource_ids if resource_id])
+            conn.commit()
+
+    def release_owner(self, owner: str) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("UPDATE resources SET released = 1 WHERE owner = ?", (owner,))
+            conn.commit()
+
+    def expired(self, now: Optional[float] = None, limit: int = SWEEP_BATCH) -> List[TrackedResource]:
+        now = time.time() if now is None else now
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                """
+                SELECT resource_id, kind, owner FROM resources
+                WHERE released = 1
+                   OR (kind = 'thread' AND last_used_at < ?)
+                   OR (kind = 'vector_store' AND owner != ? AND last_used_at < ?)
+                   OR (kind = 'vector_store' AND owner = ? AND last_used_at < ?)
+                ORDER BY last_used_at
+                LIMIT ?
+                """,
+                (now - THREAD_TTL_SECONDS, SHARED_OWNER, now - SESSION_STORE_TTL_SECONDS,
+                 SHARED_OWNER, now - SHARED_STORE_TTL_SECONDS, limit)
+            ).fetchall()
+        return [TrackedResource(*row) for row in rows]
+
+    def contains(self, resource_id: str) -> bool:
+        with self._lock:
+            conn = self._connect()
+            return conn.execute("SELECT 1 FROM resources WHERE resource_id = ?", (resource_id,)).fetchone() is not None
+
+    def forget(self, resource_ids: Iterable[str]) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("DELETE FROM resources WHERE resource_id = ?", [(r,) for r in resource_ids])
+            conn.commit()
+            for resource_id in resource_ids:
+                self._touched.pop(resource_id, None)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                "SELECT kind || CASE released WHEN 1 THEN '_released' ELSE '' END, COUNT(*) "
+                "FROM resources GROUP BY kind, released"
+            ).fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _is_not_found(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 404
+
+
+class ResourceManager:
+    # Creates, reserves and garbage-collects the app's threads and vector stores.
+    # Threads are kept ready per vector store, so opening a session on a known store costs no API call.
+    def __init__(self, client: Callable[[], "openai.OpenAI"], ledger: Optional[ResourceLedger] = None,
+                 registry: Optional["DocumentRegistry"] = None,
+                 reserve_per_store: int = RESERVE_THREADS_PER_STORE, reserve_stores: int = RESERVE_STORES):
+        self._client = client
+        self.ledger = ledger if ledger is not None else ResourceLedger()
+        self.registry = registry
+        self.reserve_per_store = reserve_per_store
+        self.reserve_stores = reserve_stores
+        # vector store id (None for unbound threads) -> (thread id, created at), most recently used last
+        self._reserve: "OrderedDict[Optional[str], Deque[Tuple[str, float]]]" = OrderedDict()
+        self._refilling: set = set()
+        self._lock = threading.Lock()
+        self._background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="resource-reserve")
+        self._sweeper: Optional[threading.Thread] = None
+        self.stats = {"reserve_hits": 0, "reserve_misses": 0, "swept": 0}
+
+    # --- creation ---
+
+    def create_vector_store(self, owner: str, name: str = "knowledge_base"):
+        # The server-side expiry is a backstop for stores whose ledger entry is lost
+        ttl = SHARED_STORE_TTL_SECONDS if owner == SHARED_OWNER else SESSION_STORE_TTL_SECONDS
+        vector_store = self._client().vector_stores.create(
+            name=name,
+            expires_after={"anchor": "last_active_at", "days": max(1, int(ttl // 86400))}
+        )
+        self.ledger.track(vector_store.id, "vector_store", owner)
+        return vector_store
+
+    def _create_thread(self, vector_store_id: Optional[str], owner: str,
+                       messages: Optional[List[dict]] = None) -> str:
+        tool_resources = {"file_search": {"vector_store_ids": [vector_store_id]}} if vector_store_id else None
+        thread = self._client().beta.threads.create(
+            **({"tool_resources": tool_resources} if tool_resources else {}),
+            **({"messages": messages} if messages else {})
+        )
+        self.ledger.track(thread.id, "thread", owner)
+        return thread.id
+
+    def create_thread(self, vector_store_id: Optional[str], owner: str, messages: List[dict]) -> str:
+        # A thread that starts with a conversation (hedged runs), so never one from the reserve
+        return self._create_thread(vector_store_id, owner, messages)
+
+    def take_thread(self, vector_store_id: Optional[str], owner: str, reserve: bool = True) -> str:
+        # A reserved thread bound to this store if one is ready, otherwise a new one; the reserve is
+        # topped up in the background either way. Only shared stores keep a reserve: a session's
+        # private store gets no second thread, so reserved ones would just wait for the sweeper.
+        thread_id = None
+        stale = []
+        with self._lock:
+            ready = self._reserve.get(vector_store_id)
+            while ready:
+                candidate, created_at = ready.popleft()
+                if time.time() - created_at < RESERVE_MAX_AGE_SECONDS:
+                    thread_id = candidate
+                    break
+                stale.append(candidate)
+        if stale:
+            self.ledger.release(*stale)
+        if thread_id is not None:
+            self.stats["reserve_hits"] += 1
+            metrics.events.inc(event="thread_reserve_hit")
+            self.ledger.reassign(thread_id, owner)
+        else:
+            if reserve:
+                self.stats["reserve_misses"] += 1
+                metrics.events.inc(event="thread_reserve_miss")
+            thread_id = self._create_thread(vector_store_id, owner)
+        if reserve:
+            self.prepare(vector_store_id)
+        return thread_id
+
+    def prepare(self, vector_store_id: Optional[str]) -> None:
+        # Start creating threads for a store that is about to be used, e.g. while its files index
+        with self._lock:
+            self._reserve.setdefault(vector_store_id, deque())
+            self._reserve.move_to_end(vector_store_id)
+            evicted = []
+            while len(self._reserve) > self.reserve_stores:
+                _, threads = self._reserve.popitem(last=False)
+                evicted.extend(thread_id for thread_id, _ in threads)
+            start = vector_store_id not in self._refilling
+            self._refilling.add(vector_store_id)
+        if evicted:
+            self.ledger.release(*evicted)
+        if start:
+            self._background.submit(self._refill, vector_store_id)
+
+    def _refill(self, vector_store_id: Optional[str]) -> None:
+        try:
+            while True:
+                with self._lock:
+                    reserve = self._reserve.get(vector_store_id)
+                    if reserve is None or len(reserve) >= self.reserve_per_store:
+                        return
+                thread_id = self._create_thread(vector_store_id, RESERVE_OWNER)
+                with self._lock:
+                    reserve = self._reserve.get(vector_store_id)
+                    if reserve is not None:
+                        reserve.append((thread_id, time.time()))
+                        continue
+                # The store was evicted while this thread was being created
+                self.ledger.release(thread_id)
+                return
+        except Exception as e:
+            # Best effort: take_thread falls back to creating a thread on demand
+            metrics.events.inc(event="thread_reserve_error")
+            logger.warning("Could not reserve a thread for %s: %s", vector_store_id, e)
+        finally:
+            with self._lock:
+                self._refilling.discard(vector_store_id)
+
+    def forget_store(self, vector_store_id: str) -> None:
+        # A store that is gone (deleted, expired) must not hand out threads bound to it
+        with self._lock:
+            threads = self._reserve.pop(vector_store_id, ())
+        self.ledger.release(*(thread_id for thread_id, _ in threads))
+
+    def release(self, *resource_ids: Optional[str]) -> None:
+        # No longer needed: deleted by the next sweep, in bulk, off the request path
+        for resource_id in resource_ids:
+            if resource_id:
+                self.forget_store(resource_id)
+        self.ledger.release(*resource_ids)
+
+    def release_owner(self, owner: str) -> None:
+        self.ledger.release_owner(owner)
+
+    def touch(self, *resource_ids: Optional[str]) -> None:
+        self.ledger.touch(*resource_ids)
+
+    # --- garbage collection ---
+
+    def _delete(self, resource: TrackedResource) -> bool:
+        client = self._client()
+        try:
+            if resource.kind == "thread":
+                client.beta.threads.delete(resource.resource_id)
+            else:
+                client.vector_stores.delete(resource.resource_id)
+        except Exception as e:
+            if not _is_not_found(e):
+                return False
+        if resource.kind == "vector_store":
+            self.forget_store(resource.resource_id)
+            if resource.owner == SHARED_OWNER and self.registry is not None:
+                self.registry.forget_vector_store(resource.resource_id)
+        return True
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        # Deletes released and expired resources, SWEEP_WORKERS at a time; failures are retried next sweep
+        deleted = 0
+        with metrics.span("resources.sweep"):
+            while True:
+                batch = self.ledger.expired(now)
+                if not batch:
+                    break
+                with ThreadPoolExecutor(max_workers=SWEEP_WORKERS) as pool:
+                    outcomes = list(pool.map(self._delete, batch))
+                done = [resource.resource_id for resource, ok in zip(batch, outcomes) if ok]
+                self.ledger.forget(done)
+                deleted += len(done)
+                for resource, ok in zip(batch, outcomes):
+                    if ok:
+                        metrics.events.inc(event=f"swept_{resource.kind}")
+                if len(done) < len(batch):
+                    break
+        self.stats["swept"] += deleted
+        return deleted
+
+    def start_sweeper(self, interval: float = SWEEP_INTERVAL_SECONDS) -> None:
+        if interval <= 0 or self._sweeper is not None:
+            return
+
+        def sweep_forever() -> None:
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.warning("Resource sweep failed: %s", e)
+
+        self._sweeper = threading.Thread(target=sweep_forever, name="resource-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def purge_untracked(self, idle_days: float, delete: bool = False, name: str = "knowledge_base") -> List[str]:
+        # Vector stores this app created before the ledger existed: untracked here, named like ours,
+        # and idle for idle_days. Other hosts track their own stores, so an idle cut-off keeps them safe.
+        cutoff = time.time() - idle_days * 86400
+        candidates = []
+        for vector_store in self._client().vector_stores.list(limit=100):
+            last_active = vector_store.last_active_at or vector_store.created_at
+            if vector_store.name == name and last_active < cutoff and not self.ledger.contains(vector_store.id):
+                candidates.append(vector_store.id)
+        if delete and candidates:
+            # Treated as shared so any registry entry still pointing at the store is dropped too
+            resources = [TrackedResource(store_id, "vector_store", SHARED_OWNER) for store_id in candidates]
+            with ThreadPoolExecutor(max_workers=SWEEP_WORKERS) as pool:
+                outcomes = list(pool.map(self._delete, resources))
+            candidates = [store_id for store_id, ok in zip(candidates, outcomes) if ok]
+        return candidates
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Garbage-collect the threads and vector stores this app created")
+    parser.add_argument("--sweep", action="store_true", help="delete released and expired resources in the ledger")
+    parser.add_argument("--purge-untracked-days", type=float, metavar="DAYS",
+                        help="also list untracked 'knowledge_base' vector stores idle for DAYS")
+    parser.add_argument("--delete", action="store_true", help="delete the untracked stores instead of listing them")
+    args = parser.parse_args()
+
+    from document_registry import DocumentRegistry
+    from process_resources import get_client
+
+    manager = ResourceManager(get_client, registry=DocumentRegistry())
+    if args.sweep:
+        print(f"Swept {manager.sweep()} resource(s)")
+    if args.purge_untracked_days is not None:
+        stores = manager.purge_untracked(args.purge_untracked_days, delete=args.delete)
+        print(f"{'Deleted' if args.delete else 'Would delete'} {len(stores)} untracked vector store(s)")
+        for store_id in stores:
+            print(store_id)
+    print(manager.ledger.counts())
+
+
+if __name__ == "__main__":
+    main()
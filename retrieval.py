@@ -0,0 +1,560 @@
+import hashlib
+import os
+import re
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from ann_index import IVFIndex, recall_at_k
+from bm25_index import BM25Index, bm25_idf, reciprocal_rank_fusion, tokenize
+from document_pipeline import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, iter_batches, iter_text_chunks
+from mmap_index import (IndexVersion, MappedIndex, compact_segments, index_lock, index_version, live_documents,
+                        needs_compaction, open_segments, read_manifest, write_manifest, write_segment)
+
+# Maps a batch of texts to a (len(texts), dim) array of embeddings
+Embedder = Callable[[List[str]], np.ndarray]
+
+EMBED_BATCH_SIZE = 64
+
+# Below this many rows a segment is searched exactly; brute force is already fast there
+ANN_MIN_ROWS = 20000
+# Retrain IVF centroids once a segment has grown this much since the last training
+ANN_RETRAIN_GROWTH = 4
+# A filtered search whose documents have at most this many rows in a segment scores those rows exactly;
+# probing IVF lists first and filtering after would mostly find other documents' rows
+FILTER_EXACT_ROWS = 20000
+
+SEARCH_MODES = ("vector", "bm25", "hybrid")
+# In hybrid mode each retriever contributes this many candidates per requested result to the fusion
+HYBRID_DEPTH = 4
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    # Deterministic, offline bag-of-words embedder for tests and air-gapped runs
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in _TOKEN_RE.findall(text.lower()):
+                digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                sign = 1.0 if value & 1 else -1.0
+                vectors[row, (value >> 1) % self.dim] += sign
+        return vectors
+
+
+class SearchResult(NamedTuple):
+    document_id: str
+    chunk_index: int
+    text: str
+    score: float
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    # argpartition finds the top k in O(n); only those k are then sorted
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.size:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def document_rows(doc_codes: np.ndarray) -> Dict[int, np.ndarray]:
+    # Ascending rows of every document code, from one sort instead of a scan per search
+    order = np.argsort(doc_codes, kind="stable")
+    codes, starts = np.unique(doc_codes[order], return_index=True)
+    return {int(code): rows for code, rows in zip(codes, np.split(order, starts[1:]))}
+
+
+def _best_rows(rows: np.ndarray, scores: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+    return [(int(rows[i]), float(scores[i])) for i in top_k_indices(scores, top_k)]
+
+
+def _probe(ivf: IVFIndex, query: np.ndarray, codes: np.ndarray, allowed: Optional[np.ndarray],
+           allowed_rows: int, top_k: int) -> np.ndarray:
+    # IVF candidates of the allowed documents. Lists are probed in proportion to how few rows pass the
+    # filter, so about as many allowed rows are scored as an unfiltered search would score, and more
+    # lists are probed until top_k of them turn up.
+    nprobe = ivf.nprobe
+    if allowed is not None:
+        nprobe = int(np.ceil(nprobe * ivf.size / max(allowed_rows, 1)))
+    nprobe = min(nprobe, len(ivf.centroids))
+    while True:
+        rows = ivf.candidates(query, nprobe)
+        if allowed is not None:
+            rows = rows[np.isin(codes[rows], allowed)]
+        if len(rows) >= top_k or nprobe >= len(ivf.centroids):
+            return np.sort(rows)
+        nprobe *= 2
+
+
+class VectorIndex:
+    # Unit-normalised vectors in one contiguous float32 matrix that grows by doubling
+    def __init__(self, dim: int, capacity: int = 1024):
+        self.dim = dim
+        self.matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self.size = 0
+
+    def add(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = normalize_rows(vectors)
+        needed = self.size + len(vectors)
+        if needed > self.matrix.shape[0]:
+            capacity = max(needed, self.matrix.shape[0] * 2)
+            grown = np.zeros((capacity, self.dim), dtype=np.float32)
+            grown[:self.size] = self.matrix[:self.size]
+            self.matrix = grown
+        rows = np.arange(self.size, needed)
+        self.matrix[self.size:needed] = vectors
+        self.size = needed
+        return rows
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        return self.matrix[:self.size] @ query
+
+    def keep_rows(self, rows: np.ndarray) -> None:
+        kept = self.matrix[rows]
+        self.matrix[:len(kept)] = kept
+        self.matrix[len(kept):self.size] = 0.0
+        self.size = len(kept)
+
+
+class Segment:
+    # One persisted segment: its mapped file, the documents removed from it, and the search structures
+    # built over it. Segments never change once written, so these are built once and kept across saves.
+    def __init__(self, index: MappedIndex):
+        self.index = index
+        self.codes = {document_id: code for code, document_id in enumerate(index.document_ids)}
+        self.removed: Set[str] = set()
+        self.bm25: Optional[BM25Index] = None
+        self.ivf: Optional[IVFIndex] = None
+        self.doc_rows: Optional[Dict[int, np.ndarray]] = None
+        self.build_lock = threading.Lock()
+
+    def build(self, keywords: bool, vectors: bool, ann: Optional[str], nprobe: int) -> None:
+        # One block-wise pass over the mapped rows per structure, by whichever thread needs it first
+        index = self.index
+        with self.build_lock:
+            if keywords and self.bm25 is None:
+                bm25 = BM25Index()
+                for start in range(0, index.rows, 4096):
+                    bm25.add(index.text(row) for row in range(start, min(start + 4096, index.rows)))
+                self.bm25 = bm25
+            if vectors and self.doc_rows is None:
+                self.doc_rows = document_rows(index.doc_codes)
+            if vectors and ann is not None and index.rows >= ANN_MIN_ROWS and self.ivf is None:
+                ivf = IVFIndex(nprobe=nprobe)
+                ivf.train(index.take(ivf.training_rows(index.rows)), index.rows)
+                ivf.add_blocks(index.iter_blocks())
+                self.ivf = ivf
+
+
+class RetrievalEngine:
+    def __init__(self, embedder: Embedder, max_tokens: int = CHUNK_TOKENS,
+                 overlap_tokens: int = CHUNK_OVERLAP_TOKENS, batch_size: int = EMBED_BATCH_SIZE,
+                 index_path: Optional[str] = None, quantization: str = "int8",
+                 ann: Optional[str] = None, nprobe: int = 8, mode: str = "hybrid"):
+        if ann not in (None, "ivf"):
+            raise ValueError(f"Unknown ANN index {ann!r}; expected None or 'ivf'")
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {mode!r}; expected one of {SEARCH_MODES}")
+        self.embedder = embedder
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.batch_size = batch_size
+        self.index_path = index_path
+        self.quantization = quantization
+        self.ann = ann
+        self.nprobe = nprobe
+        self.mode = mode
+        self._memory_ivf: Optional[IVFIndex] = None
+        # Keyword index built during ingestion next to the chunk embeddings
+        self._memory_bm25 = BM25Index()
+        # Embeds queries while the keyword side is ranked
+        self._query_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval-query")
+        # In-memory rows for documents added since the last persist()
+        self.index: Optional[VectorIndex] = None
+        self.texts: List[str] = []
+        self.chunk_indices: List[int] = []
+        self.doc_codes = np.zeros(0, dtype=np.int32)
+        self._doc_codes: Dict[str, int] = {}
+        self._doc_ids: List[str] = []
+        # Documents still streaming through add_chunks; persist() leaves them in memory
+        self._ingesting: Set[str] = set()
+        # Persisted segments, memory-mapped from index_path and searched in place, and the segment
+        # each persisted document lives in
+        self.segments: List[Segment] = []
+        self._persisted: Dict[str, Segment] = {}
+        self._version: Optional[IndexVersion] = None
+        # Persisted documents removed here; masked until persist() records the removal
+        self._removed: Set[str] = set()
+        # Structures searches have needed so far; segments picked up later get them before they are used
+        self._keywords_used = False
+        self._vectors_used = False
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+        self._refresh(wait=True)
+
+    def _refresh(self, wait: bool = False) -> None:
+        # Pick up segments appended or compacted by this or another process. New segments are mapped and
+        # their search structures built without holding _lock, then swapped in; searches meanwhile keep
+        # using the current segments unless wait is set.
+        if not self.index_path or index_version(self.index_path) in (None, self._version):
+            return
+        if not self._refresh_lock.acquire(blocking=wait or self._version is None):
+            return
+        try:
+            current = {segment.index.generation: segment for segment in self.segments}
+            version, entries, indexes = open_segments(
+                self.index_path, {generation: segment.index for generation, segment in current.items()})
+            if version == self._version:
+                return
+            segments = [current.get(index.generation) or Segment(index) for index in indexes]
+            for segment in segments:
+                if segment.index.generation not in current:
+                    segment.build(self._keywords_used, self._vectors_used, self.ann, self.nprobe)
+            with self._lock:
+                for segment, entry in zip(segments, entries):
+                    segment.removed = set(entry["removed"])
+                self.segments = segments
+                self._version = version
+                self._persisted = {document_id: segment for segment in segments
+                                   for document_id in segment.codes if document_id not in segment.removed}
+                self._removed &= self._persisted.keys()
+                # A document still being ingested keeps its memory rows until add_chunks finishes with it
+                persisted = [document_id for document_id in self._doc_codes
+                             if document_id in self._persisted and document_id not in self._ingesting]
+                for document_id in persisted:
+                    self._drop_memory_document(document_id)
+        finally:
+            self._refresh_lock.release()
+
+    def has_document(self, document_id: str) -> bool:
+        self._refresh()
+        with self._lock:
+            if document_id in self._doc_codes:
+                return True
+            return document_id in self._persisted and document_id not in self._removed
+
+    def add_document(self, document_id: str, text: str) -> int:
+        return self.add_chunks(document_id, iter_text_chunks(text, self.max_tokens, self.overlap_tokens))
+
+    def _append_rows(self, code: int, first_chunk: int, chunks: List[str], vectors: np.ndarray) -> None:
+        if self.index is None:
+            self.index = VectorIndex(vectors.shape[1])
+        first_row = self.index.size
+        self.index.add(vectors)
+        self._update_memory_ann(first_row)
+        self._memory_bm25.add(chunks)
+        self.texts.extend(chunks)
+        self.chunk_indices.extend(range(first_chunk, first_chunk + len(chunks)))
+        self.doc_codes = np.concatenate([self.doc_codes, np.full(len(chunks), code, dtype=np.int32)])
+
+    def add_chunks(self, document_id: str, chunks: Iterable[str]) -> int:
+        # Consumes a lazy chunk stream: batch n is embedded while batch n + 1 is being extracted,
+        # and each batch is appended as soon as its embeddings arrive.
+        with self._lock:
+            if document_id in self._removed:
+                # Its rows are still in a mapped segment; just unmask them
+                self._removed.discard(document_id)
+                return 0
+            if document_id in self._doc_codes or document_id in self._persisted:
+                return 0
+            code = len(self._doc_ids)
+            self._doc_ids.append(document_id)
+            self._doc_codes[document_id] = code
+            self._ingesting.add(document_id)
+        added = 0
+        pending = None
+        try:
+            with ThreadPoolExecutor(max_workers=1) as embedding:
+                for batch in iter_batches(chunks, self.batch_size):
+                    future = embedding.submit(self.embedder, batch)
+                    if pending is not None:
+                        added += self._store_batch(document_id, code, added, *pending)
+                    pending = (batch, future)
+                if pending is not None:
+                    added += self._store_batch(document_id, code, added, *pending)
+        except Exception:
+            with self._lock:
+                self._ingesting.discard(document_id)
+                self._drop_memory_document(document_id)
+            raise
+        with self._lock:
+            self._ingesting.discard(document_id)
+            if not added:
+                self._doc_codes.pop(document_id, None)
+            elif document_id in self._persisted and self._doc_codes.get(document_id) == code:
+                # Another process persisted the same document meanwhile; its mapped rows serve it
+                self._drop_memory_document(document_id)
+        return added
+
+    def _store_batch(self, document_id: str, code: int, first_chunk: int, batch: List[str], future) -> int:
+        vectors = np.asarray(future.result(), dtype=np.float32)
+        with self._lock:
+            if self._doc_codes.get(document_id) != code:
+                # Removed while it was being ingested
+                return 0
+            self._append_rows(code, first_chunk, batch, vectors)
+        return len(batch)
+
+    def _drop_memory_document(self, document_id: str) -> None:
+        code = self._doc_codes.pop(document_id, None)
+        if code is None or self.index is None:
+            return
+        rows = np.flatnonzero(self.doc_codes != code)
+        self.index.keep_rows(rows)
+        self.texts = [self.texts[row] for row in rows]
+        self.chunk_indices = [self.chunk_indices[row] for row in rows]
+        self.doc_codes = self.doc_codes[rows]
+        self._memory_bm25.keep_rows(rows)
+        if self._memory_ivf is not None:
+            # Rows were renumbered; reassign them to the existing centroids
+            self._memory_ivf.reset()
+            self._update_memory_ann(0)
+
+    def _update_memory_ann(self, first_row: int) -> None:
+        size = self.index.size
+        if self.ann is None or size < ANN_MIN_ROWS:
+            self._memory_ivf = None
+            return
+        ivf = self._memory_ivf
+        if ivf is None or size > ivf.trained_rows * ANN_RETRAIN_GROWTH:
+            ivf = IVFIndex(nprobe=self.nprobe)
+            ivf.train(self.index.matrix[ivf.training_rows(size)], size)
+            first_row = 0
+            self._memory_ivf = ivf
+        ivf.add(self.index.matrix[first_row:size], first_row)
+
+    def remove_document(self, document_id: str) -> None:
+        with self._lock:
+            self._drop_memory_document(document_id)
+            if document_id in self._persisted:
+                # Segments are read-only; the rows are masked until persist() records the removal
+                self._removed.add(document_id)
+
+    def _searchable_segments(self, keywords: bool, vectors: bool) -> List[Segment]:
+        # Call with _lock released, then check the segments are still current under it: structures
+        # are built outside _lock, so ingestion and other searches are not held up
+        self._refresh()
+        segments = self.segments
+        self._keywords_used = self._keywords_used or keywords
+        self._vectors_used = self._vectors_used or vectors
+        for segment in segments:
+            segment.build(keywords, vectors, self.ann, self.nprobe)
+        return segments
+
+    def _memory_codes(self, document_ids: Optional[List[str]]) -> Optional[np.ndarray]:
+        if document_ids is None:
+            return None
+        return np.array([self._doc_codes[d] for d in document_ids if d in self._doc_codes], dtype=np.int32)
+
+    def _segment_codes(self, segment: Segment, document_ids: Optional[List[str]]) -> Optional[np.ndarray]:
+        masked = segment.removed | (self._removed & segment.codes.keys())
+        if document_ids is None and not masked:
+            return None
+        wanted = segment.codes.keys() if document_ids is None else document_ids
+        return np.array([segment.codes[d] for d in wanted if d in segment.codes and d not in masked], dtype=np.int32)
+
+    @staticmethod
+    def _segment_rows(segment: Segment, allowed: np.ndarray) -> np.ndarray:
+        rows = [segment.doc_rows[code] for code in allowed.tolist() if code in segment.doc_rows]
+        return np.sort(np.concatenate(rows)) if rows else np.empty(0, dtype=np.int64)
+
+    def _memory_result(self, row: int, score: float) -> SearchResult:
+        return SearchResult(self._doc_ids[self.doc_codes[row]], self.chunk_indices[row], self.texts[row], score)
+
+    @staticmethod
+    def _segment_result(segment: Segment, row: int, score: float) -> SearchResult:
+        index = segment.index
+        return SearchResult(index.document_ids[index.doc_codes[row]], int(index.chunk_indices[row]),
+                            index.text(row), score)
+
+    @staticmethod
+    def _top_rows(rows: Optional[np.ndarray], scores: np.ndarray, codes: np.ndarray,
+                  allowed: Optional[np.ndarray], top_k: int) -> List[Tuple[int, float]]:
+        if allowed is not None:
+            scores = np.where(np.isin(codes, allowed), scores, -np.inf)
+        picked = top_k_indices(scores, top_k)
+        if rows is not None:
+            return [(int(rows[i]), float(scores[i])) for i in picked if np.isfinite(scores[i])]
+        return [(int(i), float(scores[i])) for i in picked if np.isfinite(scores[i])]
+
+    def _rank_vectors(self, query_vector: np.ndarray, top_k: int, document_ids: Optional[List[str]],
+                      exact: bool) -> List[SearchResult]:
+        # The document filter is applied before the ANN step: a session's few documents are scored
+        # exactly, and only large filtered sets go through IVF, probing until enough of their rows turn up
+        results = []
+        if self.index is not None and self.index.size:
+            allowed = self._memory_codes(document_ids)
+            rows = None if allowed is None else np.flatnonzero(np.isin(self.doc_codes, allowed))
+            ivf = None if exact else self._memory_ivf
+            if rows is not None and len(rows) <= FILTER_EXACT_ROWS:
+                ranked = _best_rows(rows, self.index.matrix[rows] @ query_vector, top_k)
+            elif ivf is None:
+                ranked = self._top_rows(None, self.index.scores(query_vector), self.doc_codes, allowed, top_k)
+            else:
+                rows = _probe(ivf, query_vector, self.doc_codes, allowed, 0 if rows is None else len(rows), top_k)
+                ranked = _best_rows(rows, self.index.matrix[rows] @ query_vector, top_k)
+            results.extend(self._memory_result(row, score) for row, score in ranked)
+        for segment in self.segments:
+            index = segment.index
+            if not index.rows:
+                continue
+            allowed = self._segment_codes(segment, document_ids)
+            rows = None if allowed is None else self._segment_rows(segment, allowed)
+            ivf = None if exact else segment.ivf
+            if rows is not None and len(rows) <= FILTER_EXACT_ROWS:
+                ranked = _best_rows(rows, index.score_rows(query_vector, rows), top_k)
+            elif ivf is None:
+                ranked = index.search(query_vector, top_k, allowed)
+            else:
+                rows = _probe(ivf, query_vector, index.doc_codes, allowed, 0 if rows is None else len(rows), top_k)
+                ranked = _best_rows(rows, index.score_rows(query_vector, rows), top_k)
+            results.extend(self._segment_result(segment, row, score) for row, score in ranked)
+        results.sort(key=lambda result: result.score, reverse=True)
+        return results[:top_k]
+
+    def _rank_keywords(self, terms: List[str], top_k: int, document_ids: Optional[List[str]]) -> List[SearchResult]:
+        segments = []
+        if self._memory_bm25.size:
+            segments.append((self._memory_bm25, self.doc_codes, self._memory_codes(document_ids), self._memory_result))
+        for segment in self.segments:
+            if segment.index.rows:
+                segments.append((segment.bm25, segment.index.doc_codes, self._segment_codes(segment, document_ids),
+                                 partial(self._segment_result, segment)))
+        if not segments or not terms:
+            return []
+        # Corpus statistics span every segment so their scores are comparable
+        terms = list(dict.fromkeys(terms))
+        document_count = sum(bm25.size for bm25, _, _, _ in segments)
+        avgdl = sum(bm25.total_length for bm25, _, _, _ in segments) / max(document_count, 1)
+        frequencies = [bm25.document_frequencies(terms) for bm25, _, _, _ in segments]
+        idf = {term: bm25_idf(document_count, sum(f[term] for f in frequencies)) for term in terms}
+        results = []
+        for bm25, codes, allowed, make_result in segments:
+            rows, scores = bm25.score(idf, avgdl)
+            results.extend(make_result(row, score) for row, score in
+                           self._top_rows(rows, scores, codes[rows], allowed, top_k))
+        results.sort(key=lambda result: result.score, reverse=True)
+        return results[:top_k]
+
+    def search(self, query: str, top_k: int = 3, document_ids: Optional[Iterable[str]] = None,
+               exact: bool = False, mode: Optional[str] = None) -> List[SearchResult]:
+        mode = mode or self.mode
+        if document_ids is not None:
+            document_ids = list(document_ids)
+        depth = top_k * HYBRID_DEPTH if mode == "hybrid" else top_k
+        # The query embedding (usually a network call) runs while the keyword side is ranked
+        embedding = self._query_pool.submit(self.embedder, [query]) if mode != "bm25" else None
+        keyword_results: List[SearchResult] = []
+        if mode != "vector":
+            terms = tokenize(query)
+            while True:
+                segments = self._searchable_segments(keywords=True, vectors=False)
+                with self._lock:
+                    if self.segments is segments:
+                        keyword_results = self._rank_keywords(terms, depth, document_ids)
+                        break
+        vector_results: List[SearchResult] = []
+        if embedding is not None:
+            query_vector = normalize_rows(embedding.result())[0]
+            while True:
+                segments = self._searchable_segments(keywords=False, vectors=True)
+                with self._lock:
+                    if self.segments is segments:
+                        vector_results = self._rank_vectors(query_vector, depth, document_ids, exact)
+                        break
+        if mode != "hybrid":
+            return (vector_results or keyword_results)[:top_k]
+        # Reciprocal-rank fusion; the returned score is the fused RRF score
+        by_key = {(r.document_id, r.chunk_index): r for r in keyword_results + vector_results}
+        fused = reciprocal_rank_fusion([
+            [(r.document_id, r.chunk_index) for r in vector_results],
+            [(r.document_id, r.chunk_index) for r in keyword_results],
+        ])
+        return [by_key[key]._replace(score=score) for key, score in fused[:top_k]]
+
+    def measure_recall(self, queries: List[str], top_k: int = 10,
+                       document_ids: Optional[Iterable[str]] = None) -> float:
+        # recall@k of the configured (possibly approximate) vector search against exact search
+        if document_ids is not None:
+            document_ids = list(document_ids)
+        exact, approximate = [], []
+        for query in queries:
+            exact.append([(r.document_id, r.chunk_index)
+                          for r in self.search(query, top_k, document_ids, exact=True, mode="vector")])
+            approximate.append([(r.document_id, r.chunk_index)
+                                for r in self.search(query, top_k, document_ids, mode="vector")])
+        return recall_at_k(exact, approximate)
+
+    def persist(self) -> None:
+        # Appends the documents added since the last save as a new segment and records removals. The
+        # manifest is re-read under the index's file lock, so documents other workers saved meanwhile
+        # are kept, and the existing segments are neither rewritten nor re-indexed.
+        if not self.index_path:
+            return
+        with self._persist_lock:
+            with self._lock:
+                documents = {document_id: code for document_id, code in self._doc_codes.items()
+                             if document_id not in self._ingesting}
+                removed = set(self._removed)
+                rows = np.flatnonzero(np.isin(self.doc_codes, list(documents.values())))
+                memory = None
+                if len(rows):
+                    memory = (self.index.matrix[rows], [self.texts[row] for row in rows], self.doc_codes[rows],
+                              np.asarray(self.chunk_indices, dtype=np.int32)[rows])
+                dim = self.index.dim if self.index is not None else 0
+            with index_lock(self.index_path):
+                manifest = read_manifest(self.index_path)
+                if manifest is None or not manifest["segments"]:
+                    manifest = {"dim": dim, "segments": []}
+                # Another worker may have saved some of the same documents meanwhile
+                live = live_documents(manifest)
+                new_documents = [document_id for document_id in documents if document_id not in live]
+                changed = False
+                for entry in manifest["segments"]:
+                    gone = removed.intersection(entry["document_ids"]).difference(entry["removed"])
+                    if gone:
+                        entry["removed"] = entry["removed"] + sorted(gone)
+                        changed = True
+                if new_documents and memory is not None:
+                    if manifest["dim"] != dim:
+                        raise ValueError(f"{self.index_path} holds {manifest['dim']}-dimensional vectors, not {dim}")
+                    remap = np.full(len(self._doc_ids), -1, dtype=np.int32)
+                    for position, document_id in enumerate(new_documents):
+                        remap[documents[document_id]] = position
+                    vectors, texts, doc_codes, chunk_indices = memory
+                    codes = remap[doc_codes]
+                    keep = np.flatnonzero(codes >= 0)
+                    block = (vectors[keep], [texts[row] for row in keep], codes[keep], chunk_indices[keep])
+                    manifest["segments"].append(write_segment(self.index_path, [block], new_documents, dim,
+                                                              self.quantization))
+                    changed = True
+                if changed and needs_compaction(manifest):
+                    manifest["segments"] = compact_segments(self.index_path, manifest, self.quantization)
+                if changed:
+                    write_manifest(self.index_path, manifest)
+            with self._lock:
+                self._removed -= removed
+                for document_id in new_documents:
+                    if self._doc_codes.get(document_id) != documents[document_id]:
+                        # Removed while it was being saved
+                        self._removed.add(document_id)
+            self._refresh(wait=True)
@@ -0,0 +1,211 @@
+import asyncio
+import queue
+import threading
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from answer_cache import normalize_question
+from metrics import Counter, metrics
+
+FlightKey = Tuple[str, str]
+
+_DONE = object()
+
+flights_started = Counter("rag_single_flight_runs_total", "Runs started for questions with no identical run in flight.")
+runs_saved = Counter("rag_single_flight_saved_total",
+                     "Questions answered by joining an identical run already in flight instead of starting one.")
+metrics.register(flights_started)
+metrics.register(runs_saved)
+
+
+class FlightAbandoned(Exception):
+    pass
+
+
+class Flight:
+    # One run's answer, fanned out to every caller that asked the same question while it was in flight.
+    # Subscribers are push callables; late joiners first get the deltas they missed.
+    def __init__(self, key: FlightKey):
+        self.key = key
+        self.deltas: List[str] = []
+        self.error: Optional[BaseException] = None
+        self.finished = False
+        # Set when the run is driven on an event loop; cancelled once nobody is listening
+        self.task: Optional[asyncio.Task] = None
+        self._subscribers: List[Callable[[object], None]] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, push: Callable[[object], None]) -> None:
+        with self._lock:
+            for delta in self.deltas:
+                push(delta)
+            if self.finished:
+                push(_DONE)
+            else:
+                self._subscribers.append(push)
+
+    def unsubscribe(self, push: Callable[[object], None]) -> int:
+        with self._lock:
+            if push in self._subscribers:
+                self._subscribers.remove(push)
+            return len(self._subscribers)
+
+    def publish(self, text: str) -> None:
+        with self._lock:
+            self.deltas.append(text)
+            for push in self._subscribers:
+                push(text)
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self.error = error
+            self.finished = True
+            for push in self._subscribers:
+                push(_DONE)
+            self._subscribers.clear()
+
+
+class SingleFlight:
+    # Process-wide: identical questions on the same vector store that arrive while a run is answering
+    # one of them share that run. Nothing is kept once it finishes; repeats after that are the answer
+    # cache's business.
+    def __init__(self):
+        self._flights: Dict[FlightKey, Flight] = {}
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "saved": 0}
+
+    def _join(self, vector_store_id: str, question: str) -> Tuple[Flight, bool]:
+        key = (vector_store_id, normalize_question(question))
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and not flight.finished:
+                self._stats["saved"] += 1
+                runs_saved.inc()
+                return flight, False
+            flight = self._flights[key] = Flight(key)
+            self._stats["runs"] += 1
+        flights_started.inc()
+        return flight, True
+
+    def _land(self, flight: Flight) -> None:
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def forget(self, vector_store_id: str) -> None:
+        # The store's documents changed: runs already in flight finish for whoever is waiting on them,
+        # but later questions start fresh ones
+        with self._lock:
+            for key in [key for key in self._flights if key[0] == vector_store_id]:
+                del self._flights[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._flights))
+
+    # --- blocking callers ---
+
+    def stream(self, vector_store_id: str, question: str, run: Callable[[], Iterator[str]]) -> Iterator[str]:
+        # Yields the answer of run(), or of the identical run already in flight
+        while True:
+            flight, leader = self._join(vector_store_id, question)
+            if leader:
+                yield from self._lead(flight, run)
+                return
+            yielded = False
+            try:
+                for delta in self._follow(flight):
+                    yielded = True
+                    yield delta
+                return
+            except FlightAbandoned:
+                # The caller running it went away; ask again unless part of its answer was already shown
+                if yielded:
+                    raise
+
+    def _lead(self, flight: Flight, run: Callable[[], Iterator[str]]) -> Iterator[str]:
+        # The run streams on the caller's thread, so it stops if the caller does
+        try:
+            for delta in run():
+                flight.publish(delta)
+                yield delta
+        except GeneratorExit:
+            flight.finish(FlightAbandoned("The run answering this question was abandoned."))
+            raise
+        except BaseException as e:
+            flight.finish(e)
+            raise
+        else:
+            flight.finish()
+        finally:
+            self._land(flight)
+
+    def _follow(self, flight: Flight) -> Iterator[str]:
+        deltas: "queue.Queue" = queue.Queue()
+        push = deltas.put
+        flight.subscribe(push)
+        try:
+            while True:
+                item = deltas.get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            flight.unsubscribe(push)
+        if flight.error is not None:
+            raise flight.error
+
+    # --- event loop callers ---
+
+    async def astream(self, vector_store_id: str, question: str,
+                      run: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        while True:
+            flight, leader = self._join(vector_store_id, question)
+            if leader:
+                # Driven as its own task, so it outlives a cancelled first asker while others still wait
+                flight.task = asyncio.ensure_future(self._drive(flight, run))
+            yielded = False
+            try:
+                async for delta in self._afollow(flight):
+                    yielded = True
+                    yield delta
+                return
+            except FlightAbandoned:
+                if yielded:
+                    raise
+
+    async def _drive(self, flight: Flight, run: Callable[[], AsyncIterator[str]]) -> None:
+        try:
+            async for delta in run():
+                flight.publish(delta)
+        except asyncio.CancelledError:
+            flight.finish(FlightAbandoned("The run answering this question was abandoned."))
+            raise
+        except BaseException as e:
+            # Delivered to every subscriber; not re-raised, so the task never logs it as unretrieved
+            flight.finish(e)
+        else:
+            flight.finish()
+        finally:
+            self._land(flight)
+
+    async def _afollow(self, flight: Flight) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        deltas: "asyncio.Queue" = asyncio.Queue()
+
+        def push(item: object) -> None:
+            # Blocking leaders publish from their own threads
+            loop.call_soon_threadsafe(deltas.put_nowait, item)
+
+        flight.subscribe(push)
+        try:
+            while True:
+                item = await deltas.get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            # The last subscriber to leave stops the run, and with it the assistant run server-side
+            if flight.unsubscribe(push) == 0 and flight.task is not None and not flight.finished:
+                flight.task.cancel()
+        if flight.error is not None:
+            raise flight.error
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Dict, Optional
+
+# Shared by every session and process on the host, like the document registry
+DEFAULT_SPEECH_CACHE_PATH = os.environ.get(
+    "RAG_SPEECH_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".openai_rag", "speech")
+)
+DEFAULT_SPEECH_CACHE_BYTES = int(float(os.environ.get("RAG_SPEECH_CACHE_MB", "256")) * 1024 * 1024)
+
+
+def speech_key(text: str, voice: str, response_format: str, model: str = "tts-1") -> str:
+    payload = "\0".join((model, voice, response_format, text)).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class SpeechCache:
+    # Content-addressed audio files; file mtimes record last use and the oldest go first when over budget
+    def __init__(self, path: str = DEFAULT_SPEECH_CACHE_PATH, max_bytes: int = DEFAULT_SPEECH_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._sizes: Optional[Dict[str, int]] = None
+        self._total = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _file(self, key: str, response_format: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.{response_format}")
+
+    def _scan(self) -> Dict[str, int]:
+        # Sizes are read from disk once, lazily, then tracked in memory
+        if self._sizes is None:
+            sizes = {}
+            if os.path.isdir(self.path):
+                for directory, _, names in os.walk(self.path):
+                    for name in names:
+                        if name.startswith("."):
+                            continue
+                        file_path = os.path.join(directory, name)
+                        try:
+                            sizes[file_path] = os.path.getsize(file_path)
+                        except OSError:
+                            pass
+            self._sizes = sizes
+            self._total = sum(sizes.values())
+        return self._sizes
+
+    def get(self, key: str, response_format: str) -> Optional[bytes]:
+        file_path = self._file(key, response_format)
+        try:
+            with open(file_path, "rb") as f:
+                data = f.read()
+            os.utime(file_path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, response_format: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        file_path = self._file(key, response_format)
+        directory = os.path.dirname(file_path)
+        os.makedirs(directory, exist_ok=True)
+        # Written under a temporary name and renamed, so readers never see a partial clip
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".speech-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(data)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            sizes = self._scan()
+            self._total += len(data) - sizes.get(file_path, 0)
+            sizes[file_path] = len(data)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Least recently used first, down to 90% of the budget so eviction is not run on every put
+        target = int(self.max_bytes * 0.9)
+        by_age = []
+        for file_path in self._sizes:
+            try:
+                by_age.append((os.path.getmtime(file_path), file_path))
+            except OSError:
+                by_age.append((0.0, file_path))
+        for _, file_path in sorted(by_age):
+            if self._total <= target:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+            self._total -= self._sizes.pop(file_path)
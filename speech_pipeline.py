@@ -0,0 +1,79 @@
+import re
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Iterator, List, Optional, Tuple
+
+# Sentences shorter than this are merged with the next one; very short clips sound choppy
+MIN_SENTENCE_CHARS = 24
+# The speech endpoint accepts at most 4096 characters per request
+MAX_SPEECH_CHARS = 4096
+MAX_TTS_WORKERS = 4
+
+_SENTENCE_END_RE = re.compile(r"[.!?…]+[\"')\]]*\s+|\n\s*\n")
+
+
+def split_sentences(text: str, min_chars: int = MIN_SENTENCE_CHARS) -> Tuple[List[str], str]:
+    # Complete sentences found in text, and the unfinished remainder to carry over
+    sentences, start, pending = [], 0, ""
+    for match in _SENTENCE_END_RE.finditer(text):
+        pending += text[start:match.end()]
+        start = match.end()
+        if len(pending.strip()) >= min_chars:
+            sentences.append(pending.strip())
+            pending = ""
+    return sentences, pending + text[start:]
+
+
+def _limit(sentence: str, max_chars: int = MAX_SPEECH_CHARS) -> List[str]:
+    parts = []
+    while len(sentence) > max_chars:
+        cut = sentence.rfind(" ", 0, max_chars)
+        cut = cut if cut > 0 else max_chars
+        parts.append(sentence[:cut])
+        sentence = sentence[cut:].lstrip()
+    return parts + [sentence] if sentence else parts
+
+
+class SpeechPipeline:
+    # Text goes in as it streams; sentences are synthesized concurrently and come out in order
+    def __init__(self, synthesize: Callable[[str], Optional[bytes]], max_workers: int = MAX_TTS_WORKERS,
+                 min_chars: int = MIN_SENTENCE_CHARS):
+        self._synthesize = synthesize
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts")
+        self._min_chars = min_chars
+        self._buffer = ""
+        self._pending: Deque[Tuple[str, "Future[Optional[bytes]]"]] = deque()
+        self._closed = False
+
+    def _submit(self, sentence: str) -> None:
+        for part in _limit(sentence):
+            self._pending.append((part, self._pool.submit(self._synthesize, part)))
+
+    def feed(self, delta: str) -> None:
+        sentences, self._buffer = split_sentences(self._buffer + delta, self._min_chars)
+        for sentence in sentences:
+            self._submit(sentence)
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            if self._buffer.strip():
+                self._submit(self._buffer.strip())
+            self._buffer = ""
+            self._pool.shutdown(wait=False)
+
+    def ready(self) -> Iterator[Tuple[str, Optional[bytes]]]:
+        # Clips that are already synthesized, stopping at the first one still in flight
+        while self._pending and self._pending[0][1].done():
+            sentence, future = self._pending.popleft()
+            yield sentence, future.result()
+
+    def drain(self) -> Iterator[Tuple[str, Optional[bytes]]]:
+        self.close()
+        while self._pending:
+            sentence, future = self._pending.popleft()
+            yield sentence, future.result()
+
+    def __iter__(self) -> Iterator[Tuple[str, Optional[bytes]]]:
+        return self.drain()
+
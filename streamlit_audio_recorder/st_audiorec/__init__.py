@@ -1,34 +1,55 @@
 import os
+import base64
+import functools
 import numpy as np
 import streamlit as st
-from io import BytesIO
 import streamlit.components.v1 as components
 
 
-def st_audiorec():
-
+@functools.lru_cache(maxsize=None)
+def _component():
+    # declared once per process instead of on every rerun
     # get parent directory relative to current directory
     parent_dir = os.path.dirname(os.path.abspath(__file__))
     # Custom REACT-based component for recording client audio in browser
     build_dir = os.path.join(parent_dir, "frontend/build")
-    # specify directory and initialize st_audiorec object functionality
-    st_audiorec = components.declare_component("st_audiorec", path=build_dir)
+    return components.declare_component("st_audiorec", path=build_dir)
 
-    # Create an instance of the component: STREAMLIT AUDIO RECORDER
-    raw_audio_data = st_audiorec()  # raw_audio_data: stores all the data returned from the streamlit frontend
-    wav_bytes = None                # wav_bytes: contains the recorded audio in .WAV format after conversion
 
-    # the frontend returns raw audio data in the form of arraybuffer
-    # (this arraybuffer is derived from web-media API WAV-blob data)
+def decode_audio(raw_audio_data):
+    # the frontend sends the WAV arraybuffer as a typed array, which Streamlit delivers as bytes;
+    # base64 strings (optionally as a data URL) and the older {"arr": {"0": byte, ...}} object also work
+    if raw_audio_data is None or raw_audio_data == "":
+        return None
+    if isinstance(raw_audio_data, (bytes, bytearray, memoryview)):
+        return bytes(raw_audio_data)
+    if isinstance(raw_audio_data, str):
+        return base64.b64decode(raw_audio_data.split(",", 1)[-1])
+    if isinstance(raw_audio_data, dict):
+        arr = raw_audio_data["arr"]
+        if isinstance(arr, list):
+            return np.asarray(arr, dtype=np.uint8).tobytes()
+        count = len(arr)
+        values = np.fromiter(arr.values(), dtype=np.uint8, count=count)
+        # JSON keeps the typed array's keys "0".."n-1" in order; only scatter when they are not
+        if count and (next(iter(arr)) != "0" or next(reversed(arr)) != str(count - 1)):
+            positions = np.fromiter(arr.keys(), dtype=np.int64, count=count)
+            ordered = np.empty(count, dtype=np.uint8)
+            ordered[positions] = values
+            values = ordered
+        return values.tobytes()
+    raise TypeError(f"Unsupported audio payload: {type(raw_audio_data).__name__}")
+
+
+def st_audiorec():
+
+    # Create an instance of the component: STREAMLIT AUDIO RECORDER
+    raw_audio_data = _component()()  # raw_audio_data: stores all the data returned from the streamlit frontend
+    wav_bytes = None                 # wav_bytes: contains the recorded audio in .WAV format after conversion
 
-    if isinstance(raw_audio_data, dict):  # retrieve audio data
+    if raw_audio_data:  # retrieve audio data
         with st.spinner('retrieving audio-recording...'):
-            ind, raw_audio_data = zip(*raw_audio_data['arr'].items())
-            ind = np.array(ind, dtype=int)  # convert to np array
-            raw_audio_data = np.array(raw_audio_data)  # convert to np array
-            sorted_ints = raw_audio_data[ind]
-            stream = BytesIO(b"".join([int(v).to_bytes(1, "big") for v in sorted_ints]))
             # wav_bytes contains audio data in byte format, ready to be processed further
-            wav_bytes = stream.read()
+            wav_bytes = decode_audio(raw_audio_data)
 
-    return wav_bytes
\ No newline at end of file
+    return wav_bytes
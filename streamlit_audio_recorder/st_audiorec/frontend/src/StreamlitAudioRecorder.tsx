@@ -138,13 +138,11 @@ class StAudioRec extends StreamlitComponentBase<State> {
       fetch(data.url).then(function(ctx){
         return ctx.blob()
       }).then(function(blob){
-        // converting blob to arrayBuffer, this process step needs to be be improved
-        // this operation's time complexity scales exponentially with audio length
         return (new Response(blob)).arrayBuffer()
       }).then(function(buffer){
-        Streamlit.setComponentValue({
-          "arr": new Uint8Array(buffer)
-        })
+        // a typed array is sent as binary and arrives in Python as bytes,
+        // instead of a JSON object with one key per byte
+        Streamlit.setComponentValue(new Uint8Array(buffer))
       })
 
     }
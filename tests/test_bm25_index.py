@@ -0,0 +1,60 @@
+import math
+
+import numpy as np
+import pytest
+
+from bm25_index import BM25Index, bm25_idf, reciprocal_rank_fusion, tokenize
+
+
+def test_identifiers_are_kept_whole_and_split_into_parts():
+    assert tokenize("Error FX-9921 in v1.2!") == ["error", "fx-9921", "fx", "9921", "in", "v1.2", "v1", "2"]
+
+
+def reference_score(texts, query_terms, k1=1.2, b=0.75):
+    documents = [tokenize(text) for text in texts]
+    avgdl = sum(map(len, documents)) / len(documents)
+    scores = []
+    for tokens in documents:
+        score = 0.0
+        for term in query_terms:
+            tf = tokens.count(term)
+            if tf:
+                df = sum(term in other for other in documents)
+                idf = math.log(1.0 + (len(documents) - df + 0.5) / (df + 0.5))
+                score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(tokens) / avgdl))
+        scores.append(score)
+    return scores
+
+
+def test_scores_match_the_bm25_formula():
+    texts = ["the pump valve", "valve valve seal", "pump motor wiring diagram", "nothing relevant here at all"]
+    index = BM25Index()
+    index.add(texts[:2])
+    # Appends after postings were read must keep them sorted and complete
+    index.document_frequencies(["valve"])
+    index.add(texts[2:])
+    terms = ["valve", "pump"]
+    idf = {term: bm25_idf(index.size, frequency) for term, frequency in index.document_frequencies(terms).items()}
+    rows, scores = index.score(idf, index.total_length / index.size)
+    expected = reference_score(texts, terms)
+    np.testing.assert_array_equal(rows, [0, 1, 2])
+    np.testing.assert_allclose(scores, expected[:3])
+
+
+def test_keep_rows_renumbers_postings():
+    index = BM25Index()
+    index.add(["alpha beta", "beta", "gamma beta", "alpha"])
+    index.keep_rows(np.array([1, 3]))
+    assert index.size == 2
+    assert index.document_frequencies(["alpha", "beta", "gamma"]) == {"alpha": 1, "beta": 1, "gamma": 0}
+    rows, _ = index.score({"alpha": 1.0}, 1.0)
+    np.testing.assert_array_equal(rows, [1])
+
+
+def test_reciprocal_rank_fusion():
+    fused = dict(reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], k=60))
+    assert fused["a"] == pytest.approx(1 / 61 + 1 / 62)
+    assert fused["c"] == pytest.approx(1 / 63 + 1 / 61)
+    assert fused["b"] == pytest.approx(1 / 62)
+    # Agreement between the rankings beats a single first place
+    assert [key for key, _ in reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]])] == ["a", "c", "b"]
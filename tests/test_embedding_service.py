@@ -0,0 +1,93 @@
+import threading
+
+import numpy as np
+import openai
+import pytest
+
+import embedding_service
+from document_pipeline import count_tokens, truncate_tokens
+from embedding_service import EmbeddingService
+from mock_openai import EMBEDDING_DIM, Fault, _embedding, start_mock_server
+
+
+@pytest.fixture
+def server():
+    server = start_mock_server(latency_scale=0.0)
+    yield server
+    server.shutdown()
+
+
+def make_service(server, **options) -> EmbeddingService:
+    return EmbeddingService(lambda: openai.OpenAI(api_key="sk-test", base_url=server.base_url), **options)
+
+
+def expected(texts):
+    return np.stack([_embedding(text, EMBEDDING_DIM) for text in texts])
+
+
+def test_batches_respect_the_item_limit_and_keep_input_order(server):
+    service = make_service(server, max_batch_items=10)
+    texts = [f"chunk number {i}" for i in range(35)]
+    np.testing.assert_allclose(service(texts), expected(texts), atol=1e-6)
+    assert service.stats()["requests"] == 4
+    assert server.state.requests["embeddings"] == 4
+
+
+def test_batches_respect_the_token_budget(server):
+    texts = [" ".join(["word"] * size) for size in (5, 9, 3, 7, 2, 8)]
+    budget = 12
+    service = make_service(server, max_batch_tokens=budget)
+    batches = service._pack(texts)
+    assert [text for batch in batches for text in batch] == texts
+    assert all(sum(count_tokens(text) for text in batch) <= budget for batch in batches)
+    np.testing.assert_allclose(service(texts), expected(texts), atol=1e-6)
+    assert service.stats()["requests"] == len(batches)
+
+
+def test_identical_inputs_are_embedded_once_and_cached(server):
+    service = make_service(server)
+    first = service(["alpha", "beta", "alpha"])
+    np.testing.assert_array_equal(first[0], first[2])
+    second = service(["alpha", "gamma"])
+    np.testing.assert_array_equal(second[0], first[0])
+    stats = service.stats()
+    assert (stats["texts"], stats["embedded"], stats["cache_hits"], stats["requests"]) == (5, 3, 2, 2)
+    assert stats["texts_per_second"] > 0
+
+
+def test_cache_evicts_the_least_recently_used(server):
+    service = make_service(server, cache_size=2)
+    service(["a", "b"])
+    service(["a", "c"])
+    service(["a", "b"])
+    assert service.stats()["embedded"] == 4
+
+
+def test_over_long_inputs_are_truncated(server, monkeypatch):
+    monkeypatch.setattr(embedding_service, "MAX_INPUT_TOKENS", 5)
+    service = make_service(server)
+    text = "one two three four five six seven eight"
+    np.testing.assert_allclose(service([text]), expected([truncate_tokens(text, 5)]), atol=1e-6)
+    assert service.stats()["truncated"] == 1
+
+
+def test_rate_limits_are_retried_after_the_servers_delay(server):
+    service = make_service(server)
+    server.state.faults["embeddings"] = Fault("1.0:429")
+    lifted = threading.Timer(0.3, server.state.faults.pop, ("embeddings",))
+    lifted.start()
+    try:
+        np.testing.assert_allclose(service(["after the limit"]), expected(["after the limit"]), atol=1e-6)
+    finally:
+        lifted.cancel()
+    stats = service.stats()
+    assert stats["rate_limited"] >= 1 and stats["retries"] == stats["rate_limited"]
+    assert stats["requests"] == 1
+
+
+def test_gives_up_after_max_retries(server):
+    service = make_service(server, max_retries=1)
+    server.state.faults["embeddings"] = Fault("1.0:500")
+    with pytest.raises(openai.InternalServerError):
+        service(["never embedded"])
+    assert service.stats()["retries"] == 1
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from ingestion_jobs import IngestionJobs, current_job
+
+
+class Session:
+    pass
+
+
+def wait(jobs: IngestionJobs, job_ids, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while not all(jobs.get(job_id).done for job_id in job_ids):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return [jobs.get(job_id) for job_id in job_ids]
+
+
+def test_jobs_for_one_key_run_in_submission_order():
+    jobs = IngestionJobs(max_workers=4)
+    order = []
+
+    def work(index, progress):
+        time.sleep(0.002)
+        order.append(index)
+
+    session = Session()
+    wait(jobs, [jobs.submit(str(index), work, index, key=session) for index in range(50)])
+    assert order == list(range(50))
+
+
+def test_queued_jobs_do_not_hold_workers():
+    jobs = IngestionJobs(max_workers=2)
+    release = threading.Event()
+    busy = Session()
+    blocked = [jobs.submit("blocked", lambda progress: release.wait(10), key=busy) for _ in range(5)]
+    (other,) = wait(jobs, [jobs.submit("other", lambda progress: "done", key=Session())])
+    assert other.result == "done"
+    release.set()
+    assert all(job.status == "completed" for job in wait(jobs, blocked))
+
+
+def test_a_failed_job_does_not_stop_its_queue():
+    jobs = IngestionJobs(max_workers=1)
+
+    def fail(progress):
+        raise ValueError("broken")
+
+    session = Session()
+    failed, completed = wait(jobs, [jobs.submit("fail", fail, key=session),
+                                    jobs.submit("ok", lambda progress: 1, key=session)])
+    assert (failed.status, failed.error) == ("failed", "broken")
+    assert (completed.status, completed.result) == ("completed", 1)
+
+
+def test_warnings_are_kept_on_the_running_job():
+    jobs = IngestionJobs(max_workers=1)
+
+    def work(progress):
+        current_job().warn("one file failed")
+        return "partial"
+
+    (job,) = wait(jobs, [jobs.submit("warn", work)])
+    assert (job.status, job.result, job.warnings) == ("completed", "partial", ["one file failed"])
+    assert current_job() is None
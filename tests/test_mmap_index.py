@@ -0,0 +1,149 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from mmap_index import (MappedIndex, compact_segments, data_path, index_lock, live_documents, needs_compaction,
+                        open_segments, quantize, read_manifest, sidecar_path, write_manifest, write_segment)
+
+DIM = 16
+
+
+def unit_rows(rows: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(rows, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def block(vectors: np.ndarray, codes, first: int = 0):
+    texts = [f"chunk {first + row}" for row in range(len(vectors))]
+    return vectors, texts, np.asarray(codes, dtype=np.int32), np.arange(first, first + len(vectors), dtype=np.int32)
+
+
+def test_int8_round_trip_is_within_half_a_step_per_row():
+    vectors = unit_rows(200)
+    quantized, scales = quantize(vectors, "int8")
+    assert quantized.dtype == np.int8 and scales.dtype == np.float32
+    assert np.abs(quantized).max() == 127
+    restored = quantized.astype(np.float32) * scales[:, None]
+    assert np.all(np.abs(restored - vectors) <= scales[:, None] / 2 + 1e-7)
+
+
+def test_int8_keeps_zero_rows():
+    quantized, scales = quantize(np.zeros((2, DIM), dtype=np.float32), "int8")
+    assert not quantized.any()
+    assert np.all(scales == 1.0)
+
+
+def test_float16_round_trip():
+    vectors = unit_rows(200)
+    quantized, scales = quantize(vectors, "float16")
+    assert quantized.dtype == np.float16
+    assert np.all(scales == 1.0)
+    np.testing.assert_allclose(quantized.astype(np.float32), vectors, atol=1e-3)
+
+
+def test_unknown_quantization_is_rejected():
+    with pytest.raises(ValueError):
+        quantize(unit_rows(1), "int4")
+
+
+@pytest.mark.parametrize("quantization", ["int8", "float16"])
+def test_segment_round_trip(tmp_path, quantization):
+    path = str(tmp_path / "chunks.idx")
+    vectors = unit_rows(300)
+    codes = np.repeat([0, 1, 2], 100)
+    with index_lock(path):
+        segment = write_segment(path, [block(vectors[:150], codes[:150]), block(vectors[150:], codes[150:], 150)],
+                                ["a", "b", "c"], DIM, quantization)
+        write_manifest(path, {"dim": DIM, "segments": [segment]})
+    assert segment["rows"] == 300 and segment["quantization"] == quantization and segment["removed"] == []
+    assert os.path.exists(data_path(path, segment["generation"]))
+
+    version, entries, indexes = open_segments(path, {})
+    assert version is not None
+    assert entries == [segment]
+    index = indexes[0]
+    assert (index.rows, index.dim, index.quantization, index.generation) == (300, DIM, quantization,
+                                                                               segment["generation"])
+    assert index.document_ids == ["a", "b", "c"]
+    np.testing.assert_array_equal(index.doc_codes, codes)
+    np.testing.assert_array_equal(index.chunk_indices, np.arange(300))
+    assert index.text(0) == "chunk 0" and index.text(299) == "chunk 299"
+    np.testing.assert_allclose(index.take(np.arange(300)), vectors, atol=1e-2)
+
+    query = vectors[42]
+    assert index.search(query, top_k=1)[0][0] == 42
+    assert [row for row, _ in index.search(query, top_k=5, allowed_codes=np.array([2]))] == \
+        sorted((row for row in range(200, 300)), key=lambda row: -float(vectors[row] @ query))[:5]
+
+
+def test_manifest_format(tmp_path):
+    path = str(tmp_path / "chunks.idx")
+    with index_lock(path):
+        first = write_segment(path, [block(unit_rows(4), [0, 0, 1, 1])], ["a", "b"], DIM)
+        second = write_segment(path, [block(unit_rows(2, seed=1), [0, 0])], ["c"], DIM)
+        second["removed"] = ["c"]
+        write_manifest(path, {"dim": DIM, "segments": [first, second]})
+    with open(sidecar_path(path), encoding="utf-8") as f:
+        manifest = json.load(f)
+    assert manifest["format_version"] == 2
+    assert manifest["dim"] == DIM
+    assert [segment["generation"] for segment in manifest["segments"]] == [first["generation"], second["generation"]]
+    assert live_documents(manifest) == {"a", "b"}
+
+
+def test_single_file_sidecars_are_read_as_one_segment(tmp_path):
+    path = str(tmp_path / "chunks.idx")
+    segment = write_segment(path, [block(unit_rows(3), [0, 1, 1])], ["a", "b"], DIM)
+    with open(sidecar_path(path), "w", encoding="utf-8") as f:
+        json.dump({"format_version": 1, "generation": segment["generation"], "quantization": "int8",
+                   "rows": 3, "dim": DIM, "document_ids": ["a", "b"]}, f)
+    assert read_manifest(path) == {"format_version": 2, "dim": DIM, "segments": [segment]}
+    _, _, indexes = open_segments(path, {})
+    assert indexes[0].rows == 3
+
+
+def test_unlisted_data_files_are_removed(tmp_path):
+    path = str(tmp_path / "chunks.idx")
+    with index_lock(path):
+        old = write_segment(path, [block(unit_rows(2), [0, 0])], ["a"], DIM)
+        write_manifest(path, {"dim": DIM, "segments": [old]})
+        new = write_segment(path, [block(unit_rows(2), [0, 0])], ["b"], DIM)
+        write_manifest(path, {"dim": DIM, "segments": [new]})
+    assert sorted(os.listdir(tmp_path)) == sorted(["chunks.idx.json", "chunks.idx.lock",
+                                                   os.path.basename(data_path(path, new["generation"]))])
+
+
+def test_open_segments_reuses_mapped_segments(tmp_path):
+    path = str(tmp_path / "chunks.idx")
+    with index_lock(path):
+        first = write_segment(path, [block(unit_rows(2), [0, 0])], ["a"], DIM)
+        write_manifest(path, {"dim": DIM, "segments": [first]})
+    _, _, (mapped,) = open_segments(path, {})
+    with index_lock(path):
+        second = write_segment(path, [block(unit_rows(2), [0, 0])], ["b"], DIM)
+        write_manifest(path, {"dim": DIM, "segments": [first, second]})
+    _, _, indexes = open_segments(path, {mapped.generation: mapped})
+    assert indexes[0] is mapped
+    assert isinstance(indexes[1], MappedIndex) and indexes[1].document_ids == ["b"]
+
+
+def test_compaction_drops_removed_documents(tmp_path):
+    path = str(tmp_path / "chunks.idx")
+    vectors = unit_rows(6)
+    with index_lock(path):
+        first = write_segment(path, [block(vectors[:4], [0, 0, 1, 1])], ["a", "b"], DIM)
+        second = write_segment(path, [block(vectors[4:], [0, 0], 4)], ["c"], DIM)
+        first["removed"] = ["a"]
+        manifest = {"dim": DIM, "segments": [first, second]}
+        assert needs_compaction(manifest)
+        manifest["segments"] = compact_segments(path, manifest)
+        write_manifest(path, manifest)
+    (segment,) = manifest["segments"]
+    assert segment["document_ids"] == ["b", "c"] and segment["rows"] == 4
+    _, _, (index,) = open_segments(path, {})
+    np.testing.assert_array_equal(index.doc_codes, [0, 0, 1, 1])
+    assert [index.text(row) for row in range(4)] == ["chunk 2", "chunk 3", "chunk 4", "chunk 5"]
+    np.testing.assert_allclose(index.take(np.arange(4)), vectors[2:], atol=1e-2)
+    assert len(os.listdir(tmp_path)) == 3
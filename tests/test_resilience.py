@@ -0,0 +1,147 @@
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+from mock_openai import Fault, start_mock_server
+from resilience import CircuitBreaker, CircuitOpenError, Resilience, ResilientTransport, circuit_open
+
+COOLDOWN = 0.2
+
+
+def fail(breaker: CircuitBreaker, times: int) -> None:
+    for _ in range(times):
+        breaker.allow()
+        breaker.record(False)
+
+
+def test_breaker_opens_once_enough_recent_calls_fail():
+    breaker = CircuitBreaker("threads", window=10, min_calls=4, failure_rate=0.5, cooldown=COOLDOWN)
+    # Too few calls to judge
+    fail(breaker, 3)
+    assert breaker.state == "closed"
+    breaker = CircuitBreaker("threads", window=10, min_calls=4, failure_rate=0.5, cooldown=COOLDOWN)
+    for _ in range(4):
+        breaker.record(True)
+    fail(breaker, 3)
+    assert breaker.state == "closed"
+    # 4 of the last 8 calls failed
+    fail(breaker, 1)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError) as raised:
+        breaker.allow()
+    assert raised.value.circuit == "threads" and 0 < raised.value.retry_in <= COOLDOWN
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success():
+    breaker = CircuitBreaker("threads", window=10, min_calls=4, cooldown=COOLDOWN)
+    fail(breaker, 4)
+    time.sleep(COOLDOWN)
+    breaker.allow()
+    assert breaker.state == "half_open"
+    # Everyone else waits for the probe's outcome
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+    # The failures that opened it are forgotten
+    fail(breaker, 3)
+    assert breaker.state == "closed"
+
+
+def test_failed_probe_opens_the_breaker_again():
+    breaker = CircuitBreaker("threads", window=10, min_calls=4, cooldown=COOLDOWN)
+    fail(breaker, 4)
+    time.sleep(COOLDOWN)
+    breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_a_probe_that_never_reports_back_is_replaced():
+    breaker = CircuitBreaker("threads", window=10, min_calls=4, cooldown=COOLDOWN)
+    fail(breaker, 4)
+    time.sleep(COOLDOWN)
+    breaker.allow()
+    time.sleep(COOLDOWN)
+    breaker.allow()
+    assert breaker.state == "half_open"
+
+
+@pytest.fixture
+def server():
+    server = start_mock_server(latency_scale=0.0)
+    yield server
+    server.shutdown()
+
+
+def make_client(server, resilience: Resilience) -> openai.OpenAI:
+    transport = ResilientTransport(httpx.HTTPTransport(), resilience)
+    return openai.OpenAI(api_key="sk-test", base_url=server.base_url, max_retries=0,
+                         http_client=httpx.Client(transport=transport))
+
+
+def test_reads_are_retried_and_creates_are_not(server):
+    resilience = Resilience(attempts=3)
+    client = make_client(server, resilience)
+    store = client.vector_stores.create(name="kb")
+    server.state.faults["vector_stores.retrieve"] = Fault("1.0:503")
+    server.state.faults["threads.create"] = Fault("1.0:500")
+    with pytest.raises(openai.InternalServerError):
+        client.vector_stores.retrieve(store.id)
+    with pytest.raises(openai.InternalServerError):
+        client.beta.threads.create()
+    assert server.state.requests["vector_stores.retrieve"] == 3
+    assert server.state.requests["threads.create"] == 1
+    assert resilience.stats()["retries"] == 2
+
+
+def test_rate_limited_creates_are_retried(server):
+    client = make_client(server, Resilience(attempts=5))
+    server.state.faults["threads.create"] = Fault("1.0:429")
+    lifted = threading.Timer(0.3, server.state.faults.pop, ("threads.create",))
+    lifted.start()
+    try:
+        assert client.beta.threads.create().id
+    finally:
+        lifted.cancel()
+    assert server.state.requests["threads.create"] >= 2
+
+
+def test_open_breaker_fails_fast_and_a_probe_closes_it(server):
+    resilience = Resilience(attempts=1)
+    breaker = resilience.breaker("threads")
+    breaker.cooldown = COOLDOWN
+    client = make_client(server, resilience)
+    server.state.faults["threads.create"] = Fault("1.0:500")
+    for _ in range(breaker.min_calls):
+        with pytest.raises(openai.InternalServerError):
+            client.beta.threads.create()
+    assert breaker.state == "open"
+    # Rejected before a request is sent
+    with pytest.raises(Exception) as raised:
+        client.beta.threads.create()
+    assert isinstance(circuit_open(raised.value), CircuitOpenError)
+    assert server.state.requests["threads.create"] == breaker.min_calls
+    # Other API families have breakers of their own
+    assert client.vector_stores.create(name="kb").id
+    del server.state.faults["threads.create"]
+    time.sleep(COOLDOWN)
+    assert client.beta.threads.create().id
+    assert breaker.state == "closed"
+    assert resilience.stats()["circuits"]["threads"] == "closed"
+
+
+def test_rate_limits_do_not_open_the_breaker(server):
+    resilience = Resilience(attempts=1)
+    breaker = resilience.breaker("threads")
+    client = make_client(server, resilience)
+    server.state.faults["threads.create"] = Fault("1.0:429")
+    for _ in range(breaker.min_calls + 2):
+        with pytest.raises(openai.RateLimitError):
+            client.beta.threads.create()
+    assert breaker.state == "closed"
@@ -0,0 +1,222 @@
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+import retrieval
+from bm25_index import reciprocal_rank_fusion
+from retrieval import HYBRID_DEPTH, HashingEmbedder, RetrievalEngine, normalize_rows
+
+DIM = 32
+DOCUMENTS = 12
+CHUNKS_PER_DOCUMENT = 500
+
+
+class ClusteredEmbedder:
+    # Every document's chunks sit around a centre of their own, like the chunks of one real document;
+    # queries land near random centres, mostly other documents'
+    def __init__(self, clusters: int = 64, seed: int = 0):
+        self.centres = np.random.default_rng(seed).normal(size=(clusters, DIM)).astype(np.float32)
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+        rng = np.random.default_rng(seed)
+        if text.startswith("doc"):
+            centre = int(text[3:].split()[0])
+        else:
+            centre = int(rng.integers(len(self.centres)))
+        return self.centres[centre] + 0.5 * rng.normal(size=DIM).astype(np.float32)
+
+    def __call__(self, texts):
+        return np.stack([self._vector(text) for text in texts])
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    # Small enough to build quickly, large enough that both segments are searched through IVF
+    monkeypatch.setattr(retrieval, "ANN_MIN_ROWS", 2000)
+    engine = RetrievalEngine(ClusteredEmbedder(), index_path=str(tmp_path / "chunks.idx"), ann="ivf",
+                             nprobe=4, mode="vector")
+    for document in range(DOCUMENTS):
+        engine.add_chunks(f"doc{document}", (f"doc{document} chunk {i}" for i in range(CHUNKS_PER_DOCUMENT)))
+    return engine
+
+
+QUERIES = [f"question {i}" for i in range(40)]
+
+
+@pytest.mark.parametrize("persisted", [False, True])
+def test_filtered_search_matches_exact_search(engine, persisted):
+    if persisted:
+        engine.persist()
+        assert sum(segment.index.rows for segment in engine.segments) == DOCUMENTS * CHUNKS_PER_DOCUMENT
+    assert engine.measure_recall(QUERIES, top_k=5, document_ids=["doc3"]) == 1.0
+    for query in QUERIES:
+        results = engine.search(query, top_k=5, document_ids=["doc3"])
+        assert len(results) == 5
+        assert {result.document_id for result in results} == {"doc3"}
+
+
+@pytest.mark.parametrize("persisted", [False, True])
+def test_large_filtered_sets_probe_until_enough_rows_match(engine, monkeypatch, persisted):
+    # Forces the IVF path for filtered searches: probing must widen instead of returning nothing
+    monkeypatch.setattr(retrieval, "FILTER_EXACT_ROWS", 0)
+    if persisted:
+        engine.persist()
+    # Filtering must not cost recall compared with the same IVF searched without a filter
+    unfiltered = engine.measure_recall(QUERIES, top_k=5)
+    for documents in (["doc3"], [f"doc{d}" for d in range(0, DOCUMENTS, 2)]):
+        assert engine.measure_recall(QUERIES, top_k=5, document_ids=documents) >= unfiltered - 0.05
+        for query in QUERIES:
+            results = engine.search(query, top_k=5, document_ids=documents)
+            assert len(results) == 5
+            assert {result.document_id for result in results} <= set(documents)
+
+
+def make_engine(path: str) -> RetrievalEngine:
+    return RetrievalEngine(HashingEmbedder(), index_path=path, max_tokens=8, overlap_tokens=0)
+
+
+def persist_document(path: str, document_id: str) -> None:
+    # Runs in a worker process of its own
+    engine = make_engine(path)
+    engine.add_document(document_id, f"{document_id} " * 40)
+    engine.persist()
+
+
+def test_concurrent_workers_keep_each_others_documents(tmp_path):
+    path = str(tmp_path / "chunks.idx")
+    documents = [f"worker{i}" for i in range(8)]
+    with ProcessPoolExecutor(max_workers=4, mp_context=multiprocessing.get_context("spawn")) as pool:
+        list(pool.map(persist_document, [path] * len(documents), documents))
+    engine = make_engine(path)
+    assert all(engine.has_document(document_id) for document_id in documents)
+    assert engine.search("worker5", top_k=1, mode="bm25")[0].document_id == "worker5"
+
+
+def test_persist_appends_segments_without_rebuilding_existing_ones(tmp_path):
+    path = str(tmp_path / "chunks.idx")
+    engine, other = make_engine(path), make_engine(path)
+    engine.add_document("a", "alpha " * 40)
+    engine.persist()
+    assert engine.search("alpha", top_k=1)[0].document_id == "a"
+    (first,) = engine.segments
+    assert first.bm25 is not None
+
+    # A worker that opened the index before "a" was saved must not drop it
+    other.add_document("b", "beta " * 40)
+    other.persist()
+    engine.add_document("c", "gamma " * 40)
+    engine.persist()
+    assert [segment.index.document_ids for segment in engine.segments] == [["a"], ["b"], ["c"]]
+    assert engine.segments[0] is first
+    # Segments saved by other workers get the structures searches already use before they are swapped in
+    assert all(segment.bm25 is not None for segment in engine.segments)
+    assert engine.index.size == 0
+    assert {engine.search(word, top_k=1)[0].document_id for word in ("alpha", "beta", "gamma")} == {"a", "b", "c"}
+
+
+def test_persist_skips_documents_another_worker_saved(tmp_path):
+    path = str(tmp_path / "chunks.idx")
+    engine, other = make_engine(path), make_engine(path)
+    engine.add_document("a", "alpha " * 40)
+    other.add_document("a", "alpha " * 40)
+    engine.persist()
+    other.persist()
+    assert [segment.index.document_ids for segment in make_engine(path).segments] == [["a"]]
+    assert other.index.size == 0
+
+
+def test_removals_are_persisted_and_compacted(tmp_path):
+    path = str(tmp_path / "chunks.idx")
+    engine = make_engine(path)
+    for document in range(3):
+        engine.add_document(f"doc{document}", f"word{document} " * 40)
+        engine.persist()
+    assert len(engine.segments) == 3
+    engine.remove_document("doc1")
+    assert not engine.has_document("doc1")
+    engine.persist()
+    # A third of the documents removed: the segments are merged and the removed rows dropped
+    (segment,) = make_engine(path).segments
+    assert segment.index.document_ids == ["doc0", "doc2"]
+    assert not make_engine(path).has_document("doc1")
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("chunks.idx.")
+                and name not in ("chunks.idx.json", "chunks.idx.lock")]) == 1
+
+
+def test_removing_and_re_adding_a_persisted_document(tmp_path):
+    path = str(tmp_path / "chunks.idx")
+    engine = make_engine(path)
+    engine.add_document("a", "alpha " * 40)
+    engine.persist()
+    engine.remove_document("a")
+    assert engine.search("alpha", top_k=1) == []
+    assert engine.add_document("a", "alpha " * 40) == 0
+    assert engine.search("alpha", top_k=1)[0].document_id == "a"
+
+
+WORDS = [f"term{i}" for i in range(300)]
+
+
+def random_chunks(seed: int, count: int):
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(WORDS, size=12)) for _ in range(count)]
+
+
+@pytest.mark.parametrize("persisted", [False, True])
+def test_vector_search_returns_the_exact_top_k(tmp_path, persisted):
+    embedder = HashingEmbedder()
+    engine = RetrievalEngine(embedder, index_path=str(tmp_path / "chunks.idx"), mode="vector")
+    corpus = {f"doc{document}": random_chunks(document, 50) for document in range(4)}
+    for document_id, chunks in corpus.items():
+        engine.add_chunks(document_id, chunks)
+    if persisted:
+        engine.persist()
+    keys = [(document_id, i) for document_id, chunks in corpus.items() for i in range(len(chunks))]
+    matrix = normalize_rows(embedder([chunk for chunks in corpus.values() for chunk in chunks]))
+    # int8 rows move scores by well under a hundredth
+    tolerance = 2e-2 if persisted else 1e-5
+    for query in random_chunks(99, 20):
+        true_scores = dict(zip(keys, matrix @ normalize_rows(embedder([query]))[0]))
+        expected = sorted(true_scores.values(), reverse=True)[:5]
+        results = engine.search(query, top_k=5)
+        assert len(results) == 5
+        assert [result.score for result in results] == sorted((result.score for result in results), reverse=True)
+        for result, score in zip(results, expected):
+            assert result.text == corpus[result.document_id][result.chunk_index]
+            assert result.score == pytest.approx(true_scores[(result.document_id, result.chunk_index)], abs=tolerance)
+            assert true_scores[(result.document_id, result.chunk_index)] >= score - 2 * tolerance
+
+
+def test_hybrid_search_fuses_vector_and_keyword_rankings(tmp_path):
+    engine = RetrievalEngine(HashingEmbedder(), index_path=str(tmp_path / "chunks.idx"))
+    chunks = random_chunks(1, 60)
+    chunks[37] += " error FX-9921 raised"
+    engine.add_chunks("manual", chunks)
+    engine.add_chunks("notes", random_chunks(2, 60))
+    query = "what does FX-9921 mean"
+    depth = 3 * HYBRID_DEPTH
+    vector = engine.search(query, top_k=depth, mode="vector")
+    keyword = engine.search(query, top_k=depth, mode="bm25")
+    # Only the chunk holding the identifier matches it; the vector side has no notion of it
+    assert [(result.document_id, result.chunk_index) for result in keyword] == [("manual", 37)]
+    fused = reciprocal_rank_fusion([[(r.document_id, r.chunk_index) for r in vector],
+                                    [(r.document_id, r.chunk_index) for r in keyword]])
+    hybrid = engine.search(query, top_k=3)
+    assert [(result.document_id, result.chunk_index) for result in hybrid] == [key for key, _ in fused[:3]]
+    assert [result.score for result in hybrid] == pytest.approx([score for _, score in fused[:3]])
+    assert (hybrid[0].document_id, hybrid[0].chunk_index) == ("manual", 37)
+
+
+def test_keyword_search_spans_persisted_and_new_segments(tmp_path):
+    engine = RetrievalEngine(HashingEmbedder(), index_path=str(tmp_path / "chunks.idx"), mode="bm25")
+    engine.add_chunks("old", ["the E42 valve", "unrelated text", "more unrelated text"])
+    engine.persist()
+    engine.add_chunks("new", ["replace the E42 valve E42", "nothing here"])
+    results = engine.search("E42", top_k=5)
+    assert [(result.document_id, result.chunk_index) for result in results] == [("new", 0), ("old", 0)]
+    assert [result.document_id for result in engine.search("E42", top_k=5, document_ids=["old"])] == ["old"]
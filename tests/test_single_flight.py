@@ -0,0 +1,188 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from single_flight import FlightAbandoned, SingleFlight
+
+
+def wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class BlockingRun:
+    # Yields its first delta, then waits for the test before yielding the rest
+    def __init__(self, error: BaseException = None):
+        self.calls = 0
+        self.gate = threading.Event()
+        self.error = error
+
+    def __call__(self):
+        self.calls += 1
+        yield "one "
+        self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        yield "two"
+
+
+def follow_in_thread(flights: SingleFlight, question: str, run) -> dict:
+    outcome = {}
+
+    def follow():
+        deltas = []
+        try:
+            for delta in flights.stream("vs", question, run):
+                deltas.append(delta)
+        except BaseException as e:
+            outcome["error"] = e
+        outcome["deltas"] = deltas
+
+    thread = threading.Thread(target=follow)
+    thread.start()
+    outcome["thread"] = thread
+    return outcome
+
+
+def test_identical_questions_share_one_run():
+    flights = SingleFlight()
+    run = BlockingRun()
+    leader = flights.stream("vs", "What is X?", run)
+    assert next(leader) == "one "
+    # Normalised like the answer cache: case, spacing and trailing punctuation do not matter
+    follower = follow_in_thread(flights, "what is  x", run)
+    wait_for(lambda: flights.stats()["saved"] == 1)
+    run.gate.set()
+    assert list(leader) == ["two"]
+    follower["thread"].join(5)
+    assert follower["deltas"] == ["one ", "two"] and "error" not in follower
+    assert run.calls == 1
+    assert flights.stats() == {"runs": 1, "saved": 1, "in_flight": 0}
+
+
+def test_other_stores_and_questions_run_separately():
+    flights = SingleFlight()
+    run = BlockingRun()
+    leader = flights.stream("vs", "What is X?", run)
+    next(leader)
+    run.gate.set()
+    assert list(flights.stream("other", "What is X?", run)) == ["one ", "two"]
+    assert list(flights.stream("vs", "What is Y?", run)) == ["one ", "two"]
+    assert run.calls == 3
+    leader.close()
+
+
+def test_a_follower_that_showed_part_of_an_abandoned_answer_fails():
+    flights = SingleFlight()
+    run = BlockingRun()
+    leader = flights.stream("vs", "What is X?", run)
+    next(leader)
+    follower = follow_in_thread(flights, "What is X?", run)
+    wait_for(lambda: flights.stats()["saved"] == 1)
+    leader.close()
+    follower["thread"].join(5)
+    assert isinstance(follower["error"], FlightAbandoned)
+    assert follower["deltas"] == ["one "]
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_run_errors_reach_every_asker():
+    flights = SingleFlight()
+    run = BlockingRun(ValueError("run failed"))
+    leader = flights.stream("vs", "What is X?", run)
+    next(leader)
+    follower = follow_in_thread(flights, "What is X?", run)
+    wait_for(lambda: flights.stats()["saved"] == 1)
+    run.gate.set()
+    with pytest.raises(ValueError):
+        list(leader)
+    follower["thread"].join(5)
+    assert isinstance(follower["error"], ValueError)
+
+
+def test_forget_makes_later_questions_start_a_fresh_run():
+    flights = SingleFlight()
+    run = BlockingRun()
+    leader = flights.stream("vs", "What is X?", run)
+    next(leader)
+    flights.forget("vs")
+    run.gate.set()
+    assert list(flights.stream("vs", "What is X?", run)) == ["one ", "two"]
+    assert list(leader) == ["two"]
+    assert run.calls == 2
+
+
+async def collect(answer):
+    return [delta async for delta in answer]
+
+
+class AsyncRun:
+    def __init__(self, first_delay: float = 0.0):
+        self.calls = 0
+        self.cancelled = 0
+        self.first_delay = first_delay
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.first_delay if self.calls == 1 else 0)
+            yield "answer"
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+def test_async_run_outlives_a_cancelled_first_asker():
+    async def scenario():
+        flights = SingleFlight()
+        run = AsyncRun(first_delay=0.1)
+        first = asyncio.ensure_future(collect(flights.astream("vs", "What is X?", run)))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(collect(flights.astream("vs", "What is X?", run)))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == ["answer"]
+        return run
+
+    run = asyncio.run(scenario())
+    assert (run.calls, run.cancelled) == (1, 0)
+
+
+def test_async_run_is_cancelled_once_every_asker_has_gone():
+    async def scenario():
+        flights = SingleFlight()
+        run = AsyncRun(first_delay=10)
+        askers = [asyncio.ensure_future(collect(flights.astream("vs", "What is X?", run))) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for asker in askers:
+            asker.cancel()
+        await asyncio.gather(*askers, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        return flights, run
+
+    flights, run = asyncio.run(scenario())
+    assert (run.calls, run.cancelled) == (1, 1)
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_asker_joining_an_abandoned_run_starts_it_again():
+    async def scenario():
+        flights = SingleFlight()
+        run = AsyncRun(first_delay=10)
+        first = asyncio.ensure_future(collect(flights.astream("vs", "What is X?", run)))
+        await asyncio.sleep(0.01)
+        # The only asker leaves, which cancels the run; the next asker joins before the run has ended
+        first.cancel()
+        await asyncio.sleep(0)
+        assert flights.stats()["in_flight"] == 1
+        answer = await collect(flights.astream("vs", "What is X?", run))
+        return flights, run, answer
+
+    flights, run, answer = asyncio.run(scenario())
+    assert answer == ["answer"]
+    assert (run.calls, run.cancelled) == (2, 1)
+    assert flights.stats() == {"runs": 2, "saved": 1, "in_flight": 0}